@@ -2,89 +2,66 @@
 Main app.
 """
 
-import concurrent.futures
-import json
+import startup  # 最先导入，以便统计导入依赖的耗时
+
+import hmac
 import logging
 import logging.config
-import time
 from datetime import datetime
-from pathlib import Path
 
 import dash
 import dash_core_components as dcc
 import dash_daq as daq
 import dash_html_components as html
-import numpy as np
-import pandas as pd
-import plotly.graph_objs as go
-import plotly.express as px
-import requests
+import flask
 import yaml
-from dash.dependencies import Input, Output
-from fake_useragent import UserAgent
-from plotly.subplots import make_subplots
-import geopandas
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 
 import config
+import figure_cache
+import figures
+import geometry
+import ingest
+import jobs
+import offload
+import query
+import shared
 import utils
 
+startup.mark("导入依赖")
 with open("logging_config.yml", "r", encoding="utf8") as f:
     logging_config = yaml.safe_load(f)
 logging.config.dictConfig(logging_config)
 logger = logging.getLogger(__name__)
+startup.mark("日志配置")
 
 app = dash.Dash(__name__)
 server = app.server
-colors = ["#E51017", "#FA893A", "#307D47", "#FFFFFF"]
-virdis = [
-    "#440154",
-    "#443983",
-    "#31688e",
-    "#21918c",
-    "#35b779",
-    "#90d743",
-    "#fde725",
-]
-plasma = ["#0d0887", "#5c01a6", "#9c179e", "#cc4778", "#ed7953", "#fdb42f", "#f0f921"]
-inferno = ["#000004", "#320a5e", "#781c6d", "#bc3754", "#ed6925", "#fbb61a", "#fcffa4"]
-cividis = ["#00224e", "#2a3f6d", "#575d6d", "#7d7c78", "#a59c74", "#d2c060", "#fee838"]
-# colorscales = {
-#     "confirmed": "Reds",
-#     "suspected": "Oranges",
-#     "cured": "Greens",
-#     "dead": "gray_r",
-# }
-colorscales = {
-    "确诊": inferno,
-    "疑似": plasma,
-    "治愈": virdis,
-    "死亡": cividis,
-}
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
-
-with open("data/china_provinces_v3.geojson") as f:
-    provinces_map = json.load(f)
-with open("data/china_cities_v2.geojson") as f:
-    cities_map = json.load(f)
+startup.mark("创建 Dash 应用")
+colors = figures.colors
+# 地图边界只通过静态地址下载一次，figure 中只引用地址。第一次用到时才加载
+provinces_resource = geometry.GeometryResource("provinces", "data/china_provinces_v3.geojson")
+cities_resource = geometry.GeometryResource("cities", "data/china_cities_v2.geojson")
+geometry.register_resources(server, [provinces_resource, cities_resource])
+query.register_routes(server)
+
+
+@server.route(config.resync_url, methods=["POST"])
+def resync():
+    """手动请求全量同步，见 ingest.request_resync。"""
+    auth = flask.request.headers.get("Authorization", "")
+    if not config.admin_token or not hmac.compare_digest(auth, f"Bearer {config.admin_token}"):
+        flask.abort(403)
+    ingest.request_resync()
+    logger.info("收到全量同步请求")
+    return flask.jsonify({"status": "requested"}), 202
+
+
 with open("data/description.md", "r", encoding="utf-8") as f:
     description = f.read()
-provinces_geomap = geopandas.read_file("data/china_provinces_v3.geojson")
-provinces_list = provinces_geomap.NL_NAME_1.values  # 地图中的省份
-before24 = pd.DataFrame(
-    data={
-        "confirmed": [41, 41, 41, 45, 62, 198, 275, 291, 440, 571, 830],
-        "suspected": [0, 0, 0, 0, 0, 0, 0, 54, 37, 393, 1072],
-        "cured": [0, 0, 5, 8, 12, 17, 18, 25, 25, 25, 34],
-        "dead": [1, 1, 2, 2, 2, 3, 4, 6, 9, 17, 25],
-    },
-    index=pd.date_range("2020-1-13", "2020-1-23"),
-)
-province_data_file = Path("history_data/province_data.csv")
-city_data_file = Path("history_data/city_data.csv")
-
-# 虽然直辖市为省级，但是此处仍将其纳入市级来展示
-# 为了方便起见，台湾也计入其中
-municipalities = ["北京", "上海", "天津", "重庆", "台湾", "香港"]
+provinces_geojson = "data/china_provinces_v3.geojson"
+map_levels = ["province", "city"]
 
 app.title = f"COVID-19 疫情趋势"
 app.layout = html.Div(
@@ -234,6 +211,9 @@ app.layout = html.Div(
             ],
             type="cube",
         ),
+        # 当前数据版本的底图，切换指标时由浏览器端的 maps.recolor 重新着色，不再请求服务器
+        dcc.Store(id="province-map-base"),
+        dcc.Store(id="province-map-version"),
         html.Div(
             [
                 html.H2("市级地图"),
@@ -270,6 +250,9 @@ app.layout = html.Div(
             ],
             type="cube",
         ),
+        # 当前数据版本的底图，切换指标时由浏览器端的 maps.recolor 重新着色，不再请求服务器
+        dcc.Store(id="city-map-base"),
+        dcc.Store(id="city-map-version"),
         html.Div(
             [
                 html.H2("生成省级疫情动态变化图"),
@@ -288,20 +271,21 @@ app.layout = html.Div(
                     id="submit",
                     style={"width": "80px", "height": "43px", "marginLeft": "2%"},
                 ),
-                dcc.Loading(
-                    children=[
-                        html.Video(
-                            id="video",
-                            controls=True,
-                            style={
-                                "width": "90%",
-                                "marginLeft": "2%",
-                                "marginRight": "5%",
-                                "marginTop": "2%",
-                                "marginBottom": "2%",
-                            },
-                        ),
-                    ]
+                html.Div(id="video-status", style={"marginTop": "1%"}),
+                dcc.Store(id="video-job"),
+                dcc.Interval(
+                    id="video-poll", interval=config.video_poll_interval, disabled=True
+                ),
+                html.Video(
+                    id="video",
+                    controls=True,
+                    style={
+                        "width": "90%",
+                        "marginLeft": "2%",
+                        "marginRight": "5%",
+                        "marginTop": "2%",
+                        "marginBottom": "2%",
+                    },
                 ),
             ],
             style={"marginLeft": "3%"},
@@ -310,66 +294,6 @@ app.layout = html.Div(
 )
 
 
-def generate_province_city_datafile():
-    """生成省级和市级数据文件，这些文件用于绘制地图。"""
-    headers = {"User-Agent": utils.ua.random}
-    r = requests.get(config.apis["isaaclin_area_latest"], headers=headers)
-    r.raise_for_status()
-    res = r.json()
-    province, confirmed, suspected, cured, dead = zip(
-        *[
-            (
-                i["provinceName"].rstrip("省").rstrip("市"),
-                i["confirmedCount"],
-                i["suspectedCount"],
-                i["curedCount"],
-                i["deadCount"],
-            )
-            for i in res["results"]
-            if i["countryName"] == "中国"
-        ]
-    )
-    df = pd.DataFrame(
-        data={
-            "地区": province,
-            "确诊": confirmed,
-            "疑似": suspected,
-            "治愈": cured,
-            "死亡": dead,
-        },
-    )
-    df.to_csv(province_data_file, encoding="utf8")
-
-    cities, confirmeds, suspecteds, cureds, deads = [], [], [], [], []
-    for province in res["results"]:
-        if province["countryName"] != "中国":
-            continue
-        if province["provinceShortName"] in municipalities:
-            cities.append(province["provinceShortName"])
-            confirmeds.append(province["confirmedCount"])
-            suspecteds.append(province["suspectedCount"])
-            cureds.append(province["curedCount"])
-            deads.append(province["deadCount"])
-            continue
-        for city in province["cities"]:
-            cities.append(city["cityName"])
-            confirmeds.append(city["confirmedCount"])
-            suspecteds.append(city["suspectedCount"])
-            cureds.append(city["curedCount"])
-            deads.append(city["deadCount"])
-    cities = [utils.uniform_city_name(cn) for cn in cities]
-    df = pd.DataFrame(
-        data={
-            "地区": cities,
-            "确诊": confirmeds,
-            "疑似": suspecteds,
-            "治愈": cureds,
-            "死亡": deads,
-        },
-    )
-    df.to_csv(city_data_file, encoding="utf8")
-
-
 @app.callback(
     [
         Output("trend", "figure"),
@@ -383,137 +307,25 @@ def generate_province_city_datafile():
 )
 def update_graph_and_counts(n):
     """更新面积图、折线图和当前确诊、疑似、治愈和死亡人数。"""
-
-    future1 = executor.submit(utils.save_province_city_history)
-    future2 = executor.submit(utils.save_dxy_minutes_history)
-
-    headers = {"User-Agent": utils.ua.random}
-    r = requests.get(config.apis["isaaclin_overall_history"], headers=headers)
-    r.raise_for_status()
-    res = r.json()
-    with open(
-        f"history_data/isaaclin_overall_{datetime.now().strftime('%Y%m%d')}.json",
-        "w",
-        encoding="utf-8",
-    ) as f:
-        json.dump(res, f, ensure_ascii=False, indent=4)
-    time_, confirmed, suspected, cured, dead = zip(
-        *[
-            (
-                i["updateTime"],
-                i["confirmedCount"],
-                i["suspectedCount"],
-                i["curedCount"],
-                i["deadCount"],
-            )
-            for i in res["results"]
-        ]
-    )
-    time_ = [utils.timestamp2datetime(t / 1000) for t in time_]
-    latest_update_time = time_[0]
-    latest_confirmed = confirmed[0]
-    latest_suspected = suspected[0]
-    latest_cured = cured[0]
-    latest_dead = dead[0]
-    df = pd.DataFrame(
-        data={
-            "time": time_,
-            "confirmed": confirmed,
-            "suspected": suspected,
-            "cured": cured,
-            "dead": dead,
-        }
-    )
-    df = df.resample("D", on="time")
-    df = df.apply(lambda series: series.sort_values(ignore_index=True).iloc[-1])
-    df = df.drop(columns="time")
-    df = pd.concat([before24, df])
-
-    new_from_yesterday = df.diff(periods=1)
-
-    fig = make_subplots(
-        rows=3,
-        cols=1,
-        shared_xaxes=True,
-        subplot_titles=["确诊疑似人数堆积面积图", "治愈死亡人数折线图", "较昨日新增确诊、疑似、治愈和死亡人数折线图"],
-    )
-    trace_confirmed = go.Scatter(
-        x=df.index,
-        y=df.confirmed,
-        marker=dict(color=colors[0]),
-        mode="lines+markers",
-        hovertemplate="确诊：%{y}<extra></extra>",
-        name="确诊",
-        stackgroup="one",
-    )
-    trace_suspected = go.Scatter(
-        x=df.index,
-        y=df.suspected,
-        marker=dict(color=colors[1]),
-        mode="lines+markers",
-        hovertemplate="疑似：%{y}<extra></extra>",
-        name="疑似",
-        stackgroup="one",
-    )
-    trace_cured = go.Scatter(
-        x=df.index,
-        y=df.cured,
-        marker=dict(color=colors[2]),
-        mode="lines+markers",
-        hovertemplate="治愈：%{y}<extra></extra>",
-        name="治愈",
-    )
-    trace_dead = go.Scatter(
-        x=df.index,
-        y=df.dead,
-        marker=dict(color=colors[3]),
-        mode="lines+markers",
-        hovertemplate="死亡：%{y}<extra></extra>",
-        name="死亡",
-    )
-    trace_confirmed_new = go.Scatter(
-        x=df.index,
-        y=new_from_yesterday["confirmed"],
-        marker=dict(color=colors[0]),
-        mode="lines+markers",
-        hovertemplate="新增确诊：%{y}<extra></extra>",
-        name="较昨日新增确诊",
-    )
-    trace_suspected_new = go.Scatter(
-        x=df.index,
-        y=new_from_yesterday["suspected"],
-        marker=dict(color=colors[1]),
-        mode="lines+markers",
-        hovertemplate="新增疑似：%{y}<extra></extra>",
-        name="较昨日新增疑似",
-    )
-    trace_cured_new = go.Scatter(
-        x=df.index,
-        y=new_from_yesterday["cured"],
-        marker=dict(color=colors[2]),
-        mode="lines+markers",
-        hovertemplate="新增治愈：%{y}<extra></extra>",
-        name="较昨日新增治愈",
-    )
-    trace_dead_new = go.Scatter(
-        x=df.index,
-        y=new_from_yesterday["dead"],
-        marker=dict(color=colors[3]),
-        mode="lines+markers",
-        hovertemplate="新增死亡：%{y}<extra></extra>",
-        name="较昨日新增死亡",
-    )
-
-    fig.append_trace(trace_confirmed, 1, 1)
-    fig.append_trace(trace_suspected, 1, 1)
-    fig.append_trace(trace_dead, 2, 1)
-    fig.append_trace(trace_cured, 2, 1)
-    fig.append_trace(trace_confirmed_new, 3, 1)
-    fig.append_trace(trace_suspected_new, 3, 1)
-    fig.append_trace(trace_cured_new, 3, 1)
-    fig.append_trace(trace_dead_new, 3, 1)
-    margin = go.layout.Margin(l=100, r=100, b=50, t=25, pad=4)
-    fig["layout"].update(margin=margin, showlegend=True, template="plotly_dark")
+    snapshot = shared.get_snapshot(config.snapshot_wait_timeout)
+    if snapshot is None:
+        raise PreventUpdate
+    df = snapshot.overall
+    latest_update_time = df.time.iloc[0]
+    latest_confirmed = df.confirmed.iloc[0]
+    latest_suspected = df.suspected.iloc[0]
+    latest_cured = df.cured.iloc[0]
+    latest_dead = df.dead.iloc[0]
+    try:
+        fig = trend_figures.get(snapshot, "trend")
+    except (offload.Overloaded, offload.TaskTimeout):
+        # 数字和更新时间照常更新，只有趋势图等下一次
+        logger.warning("趋势图计算繁忙，本次不更新")
+        fig = dash.no_update
+    except Exception:
+        # 子进程中出错或者进程池损坏等，同样保留浏览器中原来的趋势图
+        logger.error("生成趋势图出错，本次不更新。", exc_info=True)
+        fig = dash.no_update
     return (
         fig,
         f'网页更新时间：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}，每 {config.update_interval // 60000} 分钟更新一次。数据实际更新时间：{latest_update_time.strftime("%Y-%m-%d %H:%M:%S")}',
@@ -524,198 +336,153 @@ def update_graph_and_counts(n):
     )
 
 
+def build_map_figure(snapshot, level):
+    """在进程池中生成省级或市级底图，见 figures.map_figure。"""
+    resource = provinces_resource if level == "province" else cities_resource
+    return offload.run(figures.map_figure, snapshot.version, level, resource.url)
+
+
+def build_trend_figure(snapshot, level):
+    """在进程池中生成趋势图，见 figures.trend_figure。level 没有用到，只是为了与 FigureCache 的约定一致。"""
+    return offload.run(figures.trend_figure, snapshot.version)
+
+
+def prewarm(snapshot):
+    trend_figures.prewarm(snapshot, ["trend"])
+    map_figures.prewarm(snapshot, map_levels)
+
+
+map_figures = figure_cache.FigureCache(build_map_figure, maxsize=config.figure_cache_size)
+trend_figures = figure_cache.FigureCache(build_trend_figure, maxsize=1)
+# 新数据到达后立即在后台生成趋势图和 2 张底图，只有拉取数据的 worker 会收到通知，其余 worker 第一次用到时生成
+shared.subscribe(prewarm)
+startup.mark("页面布局与回调")
+
+
+def update_map_base(level, known_version):
+    """数据版本变化时才把新底图发给浏览器。"""
+    snapshot = shared.get_snapshot(config.snapshot_wait_timeout)
+    if snapshot is None or snapshot.version == known_version:
+        raise PreventUpdate
+    try:
+        return map_figures.get(snapshot, level), snapshot.version
+    except (offload.Overloaded, offload.TaskTimeout):
+        logger.warning(f"{level} 底图计算繁忙，本次不更新")
+        raise PreventUpdate
+    except Exception:
+        logger.error(f"生成 {level} 底图出错，本次不更新。", exc_info=True)
+        raise PreventUpdate
+
+
 @app.callback(
-    Output("province-level-map", "figure"),
-    [Input("interval-component", "n_intervals"), Input("province-radio", "value")],
+    [Output("province-map-base", "data"), Output("province-map-version", "data")],
+    [Input("interval-component", "n_intervals")],
+    [State("province-map-version", "data")],
 )
-def update_province_map(n, selected_radio):
-    """更新省级地图。"""
-    if (
-        not province_data_file.exists()
-        or (
-            datetime.now() - datetime.fromtimestamp(province_data_file.stat().st_mtime)
-        ).seconds
-        > 3600
-    ):
-        time.sleep(3)
-        generate_province_city_datafile()
-
-    df = pd.read_csv(province_data_file, index_col=0)
-    # df = df.applymap(np.log)
-    labels = ["0", "1-9", "10-99", "100-499", "500-999", "1000-9999", "10000+"]
-    # bins 是左闭右开
-    df["确诊区间"] = pd.cut(
-        df["确诊"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    df["疑似区间"] = pd.cut(
-        df["疑似"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    df["治愈区间"] = pd.cut(
-        df["治愈"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    df["死亡区间"] = pd.cut(
-        df["死亡"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    fig = px.choropleth_mapbox(
-        df,
-        geojson=provinces_map,
-        color=f"{selected_radio}区间",
-        locations="地区",
-        featureidkey="properties.NL_NAME_1",
-        mapbox_style="carto-darkmatter",
-        color_discrete_map={
-            "0": colorscales[selected_radio][0],
-            "1-9": colorscales[selected_radio][1],
-            "10-99": colorscales[selected_radio][2],
-            "100-499": colorscales[selected_radio][3],
-            "500-999": colorscales[selected_radio][4],
-            "1000-9999": colorscales[selected_radio][5],
-            "10000+": colorscales[selected_radio][6],
-        },
-        category_orders={f"{selected_radio}区间": labels},
-        center={"lat": 35.110573, "lon": 106.493924},
-        zoom=3,
-        hover_name="地区",
-        hover_data=["确诊", "疑似", "治愈", "死亡"],
-    )
-    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-    return fig
+def update_province_map(n, known_version):
+    """更新省级底图。"""
+    return update_map_base("province", known_version)
 
 
 @app.callback(
+    [Output("city-map-base", "data"), Output("city-map-version", "data")],
+    [Input("interval-component", "n_intervals")],
+    [State("city-map-version", "data")],
+)
+def update_city_map(n, known_version):
+    """更新市级底图。"""
+    return update_map_base("city", known_version)
+
+
+# 切换指标只在浏览器端重新着色，见 assets/maps.js
+app.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="recolor"),
+    Output("province-level-map", "figure"),
+    [Input("province-radio", "value"), Input("province-map-base", "data")],
+)
+app.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="recolor"),
     Output("city-level-map", "figure"),
-    [Input("interval-component", "n_intervals"), Input("city-radio", "value")],
+    [Input("city-radio", "value"), Input("city-map-base", "data")],
 )
-def update_city_map(n, selected_radio):
-    """更新市级地图。"""
-    while (
-        not city_data_file.exists()
-        or (
-            datetime.now() - datetime.fromtimestamp(city_data_file.stat().st_mtime)
-        ).seconds
-        > 3600
-    ):
-        time.sleep(2)
-    df = pd.read_csv(city_data_file)
-    # df = df.applymap(np.log)
-    labels = ["0", "1-9", "10-99", "100-499", "500-999", "1000-9999", "10000+"]
-    # bins 是左闭右开
-    df["确诊区间"] = pd.cut(
-        df["确诊"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    df["疑似区间"] = pd.cut(
-        df["疑似"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    df["治愈区间"] = pd.cut(
-        df["治愈"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
-    )
-    df["死亡区间"] = pd.cut(
-        df["死亡"],
-        bins=[0, 1, 10, 100, 500, 1000, 10000, 100000],
-        precision=0,
-        right=False,
-        labels=labels,
+
+
+def render_video(start_date, end_date, videoname, progress):
+    fps = 30
+    dpi = 300
+    # 地图中的省份，顺序与渲染时 geopandas 读取的顺序一致
+    provinces_list = geometry.property_values(provinces_geojson, "NL_NAME_1", "original")
+    # 读取和分桶在进程池中执行，帧的渲染本来就在 render 的进程池中
+    bucket_times, values = offload.run(
+        utils.read_province_buckets,
+        provinces_list,
+        start_date,
+        end_date,
+        timeout=config.video_buckets_timeout,
     )
-    fig = px.choropleth_mapbox(
-        df,
-        geojson=cities_map,
-        color=f"{selected_radio}区间",
-        locations="地区",
-        featureidkey="properties.NAME",
-        mapbox_style="carto-darkmatter",
-        color_discrete_map={
-            "0": colorscales[selected_radio][0],
-            "1-9": colorscales[selected_radio][1],
-            "10-99": colorscales[selected_radio][2],
-            "100-499": colorscales[selected_radio][3],
-            "500-999": colorscales[selected_radio][4],
-            "1000-9999": colorscales[selected_radio][5],
-            "10000+": colorscales[selected_radio][6],
-        },
-        # color_discrete_sequence='plasma',
-        category_orders={f"{selected_radio}区间": labels},
-        center={"lat": 35.110573, "lon": 106.493924},
-        zoom=3,
-        hover_name="地区",
-        hover_data=["确诊", "疑似", "治愈", "死亡"],
+    utils.generate_video(
+        bucket_times,
+        values,
+        provinces_geojson,
+        dpi,
+        videoname,
+        fps,
+        progress,
     )
-    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-    return fig
+
+
+video_jobs = jobs.JobManager(
+    render_video, config.video_cache_dir, config.video_cache_max_bytes
+)
+
+
+@app.callback(
+    Output("video-job", "data"),
+    [Input("submit", "n_clicks")],
+    [State("date-range", "start_date"), State("date-range", "end_date")],
+)
+def submit_video(n_clicks, start_date, end_date):
+    """提交视频生成任务。"""
+    if not (n_clicks and start_date and end_date):
+        raise PreventUpdate
+    # 结束日期之后的新数据不影响视频内容，所以数据版本取水位线和结束时间中较小的那个
+    end = datetime.strptime(f"{end_date} 23:59:59", "%Y-%m-%d %H:%M:%S")
+    snapshot = shared.get_snapshot(config.snapshot_wait_timeout)
+    watermark = (snapshot.area_watermark if snapshot else None) or 0
+    data_version = min(watermark, int(end.timestamp() * 1000))
+    job_id = video_jobs.submit(start_date, end_date, data_version)
+    logger.info(f"提交视频任务 {job_id}：{start_date} 至 {end_date}")
+    return job_id
 
 
 @app.callback(
-    Output("video", "src"),
     [
-        Input("date-range", "start_date"),
-        Input("date-range", "end_date"),
-        Input("submit", "n_clicks_timestamp"),
+        Output("video", "src"),
+        Output("video-status", "children"),
+        Output("video-poll", "disabled"),
     ],
+    [Input("video-poll", "n_intervals"), Input("video-job", "data")],
 )
-def update_video(start_date, end_date, n_clicks_timestamp):
-    logger.info(f"n_clicks_timestamp={n_clicks_timestamp}")
-    latest_file = max(
-        Path("history_data/").glob("dxy_minutes*.json"), key=lambda p: p.stat().st_ctime
-    )
-    with open(latest_file, "r", encoding="utf8",) as f:
-        history = json.load(f)
-    if (
-        start_date
-        and end_date
-        and n_clicks_timestamp
-        and (n_clicks_timestamp != -1)
-        and (
-            datetime.now() - utils.timestamp2datetime(n_clicks_timestamp / 1000)
-        ).seconds
-        < 1
-    ):
-        logger.info("[开始] 更新视频")
-        fps = 30
-        dpi = 300
-        figdir = "assets/figures"
-        Path(figdir).mkdir(exist_ok=True, parents=True)
-        utils.rmfigures(figdir)
-        logger.info("[开始] 生成图片")
-        utils.generate_figures(
-            history, provinces_geomap, provinces_list, start_date, end_date, dpi, figdir
-        )
-        logger.info("[结束] 生成图片")
-        videoname = f"assets/tncg-{start_date.replace('-', '')}-{end_date.replace('-', '')}-{datetime.now().strftime('%Y%m%d%H%M%S')}.mp4"
-        logger.info("[开始] 生成视频")
-        utils.generate_video(f"{figdir}/%d.png", videoname, 30)
-        logger.info("[结束] 生成视频")
-        logger.info("[结束] 更新视频")
-        src = f"/{videoname}"
+def update_video(n, job_id):
+    """轮询视频生成任务的进度。"""
+    job = video_jobs.get(job_id) if job_id else None
+    if job is None:
+        raise PreventUpdate
+    if job.status == "done":
+        src = f"/{job.path.as_posix()}"
         logger.debug(f"src={src}")
-        return src
+        return src, "", True
+    if job.status == "failed":
+        return dash.no_update, f"视频生成失败：{job.error}", True
+    status = "排队中 ..." if job.status == "queued" else f"生成中 {job.progress:.0%} ..."
+    return dash.no_update, status, False
+
 
+startup.mark("其余回调")
+startup.report()
 
 if __name__ == "__main__":
+    # 只在提供服务的进程中开始拉取或读取共享的快照，见 shared.py。gunicorn 下由 config.post_worker_init 启动，
+    # 以 spawn 方式启动的进程池子进程会以 __mp_main__ 重新导入本文件，不能在导入时启动
+    shared.start()
     app.run_server(host="0.0.0.0", port=9102, debug=False)
@@ -0,0 +1,22 @@
+// 地图指标切换。服务器只在数据版本变化时发送一次底图（见 app.py 中的 build_map_figure），
+// 4 种指标的区间编号和配色都在 layout.meta.metrics 中，这里只换掉 z 和配色，不再请求服务器。
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    maps: {
+        recolor: function (metric, base) {
+            if (!base) {
+                return {data: [], layout: {}};
+            }
+            var spec = base.layout.meta.metrics[metric];
+            var trace = Object.assign({}, base.data[0], {
+                z: spec.z,
+                zmax: spec.zmax,
+                colorscale: spec.colorscale,
+                colorbar: Object.assign({}, base.data[0].colorbar, {
+                    tickvals: spec.labels.map(function (_, i) { return i; }),
+                    ticktext: spec.labels
+                })
+            });
+            return {data: [trace], layout: base.layout};
+        }
+    }
+});
@@ -0,0 +1,71 @@
+"""
+离线生成简化后的地图边界文件。
+
+用法：
+
+    python build_geometry.py [--levels low medium high]
+
+对 config.geometry_sources 中的每个文件，按 config.geometry_levels 中的每个级别生成一份简化文件，
+并输出每个级别的文件大小、顶点数变化、json.load 得到的 dict 和 CompactGeometry 占用的内存，
+以及简化后不合法（自相交等，见 geometry.invalid_features）的 feature 数。有不合法的 feature 时以状态 1 退出。
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import config
+import geometry
+
+
+def build(source, level):
+    tolerance, digits = config.geometry_levels[level]
+    with open(source, encoding="utf8") as f:
+        original = json.load(f)
+    simplified = geometry.simplify_geojson(original, tolerance, digits)
+    target = geometry.simplified_path(source, level)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(target, "w", encoding="utf8") as f:
+        json.dump(simplified, f, ensure_ascii=False, separators=(",", ":"))
+    return (
+        Path(source).stat().st_size,
+        target.stat().st_size,
+        geometry.count_vertices(original),
+        geometry.count_vertices(simplified),
+        geometry.footprint(simplified),
+        len(geometry.invalid_features(simplified)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成简化后的地图边界文件")
+    parser.add_argument(
+        "--levels",
+        nargs="+",
+        default=list(config.geometry_levels),
+        choices=list(config.geometry_levels),
+    )
+    args = parser.parse_args()
+    print(
+        f"{'文件':<40}{'级别':<8}{'大小':>24}{'顶点数':>24}{'内存 dict -> 数组':>24}{'不合法':>8}"
+    )
+    invalid = 0
+    for source in config.geometry_sources:
+        for level in args.levels:
+            size, new_size, vertices, new_vertices, (as_dict, as_arrays), bad = build(source, level)
+            invalid += bad
+            print(
+                f"{Path(source).name:<40}{level:<8}"
+                f"{size / 1024:>9.0f}K -> {new_size / 1024:>6.0f}K ({new_size / size:>4.0%})"
+                f"{vertices:>9} -> {new_vertices:>6} ({new_vertices / vertices:>4.0%})"
+                f"{as_dict / 1024:>9.0f}K -> {as_arrays / 1024:>6.0f}K ({as_arrays / as_dict:>4.0%})"
+                f"{bad:>8}"
+            )
+    if invalid:
+        print(f"有 {invalid} 个简化后不合法的 feature", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+只读的内存映射数据文件。
+
+文件由一个 JSON 头和若干按 64 字节对齐的数组组成：
+
+    MAGIC(8 字节) | 头长度(8 字节，小端) | JSON 头 | 填充 | 数组 1 | 填充 | 数组 2 ...
+
+JSON 头中的 meta 为任意可序列化为 JSON 的元数据，arrays 记录每个数组的 dtype、shape 和偏移。
+读取时用 mmap 映射整个文件，数组由 np.frombuffer 直接指向映射的内存，不做拷贝，
+多个进程映射同一个文件时共享同一份物理内存（页缓存）。
+
+文件总是写到临时文件后重命名，读者持有的旧映射在重命名后仍然有效。
+比较 stamp（inode 和修改时间）即可判断文件是否已被替换，只需一次 stat。
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import refresh
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NCOVBDL1"
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def stamp(path):
+    """返回 (inode, 修改时间, 大小)，文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def write_bundle(path, meta, arrays):
+    """把 meta 和 arrays（名称 -> numpy 数组）原子地写入 path。"""
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        if a.dtype.hasobject:
+            raise TypeError(f"数组 {name} 的 dtype {a.dtype} 不能写入共享文件")
+        offset = _align(offset)
+        layout[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset += a.nbytes
+    header = json.dumps({"meta": meta, "arrays": layout}, ensure_ascii=False).encode("utf8")
+    base = _align(len(MAGIC) + 8 + len(header))
+
+    def write(tmpname):
+        with open(tmpname, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name, a in arrays.items():
+                f.seek(base + layout[name]["offset"])
+                f.write(a.data)
+            # 末尾的空数组也要落在文件范围内
+            f.truncate(base + offset)
+
+    refresh.atomic_write(path, write)
+    logger.debug(f"写入 {path}，{len(arrays)} 个数组，共 {base + offset} 字节")
+
+
+class Bundle:
+    """映射一个由 write_bundle 写出的文件。meta 为元数据，arrays 为只读的 numpy 数组。"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.stamp = st.st_ino, st.st_mtime_ns, st.st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} 不是共享数据文件")
+        (length,) = struct.unpack("<Q", self._mmap[len(MAGIC) : len(MAGIC) + 8])
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start : start + length].decode("utf8"))
+        base = _align(start + length)
+        self.meta = header["meta"]
+        self.arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            count = int(np.prod(shape, dtype=np.int64))
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=base + spec["offset"]
+            ).reshape(shape)
@@ -1,4 +1,77 @@
+import os
+
 update_interval = 60 * 60 * 1000  # ms
+# 后台拉取数据的间隔，以及拉取失败后的重试间隔。
+# 平时只拉取增量（latest=1），所以间隔可以比页面更新间隔短得多
+ingest_interval = 5 * 60  # s
+ingest_retry_interval = 60  # s
+# 距上次成功拉取超过 resync_gap 说明中间可能漏了数据，需要全量同步（latest=0）；
+# 另外每隔 full_resync_interval 也做一次全量同步
+resync_gap = 3 * ingest_interval  # s
+# 省市数据文件在这段时间内有效，拉取数据以外的读取者在文件有效时直接读取，不再请求上游。
+# 拉取数据只在 leader 中进行，每轮都会重新请求
+data_file_max_age = ingest_interval  # s
+full_resync_interval = 24 * 60 * 60  # s
+# 回调函数等待第一份快照的最长时间，超时则本次不更新
+snapshot_wait_timeout = 60  # s
+# 地图底图缓存的最大数量，省级和市级各 1 张，指标切换在浏览器端完成
+figure_cache_size = 2
+# 地图分级区间的划分方式，fixed 使用 bin_edges，quantile 按各指标的分位数划分为 bin_count 个区间。
+# 区间左闭右开，最后一个区间没有上界。区间数不能超过配色的颜色数（7）
+bin_mode = "fixed"
+bin_edges = [0, 1, 10, 100, 500, 1000, 10000]
+bin_count = 7
+# 生成动态变化图时每一帧覆盖的时间范围
+bucket_width = 30 * 60  # s
+# 渲染动态变化图的进程数和进程启动方式。gevent 下 fork 出的子进程状态不可靠，所以默认使用 spawn
+render_workers = os.cpu_count() or 1
+render_start_method = "spawn"
+# 生成好的视频缓存在 assets 下，以便直接访问，总大小超过上限时删除最久未使用的视频
+video_cache_dir = "assets/videos"
+video_cache_max_bytes = 2 * 1024 ** 3
+# 按天编码的视频分段缓存，扩大日期范围时只需生成新增的分段
+segment_cache_dir = "history_data/segments"
+segment_cache_max_bytes = 2 * 1024 ** 3
+# 页面轮询视频生成进度的间隔
+video_poll_interval = 2000  # ms
+# 帧渲染器，matplotlib 或 raster，见 render.py
+frame_renderer = "raster"
+# 回调中 CPU 密集计算的进程池，见 offload.py：进程数、排队任务数上限（超过则放弃本次更新）和每个任务的超时
+offload_workers = 2
+offload_max_pending = 8
+offload_timeout = 30  # s
+# 生成视频前读取历史数据并分桶的超时
+video_buckets_timeout = 5 * 60  # s
+# 多个 worker 共享快照的目录，以及非 leader 的 worker 尝试接替拉取数据的间隔，见 shared.py
+shared_dir = "history_data/shared"
+leader_retry_interval = 30  # s
+# 历史数据存储目录，见 history_store.py
+history_store_dir = "history_data/store"
+# 地图边界简化级别：级别名 -> (简化容差（度）, 坐标保留的小数位数)。
+# 在 zoom=3 时一个像素约为 0.18 度，所以较大的容差在地图上也看不出差别。
+# 先运行 python build_geometry.py 生成简化文件，geometry_level 为 original 时使用原始文件。
+geometry_sources = ["data/china_provinces_v3.geojson", "data/china_cities_v2.geojson"]
+geometry_levels = {
+    "high": (0.002, 4),
+    "medium": (0.01, 3),
+    "low": (0.03, 2),
+}
+geometry_level = "medium"
+# 地图边界静态文件的地址前缀
+geometry_url_prefix = "/geometry"
+# 手动请求全量同步的地址（POST），请求头需带上 Authorization: Bearer <token>，token 放在 .admintoken 文件中，
+# 没有这个文件时不接受请求
+resync_url = "/admin/resync"
+admin_token = None
+if os.path.exists(".admintoken"):
+    with open(".admintoken", "r") as f:
+        admin_token = f.read().strip()
+# 时间序列查询接口的地址前缀，见 query.py
+query_url_prefix = "/api/series"
+# 全球时间序列查询接口的地址前缀，数据来自 JHU（见 jhu.py）
+global_url_prefix = "/api/global"
+# 查询接口支持的降采样粒度，取每个区间内的最后一条记录，None 表示不降采样，s
+query_resolutions = {"raw": None, "hour": 60 * 60, "day": 24 * 60 * 60}
 # 2020年3月19日更新：此接口已不可用。网友自制的全国新型肺炎疫情实时数据接口：https://lab.isaaclin.cn/nCoV/
 apis = {
     "qq": "https://service-n9zsbooc-1252957949.gz.apigw.tencentcs.com/release/qq",
@@ -14,13 +87,40 @@ apis = {
     "JHU_CSSE_DEATHS": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv",
     "JHU_CSSE_CURED": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv",
 }
+# 每轮拉取并发请求的线程数，以及同一 host 的最大并发请求数，见 fanout.py
+fanout_workers = 16
+fanout_per_host = 4
+# 全量同步时额外拉取的数据源，它们都是按天更新的。
+# qq_province 和 qq_province_city 分别对每个省、每个城市发一个请求，后者请求数很多，默认不拉取
+extra_sources = ["qq_province", "JHU_CSSE_CONFIRMED", "JHU_CSSE_DEATHS", "JHU_CSSE_CURED"]
+# JHU 原始 CSV 文件的保存目录
+jhu_data_dir = "history_data/jhu"
+jhu_chunk_rows = 1000  # 按块读取 JHU CSV 时每块的行数，每块都要为每个日期列建一个 Series，太小反而慢
+# 上游接口的 HTTP 客户端设置，见 http_client.py
+user_agent = "Mozilla/5.0 (compatible; 2019-nCoV-dash; +https://github.com/secsilm/2019-nCoV-dash)"
+http_timeout = (5, 30)  # (连接超时, 读取超时)，s
+http_pool_size = 10  # 每个 host 的最大连接数
+http_retries = 3
+http_backoff = 1  # 第一次重试前的基础等待时间，之后每次翻倍，s
+# 连续失败 breaker_threshold 次后熔断，breaker_reset_timeout 秒后再试
+breaker_threshold = 5
+breaker_reset_timeout = 5 * 60  # s
 # You may not have to use mapboxtoken. It depends on what mapbox style you use.
 # For more information, please see https://plot.ly/python/mapbox-layers/
 # If you have to use it, you can create a file named .mapboxtoken and
-# put your token in it.
-with open(".mapboxtoken", "r") as f:
-    token = f.read()
+# put your token in it. Without the file token is None.
+token = None
+if os.path.exists(".mapboxtoken"):
+    with open(".mapboxtoken", "r") as f:
+        token = f.read()
 
+# 地区名称以地图边界中的名称为准，见 regions.py。{级别: (地图边界文件, 名称属性)}
+region_sources = {
+    "province": ("data/china_provinces_v3.geojson", "NL_NAME_1"),
+    "city": ("data/china_cities_v2.geojson", "NAME"),
+}
+region_min_length = 2  # 去掉后缀和前缀匹配时名称至少保留的字数
+# 上游名称 -> 地图中的名称，用于去掉后缀和前缀匹配都对应不上的地区
 replace_map = {
     "乐东": "乐东黎族自治县",
     "伊犁州": "伊犁哈萨克自治州",
@@ -54,10 +154,13 @@ replace_map = {
     "巴州": "巴音郭楞蒙古自治州",
 }
 
-exceptions = []
+region_aliases = {"city": replace_map}  # 各级别的别名
+
+exceptions = []  # 不去掉后缀的名称
 
 # gunicorn config
-workers = 1
+# 只有一个 worker 拉取数据，快照和地图边界通过共享文件映射，增加 worker 不会成倍增加内存和上游请求
+workers = 4
 # threads = 4
 bind = "0.0.0.0:9102"
 worker_class = "gevent"
@@ -68,3 +171,10 @@ accesslog = "log/gunicorn_access.log"
 errorlog = "log/gunicorn_error.log"
 daemon = True
 pidfile = "gunicorn.pid"
+
+
+def post_worker_init(worker):
+    """worker 加载完 app 之后开始拉取或读取共享的快照，只有一个 worker 拉取数据，见 shared.py。"""
+    import shared
+
+    shared.start()
@@ -0,0 +1,74 @@
+"""
+全国累计数据的按天汇总，用于趋势图。
+
+新数据到达时只更新它所在的日期，以及这些日期和后一天的较昨日新增，不再每次对全部历史重新 resample。
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+metrics = ["confirmed", "suspected", "cured", "dead"]
+
+# 接口开始提供数据之前的每日数据
+early_days = pd.DataFrame(
+    data={
+        "confirmed": [41, 41, 41, 45, 62, 198, 275, 291, 440, 571, 830],
+        "suspected": [0, 0, 0, 0, 0, 0, 0, 54, 37, 393, 1072],
+        "cured": [0, 0, 5, 8, 12, 17, 18, 25, 25, 25, 34],
+        "dead": [1, 1, 2, 2, 2, 3, 4, 6, 9, 17, 25],
+    },
+    index=pd.date_range("2020-1-13", "2020-1-23"),
+)
+
+
+class DailyAggregate:
+    """每天每项指标取当天的最大值，累计数只增不减，所以也就是当天最后的值。
+
+    table 的索引为连续的日期，没有数据的日期为 NaN；diff 为较前一天的新增。
+    """
+
+    def __init__(self, base=None):
+        self._base = base
+        self.reset()
+
+    def reset(self):
+        self.table = pd.DataFrame(columns=metrics, dtype=float)
+        self.diff = pd.DataFrame(columns=metrics, dtype=float)
+        if self._base is not None:
+            self.update_days(self._base[metrics])
+
+    def update(self, df):
+        """合并 df 中的记录，df 需包含 time 列（datetime）和 metrics 中的各列。返回受影响的日期。"""
+        if df.empty:
+            return pd.DatetimeIndex([])
+        days = pd.DatetimeIndex(df["time"]).floor("D")
+        return self.update_days(df[metrics].groupby(days).max())
+
+    def update_days(self, new):
+        """new 为按天汇总好的数据，索引为日期。"""
+        new = new.astype(float)
+        table = self.table
+        index = table.index.union(new.index)
+        if len(index):
+            index = pd.date_range(index[0], index[-1], freq="D")
+        if not index.equals(table.index):
+            table = table.reindex(index)
+            self.diff = self.diff.reindex(index)
+        old = table.loc[new.index].to_numpy()
+        table.loc[new.index] = np.fmax(old, new.to_numpy())
+        self.table = table
+        # 只需重算受影响的日期和它们后一天的新增
+        positions = index.get_indexer(new.index)
+        positions = np.unique(np.concatenate([positions, positions + 1]))
+        positions = positions[positions < len(index)]
+        values = table.to_numpy()
+        previous = np.where(
+            (positions > 0)[:, None], values[np.maximum(positions - 1, 0)], np.nan
+        )
+        self.diff.iloc[positions] = values[positions] - previous
+        logger.debug(f"更新了 {len(new)} 天的数据，共 {len(index)} 天")
+        return new.index
@@ -0,0 +1,61 @@
+"""
+并发执行一轮数据拉取中的所有请求。
+
+每个请求是一个 Task，同一 host 的并发数有上限。每个 Task 完成后立即处理它的结果，
+一轮拉取的耗时取决于最慢的那个请求，而不是所有请求耗时之和。
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# name 用于日志和结果的键，url 用于确定 host，run 为无参数的函数，负责请求并解析、保存结果
+Task = namedtuple("Task", ["name", "url", "run"])
+
+
+def run_all(tasks, max_workers=None, per_host=None):
+    """并发执行 tasks，返回 {name: 返回值或异常}。"""
+    max_workers = max_workers or config.fanout_workers
+    per_host = per_host or config.fanout_per_host
+    semaphores = {
+        urlsplit(t.url).netloc: threading.BoundedSemaphore(per_host) for t in tasks
+    }
+    latencies = {}
+
+    def call(task):
+        with semaphores[urlsplit(task.url).netloc]:
+            start = time.time()
+            try:
+                return task.run()
+            finally:
+                latencies[task.name] = time.time() - start
+
+    results = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(call, t): t for t in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                results[task.name] = future.result()
+                logger.debug(f"{task.name} 完成，耗时 {latencies[task.name]:.2f}s")
+            except Exception as e:
+                results[task.name] = e
+                logger.error(
+                    f"{task.name} 出错，耗时 {latencies.get(task.name, 0):.2f}s：{e}",
+                    exc_info=True,
+                )
+    elapsed = time.time() - start
+    slowest = max(latencies, key=latencies.get) if latencies else None
+    logger.info(
+        f"{len(tasks)} 个请求共耗时 {elapsed:.2f}s，逐个请求耗时之和 {sum(latencies.values()):.2f}s，"
+        f"最慢的是 {slowest}（{latencies.get(slowest, 0):.2f}s）"
+    )
+    return results
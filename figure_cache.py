@@ -0,0 +1,91 @@
+"""
+figure 缓存。
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """一次正在进行的生成，同一个键的其他请求等待它的结果。"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FigureCache:
+    """以 (数据版本, 级别) 为键缓存 figure。
+
+    builder 的签名为 builder(snapshot, level)。数据版本更新后旧版本的 figure 全部清除，
+    缓存数量超过 maxsize 时淘汰最久未使用的那个。
+    同一个键同时只生成一次，其余请求等待这次生成的结果（包括异常）。
+    """
+
+    def __init__(self, builder, maxsize=2):
+        self._builder = builder
+        self._maxsize = maxsize
+        self._figures = OrderedDict()
+        self._building = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, snapshot, level):
+        key = (snapshot.version, level)
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                return self._figures[key]
+            flight = self._building.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._building[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._builder(snapshot, level)
+            self._put(key, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._building[key]
+            flight.done.set()
+
+    def _put(self, key, fig):
+        version = key[0]
+        with self._lock:
+            if self._version is not None and version < self._version:
+                # 旧快照生成的 figure 不再缓存
+                return
+            if version != self._version:
+                logger.debug(f"数据版本变为 {version}，清除 {len(self._figures)} 张旧 figure")
+                self._figures.clear()
+                self._version = version
+            self._figures[key] = fig
+            while len(self._figures) > self._maxsize:
+                self._figures.popitem(last=False)
+
+    def prewarm(self, snapshot, keys):
+        """预先生成 keys 中所有级别对应的 figure。"""
+        logger.info(f"[开始] 预生成版本 {snapshot.version} 的 {len(keys)} 张 figure")
+        for level in keys:
+            try:
+                self.get(snapshot, level)
+            except Exception:
+                logger.error(f"生成 figure {level} 出错。", exc_info=True)
+        logger.info(f"[结束] 预生成版本 {snapshot.version} 的 figure")
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self._version = None
@@ -0,0 +1,197 @@
+"""
+趋势图和地图的 figure。
+
+这里的函数不依赖 app.py，可以在 offload 的进程池中执行。以 _figure 结尾的函数只接收数据版本号，
+在子进程中从共享文件读取快照（见 shared.py），返回 figure 的 dict，避免在进程间传递 DataFrame。
+"""
+
+import plotly.graph_objs as go
+from plotly.subplots import make_subplots
+
+import shared
+
+colors = ["#E51017", "#FA893A", "#307D47", "#FFFFFF"]
+virdis = [
+    "#440154",
+    "#443983",
+    "#31688e",
+    "#21918c",
+    "#35b779",
+    "#90d743",
+    "#fde725",
+]
+plasma = ["#0d0887", "#5c01a6", "#9c179e", "#cc4778", "#ed7953", "#fdb42f", "#f0f921"]
+inferno = ["#000004", "#320a5e", "#781c6d", "#bc3754", "#ed6925", "#fbb61a", "#fcffa4"]
+cividis = ["#00224e", "#2a3f6d", "#575d6d", "#7d7c78", "#a59c74", "#d2c060", "#fee838"]
+# colorscales = {
+#     "confirmed": "Reds",
+#     "suspected": "Oranges",
+#     "cured": "Greens",
+#     "dead": "gray_r",
+# }
+colorscales = {
+    "确诊": inferno,
+    "疑似": plasma,
+    "治愈": virdis,
+    "死亡": cividis,
+}
+
+
+def _snapshot(version):
+    snapshot = shared.read_snapshot()
+    if snapshot is None or snapshot.version < version:
+        raise RuntimeError(f"共享文件中没有版本 {version} 的快照")
+    return snapshot
+
+
+def build_trend_figure(snapshot):
+    """面积图、折线图和较昨日新增折线图。"""
+    # 每日值和较昨日新增在拉取数据时已增量更新，见 daily.py
+    df = snapshot.daily
+    new_from_yesterday = snapshot.daily_diff
+    fig = make_subplots(
+        rows=3,
+        cols=1,
+        shared_xaxes=True,
+        subplot_titles=["确诊疑似人数堆积面积图", "治愈死亡人数折线图", "较昨日新增确诊、疑似、治愈和死亡人数折线图"],
+    )
+    trace_confirmed = go.Scatter(
+        x=df.index,
+        y=df.confirmed,
+        marker=dict(color=colors[0]),
+        mode="lines+markers",
+        hovertemplate="确诊：%{y}<extra></extra>",
+        name="确诊",
+        stackgroup="one",
+    )
+    trace_suspected = go.Scatter(
+        x=df.index,
+        y=df.suspected,
+        marker=dict(color=colors[1]),
+        mode="lines+markers",
+        hovertemplate="疑似：%{y}<extra></extra>",
+        name="疑似",
+        stackgroup="one",
+    )
+    trace_cured = go.Scatter(
+        x=df.index,
+        y=df.cured,
+        marker=dict(color=colors[2]),
+        mode="lines+markers",
+        hovertemplate="治愈：%{y}<extra></extra>",
+        name="治愈",
+    )
+    trace_dead = go.Scatter(
+        x=df.index,
+        y=df.dead,
+        marker=dict(color=colors[3]),
+        mode="lines+markers",
+        hovertemplate="死亡：%{y}<extra></extra>",
+        name="死亡",
+    )
+    trace_confirmed_new = go.Scatter(
+        x=df.index,
+        y=new_from_yesterday["confirmed"],
+        marker=dict(color=colors[0]),
+        mode="lines+markers",
+        hovertemplate="新增确诊：%{y}<extra></extra>",
+        name="较昨日新增确诊",
+    )
+    trace_suspected_new = go.Scatter(
+        x=df.index,
+        y=new_from_yesterday["suspected"],
+        marker=dict(color=colors[1]),
+        mode="lines+markers",
+        hovertemplate="新增疑似：%{y}<extra></extra>",
+        name="较昨日新增疑似",
+    )
+    trace_cured_new = go.Scatter(
+        x=df.index,
+        y=new_from_yesterday["cured"],
+        marker=dict(color=colors[2]),
+        mode="lines+markers",
+        hovertemplate="新增治愈：%{y}<extra></extra>",
+        name="较昨日新增治愈",
+    )
+    trace_dead_new = go.Scatter(
+        x=df.index,
+        y=new_from_yesterday["dead"],
+        marker=dict(color=colors[3]),
+        mode="lines+markers",
+        hovertemplate="新增死亡：%{y}<extra></extra>",
+        name="较昨日新增死亡",
+    )
+
+    fig.append_trace(trace_confirmed, 1, 1)
+    fig.append_trace(trace_suspected, 1, 1)
+    fig.append_trace(trace_dead, 2, 1)
+    fig.append_trace(trace_cured, 2, 1)
+    fig.append_trace(trace_confirmed_new, 3, 1)
+    fig.append_trace(trace_suspected_new, 3, 1)
+    fig.append_trace(trace_cured_new, 3, 1)
+    fig.append_trace(trace_dead_new, 3, 1)
+    margin = go.layout.Margin(l=100, r=100, b=50, t=25, pad=4)
+    fig["layout"].update(margin=margin, showlegend=True, template="plotly_dark")
+    return fig
+
+
+def build_map_figure(snapshot, level, geojson):
+    """根据快照生成省级或市级底图，level 取值为 province 或 city，geojson 为地图边界的地址。
+
+    4 种指标的区间编号、标签和配色都放在 layout.meta 中，切换指标时由 assets/maps.js 换掉 z 和配色。
+    """
+    if level == "province":
+        df, featureidkey = snapshot.province_df, "properties.NL_NAME_1"
+    else:
+        df, featureidkey = snapshot.city_df, "properties.NAME"
+    meta = {}
+    for metric, colors_ in colorscales.items():
+        # 区间编号已在 metrics.derive 中算好，这里只需生成离散的配色
+        _, labels = snapshot.bins[level][metric]
+        n = len(labels)
+        colorscale = []
+        for i, color in enumerate(colors_[:n]):
+            colorscale += [[i / n, color], [(i + 1) / n, color]]
+        meta[metric] = {
+            "z": df[f"{metric}区间"].tolist(),
+            "labels": list(labels),
+            "colorscale": colorscale,
+            "zmax": n - 0.5,
+        }
+    default = meta["确诊"]
+    fig = go.Figure(
+        go.Choroplethmapbox(
+            geojson=geojson,
+            featureidkey=featureidkey,
+            locations=df["地区"],
+            z=default["z"],
+            zmin=-0.5,
+            zmax=default["zmax"],
+            colorscale=default["colorscale"],
+            colorbar={
+                "tickvals": list(range(len(default["labels"]))),
+                "ticktext": default["labels"],
+            },
+            marker_line_width=0.5,
+            customdata=df[["确诊", "疑似", "治愈", "死亡"]].to_numpy(),
+            hovertemplate="<b>%{location}</b><br>"
+            "确诊=%{customdata[0]}<br>疑似=%{customdata[1]}<br>"
+            "治愈=%{customdata[2]}<br>死亡=%{customdata[3]}<extra></extra>",
+        )
+    )
+    fig.update_layout(
+        mapbox_style="carto-darkmatter",
+        mapbox_center={"lat": 35.110573, "lon": 106.493924},
+        mapbox_zoom=3,
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        meta={"metrics": meta},
+    )
+    return fig
+
+
+def trend_figure(version):
+    return build_trend_figure(_snapshot(version)).to_dict()
+
+
+def map_figure(version, level, geojson):
+    return build_map_figure(_snapshot(version), level, geojson).to_dict()
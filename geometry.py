@@ -0,0 +1,625 @@
+"""
+地图边界的简化、加载和发布。
+
+简化后的 GeoJSON 由 build_geometry.py 离线生成，放在 data/simplified 中，文件名形如
+china_provinces_v3.medium.geojson。运行时通过 load_compact 读取 config.geometry_level
+指定的版本，找不到时退回原始文件。
+
+地图边界通过 GeometryResource 以带版本号的静态地址发布，figure 中只引用这个地址，
+浏览器下载一次后即可长期缓存。
+
+内存中的地图边界为 CompactGeometry：坐标保存在连续的 NumPy 数组中，只在需要时才生成 GeoJSON。
+CompactGeometry 和压缩好的响应内容以共享数据文件（见 bundle.py）缓存在 data/cache 中，
+以源文件内容的哈希为键，源文件不变时启动不必重新解析和压缩，多个 worker 映射同一份坐标数组。
+所有加载都推迟到第一次用到时进行。
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import sys
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+import flask
+import numpy as np
+
+import bundle
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+simplified_dir = Path("data/simplified")
+cache_dir = Path("data/cache")
+
+
+def simplified_path(path, level):
+    path = Path(path)
+    return simplified_dir / f"{path.stem}.{level}{path.suffix}"
+
+
+def geojson_path(path, level=None):
+    """返回 level 对应的 GeoJSON 文件路径，level 为 original 或文件不存在时返回原始文件。"""
+    level = level or config.geometry_level
+    if level == "original":
+        return Path(path)
+    target = simplified_path(path, level)
+    if not target.exists():
+        logger.warning(f"{target} 不存在，使用原始文件 {path}，可运行 build_geometry.py 生成")
+        return Path(path)
+    return target
+
+
+_digests = {}  # 源文件 -> (bundle.stamp, 内容哈希)
+
+
+def _digest(path):
+    """源文件内容的哈希，文件的 inode、修改时间和大小都没变时不重新计算。"""
+    path = str(path)
+    current = bundle.stamp(path)
+    cached = _digests.get(path)
+    if cached is None or cached[0] != current:
+        cached = _digests[path] = (current, hashlib.sha1(Path(path).read_bytes()).hexdigest()[:12])
+    return cached[1]
+
+
+def _cache_target(source, kind, digest):
+    """source 的 kind 产物在 cache_dir 中的路径，同时删除同一产物的旧版本。"""
+    target = cache_dir / f"{source.stem}.{kind}.{digest}.bin"
+    for old in cache_dir.glob(f"{source.stem}.{kind}.*.bin"):
+        if old != target:
+            old.unlink()
+    return target
+
+
+def deep_sizeof(obj):
+    """递归估算 json.load 得到的对象占用的内存，用于和 CompactGeometry 对比。"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, list):
+        size += sum(deep_sizeof(v) for v in obj)
+    return size
+
+
+class CompactGeometry:
+    """以连续的 NumPy 数组保存 FeatureCollection 中的坐标。
+
+    coords 为 (点数, 2) 的 float64 数组。ring_offsets[i]:ring_offsets[i + 1] 为第 i 个环的点，
+    part_offsets[j]:part_offsets[j + 1] 为第 j 个多边形的环，
+    feature_offsets[k]:feature_offsets[k + 1] 为第 k 个 feature 的多边形。
+    kinds 为每个 feature 的几何类型，见 kind_names。properties 为 {列名: 每个 feature 的值}，
+    extra 为 FeatureCollection 中除 type 和 features 之外的字段（如 crs）。
+    """
+
+    kind_names = [None, "Polygon", "MultiPolygon"]
+
+    def __init__(
+        self, coords, ring_offsets, part_offsets, feature_offsets, kinds, properties, extra=None
+    ):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.part_offsets = part_offsets
+        self.feature_offsets = feature_offsets
+        self.kinds = kinds
+        self.properties = properties
+        self.extra = extra or {}
+
+    @classmethod
+    def from_geojson(cls, geojson):
+        rings, ring_offsets, part_offsets, feature_offsets, kinds = [], [0], [0], [0], []
+        columns = {}
+        features = geojson["features"]
+        for k, feature in enumerate(features):
+            for key, value in (feature.get("properties") or {}).items():
+                columns.setdefault(key, [None] * len(features))[k] = value
+            geometry = feature.get("geometry")
+            kind = cls.kind_names.index(geometry["type"] if geometry else None)
+            kinds.append(kind)
+            polygons = []
+            if kind == 1:
+                polygons = [geometry["coordinates"]]
+            elif kind == 2:
+                polygons = geometry["coordinates"]
+            for polygon in polygons:
+                for ring in polygon:
+                    ring = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+                    rings.append(ring)
+                    ring_offsets.append(ring_offsets[-1] + len(ring))
+                part_offsets.append(len(ring_offsets) - 1)
+            feature_offsets.append(len(part_offsets) - 1)
+        coords = np.concatenate(rings) if rings else np.zeros((0, 2))
+        return cls(
+            coords,
+            np.asarray(ring_offsets, dtype=np.int64),
+            np.asarray(part_offsets, dtype=np.int64),
+            np.asarray(feature_offsets, dtype=np.int64),
+            np.asarray(kinds, dtype=np.int8),
+            columns,
+            {k: v for k, v in geojson.items() if k not in ("type", "features")},
+        )
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def nbytes(self):
+        """坐标和偏移数组的字节数加上属性表的估算大小。"""
+        arrays = [self.coords, self.ring_offsets, self.part_offsets, self.feature_offsets, self.kinds]
+        return sum(a.nbytes for a in arrays) + deep_sizeof(self.properties)
+
+    def to_geojson(self):
+        points = self.coords.tolist()
+        ring_offsets = self.ring_offsets.tolist()
+        part_offsets = self.part_offsets.tolist()
+        feature_offsets = self.feature_offsets.tolist()
+        columns = list(self.properties.items())
+        features = []
+        for k, kind in enumerate(self.kinds.tolist()):
+            polygons = [
+                [points[ring_offsets[r] : ring_offsets[r + 1]] for r in range(part_offsets[j], part_offsets[j + 1])]
+                for j in range(feature_offsets[k], feature_offsets[k + 1])
+            ]
+            if kind == 0:
+                geometry = None
+            else:
+                coordinates = polygons[0] if kind == 1 else polygons
+                geometry = {"type": self.kind_names[kind], "coordinates": coordinates}
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": {key: values[k] for key, values in columns},
+                    "geometry": geometry,
+                }
+            )
+        return dict({"type": "FeatureCollection"}, **self.extra, features=features)
+
+    def to_bytes(self):
+        """紧凑的 GeoJSON 文本（utf8）。"""
+        return json.dumps(
+            self.to_geojson(), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf8")
+
+    def write(self, path):
+        bundle.write_bundle(
+            path,
+            {"properties": self.properties, "extra": self.extra},
+            {
+                "coords": self.coords,
+                "ring_offsets": self.ring_offsets,
+                "part_offsets": self.part_offsets,
+                "feature_offsets": self.feature_offsets,
+                "kinds": self.kinds,
+            },
+        )
+
+    @classmethod
+    def read(cls, path):
+        """数组直接指向映射的文件，多个 worker 共享同一份内存。"""
+        b = bundle.Bundle(path)
+        a = b.arrays
+        return cls(
+            a["coords"],
+            a["ring_offsets"],
+            a["part_offsets"],
+            a["feature_offsets"],
+            a["kinds"],
+            b.meta["properties"],
+            b.meta["extra"],
+        )
+
+
+_compact = {}  # (源文件, 内容哈希) -> CompactGeometry
+_compact_lock = threading.Lock()
+
+
+def footprint(geojson):
+    """返回 (json.load 得到的对象的内存, CompactGeometry 的内存)，单位为字节。"""
+    return deep_sizeof(geojson), CompactGeometry.from_geojson(geojson).nbytes
+
+
+def load_compact(path, level=None):
+    """返回 level 对应的地图边界的 CompactGeometry。
+
+    第一次加载时解析 GeoJSON 并写入 cache_dir，之后直接映射缓存文件，不再解析 JSON。
+    """
+    source = geojson_path(path, level)
+    digest = _digest(source)
+    with _compact_lock:
+        key = (str(source), digest)
+        if key not in _compact:
+            target = _cache_target(source, "compact", digest)
+            if not target.exists():
+                with open(source, encoding="utf8") as f:
+                    geojson = json.load(f)
+                compact = CompactGeometry.from_geojson(geojson)
+                compact.write(target)
+                logger.info(
+                    f"{source}：{len(compact)} 个 feature，{len(compact.coords)} 个点，"
+                    f"dict 约 {deep_sizeof(geojson) / 1024:.0f}K，数组 {compact.nbytes / 1024:.0f}K"
+                )
+            _compact[key] = CompactGeometry.read(target)
+        return _compact[key]
+
+
+def property_values(path, key, level=None):
+    """各 feature 的 properties[key]，顺序与文件中一致（也就是 geopandas.read_file 的行顺序）。"""
+    return list(load_compact(path, level).properties[key])
+
+
+def _douglas_peucker(points, tolerance):
+    """返回 points 中需要保留的点的布尔掩码，首尾两点总是保留。"""
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = points[start + 1 : end]
+        a, b = points[start], points[end]
+        ab = b - a
+        norm = np.hypot(*ab)
+        if norm == 0:
+            dist = np.hypot(*(seg - a).T)
+        else:
+            dist = np.abs(ab[0] * (seg[:, 1] - a[1]) - ab[1] * (seg[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return keep
+
+
+def _rings(geometry):
+    """按顺序返回 geometry 中所有环（外环和内环）的坐标列表。"""
+    if geometry is None:
+        return []
+    if geometry["type"] == "Polygon":
+        return list(geometry["coordinates"])
+    return [ring for polygon in geometry["coordinates"] for ring in polygon]
+
+
+def _junctions(features):
+    """找出所有拓扑节点，即在不同环中相邻点不同的坐标点。"""
+    neighbors = defaultdict(set)
+    for feature in features:
+        for ring in _rings(feature["geometry"]):
+            pts = [tuple(p) for p in ring[:-1]]
+            n = len(pts)
+            for i, p in enumerate(pts):
+                neighbors[p].add(pts[i - 1])
+                neighbors[p].add(pts[(i + 1) % n])
+    return {p for p, ns in neighbors.items() if len(ns) > 2}
+
+
+def _ring_arcs(ring, junctions):
+    """以拓扑节点把环切成多段弧，返回 [(弧, 是否反向)]。
+
+    弧以两个方向中较小的一个作为键，两个区域的公共边得到同一个键，所以只会被简化一次。
+    """
+    pts = [tuple(p) for p in ring[:-1]]
+    cut = [i for i, p in enumerate(pts) if p in junctions]
+    if not cut:
+        # 没有公共边的环（通常是岛屿），从最小点开始，保证结果与起点无关
+        start = pts.index(min(pts))
+        cut = [start]
+    pts = pts[cut[0] :] + pts[: cut[0]]
+    cut = [i - cut[0] for i in cut]
+    bounds = cut + [len(pts)]
+    pts.append(pts[0])
+    arcs = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        arc = pts[start : end + 1]
+        reverse = arc[-1] < arc[0] or (arc[-1] == arc[0] and arc[-2] < arc[1])
+        arcs.append((tuple(arc[::-1] if reverse else arc), reverse))
+    return arcs
+
+
+def _simplify_arc(arc, tolerance, digits):
+    """简化并量化一段弧。tolerance 为 None 时保留所有中间点的原始坐标，只量化两个端点。"""
+    if tolerance is None:
+        ends = _quantize([arc[0]], digits)
+        return ends + [list(p) for p in arc[1:-1]] + _quantize([arc[-1]], digits)
+    arr = np.asarray(arc, dtype=float)
+    if arc[0] == arc[-1] and len(arc) > 3:
+        # 闭合弧需要额外保留一个最远点，否则会退化为一个点
+        far = int(np.argmax(np.hypot(*(arr - arr[0]).T)))
+        keep = np.concatenate(
+            [
+                _douglas_peucker(arr[: far + 1], tolerance)[:-1],
+                _douglas_peucker(arr[far:], tolerance),
+            ]
+        )
+    else:
+        keep = _douglas_peucker(arr, tolerance)
+    return _quantize([arc[i] for i in np.flatnonzero(keep)], digits)
+
+
+def _assemble(arcs, points):
+    """把简化后的弧拼成环，返回 (环, 每条边所属的弧)。"""
+    ring, owners = [], []
+    for key, reverse in arcs:
+        arc = points(key)
+        for p in (arc[::-1] if reverse else arc)[:-1]:
+            if not ring or ring[-1] != p:
+                ring.append(p)
+                owners.append(key)
+    if ring:
+        ring.append(ring[0])
+    return ring, owners
+
+
+def _quantize(ring, digits):
+    out = []
+    for x, y in ring:
+        p = [round(x, digits), round(y, digits)]
+        if not out or out[-1] != p:
+            out.append(p)
+    return out
+
+
+def _bad_segments(rings, chunk=256):
+    """检查一个 feature 的所有环，返回不合法的边的 (环序号, 边序号)。
+
+    不合法指：两条边交叉或者共线重叠；同一个环中不相邻的两条边接触；相邻的两条边折返（毛刺）。
+    不同环之间只在一点接触是允许的。
+    """
+    rings = [np.asarray(r, dtype=float) for r in rings]
+    starts = np.concatenate([r[:-1] for r in rings])
+    ends = np.concatenate([r[1:] for r in rings])
+    ring_of = np.concatenate([np.full(len(r) - 1, i) for i, r in enumerate(rings)])
+    offsets = np.cumsum([0] + [len(r) - 1 for r in rings])
+    index = np.arange(len(starts)) - offsets[ring_of]
+    length = np.diff(offsets)[ring_of]
+    # 按最小 x 排序，每一批边只需要和最小 x 不超过这批边最大 x 的边比较
+    order = np.argsort(np.minimum(starts, ends)[:, 0], kind="stable")
+    starts, ends, ring_of, index, length = (a[order] for a in (starts, ends, ring_of, index, length))
+    lows, highs = np.minimum(starts, ends), np.maximum(starts, ends)
+
+    def cross(o, a, b):
+        return (a[:, 0] - o[:, 0]) * (b[:, 1] - o[:, 1]) - (a[:, 1] - o[:, 1]) * (b[:, 0] - o[:, 0])
+
+    def between(p, lo, hi):
+        return np.all((lo <= p) & (p <= hi), axis=1)
+
+    bad = set()
+    for lo in range(0, len(starts), chunk):
+        hi = min(lo + chunk, len(starts))
+        stop = np.searchsorted(lows[:, 0], highs[lo:hi, 0].max(), side="right")
+        overlap = np.all(
+            (lows[lo:hi, None] <= highs[None, lo:stop]) & (highs[lo:hi, None] >= lows[None, lo:stop]),
+            axis=2,
+        )
+        i, j = np.nonzero(overlap)
+        i, j = i + lo, j + lo
+        i, j = i[j > i], j[j > i]
+        same = ring_of[i] == ring_of[j]
+        gap = np.abs(index[j] - index[i])
+        adjacent = same & ((gap == 1) | (gap == length[i] - 1))
+        p1, q1, p2, q2 = starts[i], ends[i], starts[j], ends[j]
+        o1, o2 = cross(p1, q1, p2), cross(p1, q1, q2)
+        o3, o4 = cross(p2, q2, p1), cross(p2, q2, q1)
+        crossing = (o1 * o2 < 0) & (o3 * o4 < 0)
+        touching = (
+            ((o1 == 0) & between(p2, lows[i], highs[i]))
+            | ((o2 == 0) & between(q2, lows[i], highs[i]))
+            | ((o3 == 0) & between(p1, lows[j], highs[j]))
+            | ((o4 == 0) & between(q1, lows[j], highs[j]))
+        )
+        # 共线且重叠部分长度大于 0
+        shared = np.minimum(highs[i], highs[j]) - np.maximum(lows[i], lows[j])
+        collinear = (o1 == 0) & (o2 == 0) & np.any(shared > 0, axis=1)
+        # 相邻的边只共有一个端点，共线且方向相反时是折返
+        spike = adjacent & collinear
+        invalid = (~adjacent & (crossing | collinear | (same & touching))) | spike
+        for a, b in zip(i[invalid].tolist(), j[invalid].tolist()):
+            bad.add((int(ring_of[a]), int(index[a])))
+            bad.add((int(ring_of[b]), int(index[b])))
+    return bad
+
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+def invalid_features(geojson):
+    """返回有自相交、环之间交叉或者毛刺的 feature 的序号，见 _bad_segments。"""
+    return [
+        k
+        for k, feature in enumerate(geojson["features"])
+        if feature["geometry"] is not None and _bad_segments(_rings(feature["geometry"]))
+    ]
+
+
+def simplify_geojson(geojson, tolerance, digits):
+    """对 geojson 做保持拓扑的简化，并把坐标量化到 digits 位小数。
+
+    相邻区域的公共边只会被简化一次，所以简化后不会出现缝隙或重叠。简化后点数不足以构成多边形的环会被丢弃。
+    简化后不合法的 feature（见 _bad_segments），把出问题的弧改用更小的容差重新简化，
+    仍不合法时保留这段弧的原始点，直到所有环都合法。
+    """
+    features = geojson["features"]
+    junctions = _junctions(features)
+    layout = {}  # feature 序号 -> 每个多边形每个环的弧
+    users = defaultdict(set)  # 弧 -> 用到它的 feature 序号
+    for k, feature in enumerate(features):
+        if feature["geometry"] is None:
+            continue
+        layout[k] = [
+            [_ring_arcs(ring, junctions) for ring in polygon]
+            for polygon in _polygons(feature["geometry"])
+        ]
+        for polygon in layout[k]:
+            for arcs in polygon:
+                for key, _ in arcs:
+                    users[key].add(k)
+
+    tolerances = [tolerance, tolerance / 4, tolerance / 16, None]
+    steps = dict.fromkeys(users, 0)
+    simplified = {}
+
+    def points(key):
+        if (key, steps[key]) not in simplified:
+            simplified[key, steps[key]] = _simplify_arc(key, tolerances[steps[key]], digits)
+        return simplified[key, steps[key]]
+
+    results = {}
+    pending = set(layout)
+    while pending:
+        refine = set()
+        for k in sorted(pending):
+            new_polygons, rings, owners = [], [], []
+            for polygon in layout[k]:
+                new_rings = []
+                for arcs in polygon:
+                    ring, owner = _assemble(arcs, points)
+                    if len(ring) >= 4:
+                        new_rings.append(ring)
+                        rings.append(ring)
+                        owners.append(owner)
+                    elif not new_rings:
+                        # 外环消失则整个多边形丢弃
+                        break
+                if new_rings:
+                    new_polygons.append(new_rings)
+            results[k] = new_polygons
+            if rings:
+                for r, i in _bad_segments(rings):
+                    key = owners[r][i]
+                    if steps[key] < len(tolerances) - 1:
+                        refine.add(key)
+        for key in refine:
+            steps[key] += 1
+        pending = set().union(*(users[key] for key in refine))
+    refined = sum(1 for step in steps.values() if step)
+    if refined:
+        logger.debug(f"{refined} 段弧简化后不合法，改用更小的容差或原始点")
+
+    out_features = []
+    for k, feature in enumerate(features):
+        if feature["geometry"] is None:
+            out_features.append(feature)
+            continue
+        geometry = feature["geometry"]
+        new_polygons = results[k]
+        if not new_polygons:
+            # 区域太小被简化掉了，保留原始外环以免地图上缺失该区域
+            new_polygons = [[_polygons(geometry)[0][0]]]
+        if geometry["type"] == "Polygon" and len(new_polygons) == 1:
+            new_geometry = {"type": "Polygon", "coordinates": new_polygons[0]}
+        else:
+            new_geometry = {"type": "MultiPolygon", "coordinates": new_polygons}
+        out_features.append({**feature, "geometry": new_geometry})
+    return {**geojson, "features": out_features}
+
+
+def count_vertices(geojson):
+    return sum(len(ring) for f in geojson["features"] for ring in _rings(f["geometry"]))
+
+
+def _encode(raw):
+    """返回 (版本号, {编码: 响应内容})。"""
+    bodies = {"identity": raw, "gzip": gzip.compress(raw, compresslevel=9)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(raw)
+    return hashlib.sha1(raw).hexdigest()[:12], bodies
+
+
+class GeometryResource:
+    """预先压缩好的一份 GeoJSON，url 中带有内容哈希，内容不变则 url 不变。
+
+    第一次访问 version、url 或 bodies 时才加载。
+    """
+
+    def __init__(self, name, path, level=None):
+        self.name = name
+        self.path = path
+        self.level = level
+        self._version = None
+        self._bodies = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._bodies is not None:
+                return
+            source = geojson_path(self.path, self.level)
+            # brotli 是可选的，是否可用也作为缓存键的一部分
+            kind = "bodies-br" if brotli is not None else "bodies"
+            target = _cache_target(source, kind, _digest(source))
+            if not target.exists():
+                version, bodies = _encode(load_compact(self.path, self.level).to_bytes())
+                bundle.write_bundle(
+                    target,
+                    {"version": version},
+                    {k: np.frombuffer(v, dtype=np.uint8) for k, v in bodies.items()},
+                )
+            # WSGI 服务器只接受 bytes，加载时从映射的文件中复制一次
+            b = bundle.Bundle(target)
+            self._version = b.meta["version"]
+            self._bodies = {k: a.tobytes() for k, a in b.arrays.items()}
+            logger.info(
+                f"地图边界 {self.url}："
+                + "，".join(f"{k} {len(v) / 1024:.0f}K" for k, v in self._bodies.items())
+            )
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._load()
+        return self._version
+
+    @property
+    def url(self):
+        return f"{config.geometry_url_prefix}/{self.name}.{self.version}.geojson"
+
+    @property
+    def bodies(self):
+        if self._bodies is None:
+            self._load()
+        return self._bodies
+
+    def response(self, accept_encoding):
+        for encoding in ("br", "gzip", "identity"):
+            if encoding in self.bodies and (
+                encoding == "identity" or encoding in accept_encoding
+            ):
+                break
+        body = self.bodies[encoding]
+        resp = flask.Response(
+            [body], mimetype="application/geo+json", direct_passthrough=True
+        )
+        resp.headers["Content-Length"] = str(len(body))
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+        resp.headers["Vary"] = "Accept-Encoding"
+        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        resp.headers["ETag"] = f'"{self.version}-{encoding}"'
+        return resp
+
+
+def register_resources(server, resources):
+    """在 Flask server 上注册地图边界的静态地址。"""
+    by_name = {r.name: r for r in resources}
+
+    @server.route(f"{config.geometry_url_prefix}/<name>.<version>.geojson")
+    def serve_geometry(name, version):
+        resource = by_name.get(name)
+        if resource is None or resource.version != version:
+            flask.abort(404)
+        if resource.version in flask.request.headers.get("If-None-Match", ""):
+            return flask.Response(status=304)
+        return resource.response(flask.request.headers.get("Accept-Encoding", ""))
@@ -0,0 +1,310 @@
+"""
+历史数据存储。
+
+每个数据源一个 HistoryStore，数据按天分区，只追加新记录，以 (province, city, updateTime) 去重。
+目录结构为 <root>/<YYYYMMDD>/part-00001.npz，每个 npz 文件中每一列是一个单独的数组，
+读取时只加载需要的日期分区和列。
+
+每次追加都会写一个新文件，已经结束的日期由 compact 合并为一个文件（见 ingest.py）。
+合并时先完整写出 compact.npz，再删除原文件，最后改名为 part-00001.npz。compact.npz 存在时它包含
+这一天的全部记录，读取时只读它；中途退出时由下一次 compact 或 append 完成剩下的步骤。
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import utils
+
+logger = logging.getLogger(__name__)
+
+key_columns = ["province", "city", "updateTime"]
+metric_columns = ["confirmed", "suspected", "cured", "dead"]
+columns = ["country"] + key_columns + metric_columns
+string_columns = ["country", "province", "city"]
+
+
+class HistoryStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._keys = {}  # 日期 -> 该日期已有记录的键集合
+        self._watermark = None
+        self._lock = threading.Lock()
+
+    def watermark(self):
+        """已保存记录中最大的 updateTime（毫秒），没有任何记录时返回 None。"""
+        if self._watermark is None:
+            for day_dir in reversed(self._day_dirs()):
+                times = _read_day(day_dir, ["updateTime"])["updateTime"]
+                if times:
+                    self._watermark = int(max(t.max() for t in times))
+                    break
+        return self._watermark
+
+    def _day_dirs(self, start=None, end=None):
+        if not self.root.exists():
+            return []
+        start = start.strftime("%Y%m%d") if start else "00000000"
+        end = end.strftime("%Y%m%d") if end else "99999999"
+        return sorted(
+            p for p in self.root.iterdir() if p.is_dir() and start <= p.name <= end
+        )
+
+    def _day_keys(self, day):
+        if day not in self._keys:
+            keys = set()
+            day_dir = self.root / day
+            if day_dir.exists():
+                chunks = _read_day(day_dir, key_columns)
+                for arrays in zip(*(chunks[c] for c in key_columns)):
+                    keys.update(zip(*(a.tolist() for a in arrays)))
+            self._keys[day] = keys
+        return self._keys[day]
+
+    def append(self, df):
+        """追加 df 中的新记录，df 需包含 columns 中的所有列。返回实际写入的记录数。"""
+        if df.empty:
+            return 0
+        df = df[columns].drop_duplicates(subset=key_columns)
+        days = utils.timestamps2datetimes(df.updateTime).strftime("%Y%m%d")
+        written = 0
+        with self._lock:
+            for day, group in df.groupby(np.asarray(days)):
+                keys = self._day_keys(day)
+                new = [k not in keys for k in zip(*(group[c].tolist() for c in key_columns))]
+                group = group[new]
+                if group.empty:
+                    continue
+                day_dir = self.root / day
+                day_dir.mkdir(parents=True, exist_ok=True)
+                _recover(day_dir)
+                part = day_dir / f"part-{len(list(day_dir.glob('part-*.npz'))) + 1:05d}.npz"
+                _write_part(part, group)
+                keys.update(zip(*(group[c].tolist() for c in key_columns)))
+                written += len(group)
+                self._watermark = max(self.watermark() or 0, int(group.updateTime.max()))
+        logger.debug(f"{self.root} 新增 {written} 条记录")
+        return written
+
+    def partitions(self):
+        """{日期: 分区中各文件的 (名称, 修改时间, 大小)}，用于判断哪些日期分区有变化。"""
+        result = {}
+        for day_dir in self._day_dirs():
+            for attempt in range(3):
+                try:
+                    result[day_dir.name] = tuple(
+                        (p.name, p.stat().st_mtime_ns, p.stat().st_size) for p in _parts(day_dir)
+                    )
+                    break
+                except FileNotFoundError:
+                    if attempt == 2:
+                        raise
+        return result
+
+    def read_day(self, day, metrics=None):
+        """读取日期分区 day（YYYYMMDD）中的全部记录，不排序。"""
+        wanted = ["country"] + key_columns + (metric_columns if metrics is None else list(metrics))
+        day_dir = self.root / day
+        return _frame(_read_day(day_dir, wanted) if day_dir.exists() else {c: [] for c in wanted})
+
+    def read(self, start=None, end=None, metrics=None):
+        """读取 [start, end] 时间范围内的记录，start 和 end 为 datetime，metrics 为需要的指标列。"""
+        metrics = metric_columns if metrics is None else list(metrics)
+        wanted = ["country"] + key_columns + metrics
+        chunks = {c: [] for c in wanted}
+        for day_dir in self._day_dirs(start, end):
+            for c, arrays in _read_day(day_dir, wanted).items():
+                chunks[c].extend(arrays)
+        df = _frame(chunks)
+        if df.empty:
+            return df
+        if start is not None:
+            df = df[df.updateTime >= start.timestamp() * 1000]
+        if end is not None:
+            df = df[df.updateTime <= end.timestamp() * 1000]
+        return df.sort_values("updateTime", kind="mergesort", ignore_index=True)
+
+    def compact(self, before=None):
+        """把 before（datetime，默认不限）之前每个日期分区中的多个文件合并为一个，返回合并的分区数。"""
+        before = before.strftime("%Y%m%d") if before else "99999999"
+        compacted = 0
+        with self._lock:
+            for day_dir in self._day_dirs():
+                if day_dir.name >= before:
+                    continue
+                _recover(day_dir)
+                parts = _parts(day_dir)
+                if len(parts) < 2:
+                    continue
+                chunks = _read_day(day_dir, columns)
+                merged = pd.DataFrame({c: np.concatenate(chunks[c]) for c in columns})
+                _write_part(day_dir / compact_name, merged)
+                _recover(day_dir)
+                compacted += 1
+        if compacted:
+            logger.debug(f"{self.root} 合并了 {compacted} 个日期分区")
+        return compacted
+
+
+compact_name = "compact.npz"
+
+
+def _parts(day_dir):
+    """一个日期分区中需要读取的文件。"""
+    merged = day_dir / compact_name
+    if merged.exists():
+        return [merged]
+    return sorted(day_dir.glob("part-*.npz"))
+
+
+def _read_day(day_dir, wanted):
+    """读取一个日期分区的 wanted 列，返回 {列: 每个文件中的数组}。
+
+    读取过程中文件被合并时会找不到文件，此时重新读取这个分区。
+    """
+    for attempt in range(3):
+        chunks = {c: [] for c in wanted}
+        try:
+            for part in _parts(day_dir):
+                with np.load(part) as data:
+                    for c in wanted:
+                        chunks[c].append(data[c])
+            return chunks
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+            logger.debug(f"{day_dir} 正在合并，重新读取")
+
+
+def _frame(chunks):
+    if not chunks["updateTime"]:
+        return pd.DataFrame({c: [] for c in chunks})
+    return pd.DataFrame({c: np.concatenate(a) for c, a in chunks.items()})
+
+
+def _recover(day_dir):
+    """compact.npz 已经完整写出时，删除原文件并把它改名为 part-00001.npz。"""
+    merged = day_dir / compact_name
+    if not merged.exists():
+        return
+    for part in day_dir.glob("part-*.npz"):
+        part.unlink()
+    os.replace(merged, day_dir / "part-00001.npz")
+
+
+def _write_part(path, df):
+    arrays = {}
+    for c in columns:
+        if c in string_columns:
+            arrays[c] = df[c].to_numpy(dtype=str)
+        else:
+            arrays[c] = df[c].to_numpy(dtype=np.int64)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def area_records(results):
+    """把丁香园 area 接口返回的 results 展开为省级和市级记录，省级记录的 city 为空字符串。"""
+    rows = []
+    for r in results:
+        for city in [None] + (r.get("cities") or []):
+            item = r if city is None else city
+            rows.append(
+                (
+                    r.get("countryName", ""),
+                    r["provinceShortName"],
+                    "" if city is None else city["cityName"],
+                    r["updateTime"],
+                    item["confirmedCount"],
+                    item.get("suspectedCount", 0),
+                    item["curedCount"],
+                    item["deadCount"],
+                )
+            )
+    return pd.DataFrame(rows, columns=columns)
+
+
+def overall_records(results):
+    """全国累计数据，province 和 city 均为空字符串。"""
+    return pd.DataFrame(
+        [
+            (
+                "中国",
+                "",
+                "",
+                r["updateTime"],
+                r["confirmedCount"],
+                r["suspectedCount"],
+                r["curedCount"],
+                r["deadCount"],
+            )
+            for r in results
+        ],
+        columns=columns,
+    )
+
+
+def province_city_records(res):
+    """省市每日历史数据，接口字段名不固定，这里尽量兼容。"""
+    records = res.get("results", res.get("data", [])) if isinstance(res, dict) else res
+
+    def pick(record, *names, default=0):
+        for name in names:
+            if record.get(name) is not None:
+                return record[name]
+        return default
+
+    rows = []
+    for r in records:
+        t = pick(r, "updateTime", "time", "date", default=None)
+        if t is None:
+            continue
+        if not isinstance(t, (int, float)):
+            t = pd.Timestamp(t).to_pydatetime().timestamp() * 1000
+        rows.append(
+            (
+                "中国",
+                pick(r, "provinceShortName", "province", default=""),
+                pick(r, "cityName", "city", default=""),
+                int(t),
+                pick(r, "confirmedCount", "confirmed"),
+                pick(r, "suspectedCount", "suspected"),
+                pick(r, "curedCount", "cured"),
+                pick(r, "deadCount", "dead"),
+            )
+        )
+    return pd.DataFrame(rows, columns=columns)
+
+
+def qq_records(res, province, city=""):
+    """腾讯每日数据，date 为 "01.22" 的形式，年份在 year 字段中，没有疑似人数。"""
+    rows = []
+    for r in res.get("data") or []:
+        t = datetime.strptime(f"{r.get('year', 2020)}.{r['date']}", "%Y.%m.%d")
+        rows.append(
+            (
+                "中国",
+                province,
+                city,
+                int(t.timestamp() * 1000),
+                r.get("confirm", 0),
+                0,
+                r.get("heal", 0),
+                r.get("dead", 0),
+            )
+        )
+    return pd.DataFrame(rows, columns=columns)
+
+
+area = HistoryStore(Path(config.history_store_dir) / "area")
+overall = HistoryStore(Path(config.history_store_dir) / "overall")
+province_city = HistoryStore(Path(config.history_store_dir) / "province_city")
+qq = HistoryStore(Path(config.history_store_dir) / "qq")
@@ -0,0 +1,180 @@
+"""
+访问上游接口的 HTTP 客户端。
+
+所有上游请求都通过这里发出：
+
+- 每个 host 一个 requests.Session，复用连接
+- 显式的连接超时和读取超时
+- 失败后按带随机抖动的指数退避重试
+- config.apis 中的每个接口各有一个熔断器，连续失败多次后一段时间内不再请求
+- 带 ETag/If-Modified-Since 的条件请求，数据没变时上游只需返回 304
+- 上游不可用时 fetch 返回上一次成功拿到的数据（stale 为 True）。get_json 和 get_text 默认抛出 StaleError，
+  调用方不会把旧数据当成新数据，需要旧数据时传入 allow_stale=True
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# content 为响应内容（bytes）。not_modified 表示上游返回 304；stale 表示本次请求失败，返回的是上一次成功的数据
+Result = namedtuple("Result", ["content", "not_modified", "stale"])
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class StaleError(UpstreamError):
+    """上游不可用，只有上一次成功拿到的数据。"""
+
+
+class CircuitBreaker:
+    """连续失败 threshold 次后熔断，reset_timeout 秒后放行一次试探请求，成功则恢复。"""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # 半开状态：只放行这一次，失败则重新计时
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+class UpstreamClient:
+    def __init__(self, apis=None):
+        self.apis = config.apis if apis is None else apis
+        self._sessions = {}
+        self._breakers = {}
+        self._cache = {}  # url -> (etag, last_modified, content)
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=config.http_pool_size, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = config.user_agent
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def breaker(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(
+                    config.breaker_threshold, config.breaker_reset_timeout
+                )
+            return self._breakers[name]
+
+    def _request(self, url):
+        with self._lock:
+            cached = self._cache.get(url)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        r = self._session(url).get(url, headers=headers, timeout=config.http_timeout)
+        if r.status_code == 304 and cached is not None:
+            return Result(cached[2], True, False)
+        r.raise_for_status()
+        with self._lock:
+            self._cache[url] = (
+                r.headers.get("ETag"),
+                r.headers.get("Last-Modified"),
+                r.content,
+            )
+        return Result(r.content, False, False)
+
+    def fetch(self, name, url=None):
+        """请求 config.apis 中名为 name 的接口，url 用于替换默认地址（如填好参数的地址）。返回 Result。"""
+        url = url or self.apis[name]
+        breaker = self.breaker(name)
+        error = None
+        if breaker.allow():
+            for attempt in range(config.http_retries + 1):
+                if attempt:
+                    delay = config.http_backoff * 2 ** (attempt - 1)
+                    time.sleep(delay * random.uniform(0.5, 1.5))
+                start = time.time()
+                try:
+                    result = self._request(url)
+                    breaker.success()
+                    logger.debug(
+                        f"{name} {'304' if result.not_modified else '200'}，"
+                        f"耗时 {time.time() - start:.2f}s"
+                    )
+                    return result
+                except requests.HTTPError as e:
+                    error = e
+                    status = e.response.status_code
+                    if status < 500 and status != 429:
+                        break
+                except requests.RequestException as e:
+                    error = e
+                logger.warning(f"请求 {name} 第 {attempt + 1} 次失败：{error}")
+            breaker.failure()
+        else:
+            error = CircuitOpenError(f"{name} 已熔断")
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached is not None:
+            logger.warning(f"{name} 不可用（{error}），使用上一次的数据")
+            return Result(cached[2], False, True)
+        if isinstance(error, UpstreamError):
+            raise error
+        raise UpstreamError(f"{name} 不可用：{error}") from error
+
+    def _fresh(self, name, url, allow_stale):
+        result = self.fetch(name, url)
+        if result.stale and not allow_stale:
+            raise StaleError(f"{name} 不可用，只有上一次的数据")
+        return result.content
+
+    def get_json(self, name, url=None, allow_stale=False):
+        return json.loads(self._fresh(name, url, allow_stale))
+
+    def get_text(self, name, url=None, allow_stale=False):
+        return self._fresh(name, url, allow_stale).decode("utf8")
+
+
+client = UpstreamClient()
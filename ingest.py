@@ -0,0 +1,493 @@
+"""
+后台数据拉取服务。
+
+所有上游接口只在这里请求。每轮拉取的结果打包成一个带版本号的快照（Snapshot）发布出去，
+回调函数只读取最新快照，这样无论打开多少个页面，上游请求次数和回调耗时都不会变。
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+import config
+import daily
+import fanout
+import history_store
+import http_client
+import jhu
+import metrics
+import refresh
+import regions
+import utils
+
+logger = logging.getLogger(__name__)
+
+province_data_file = Path("history_data/province_data.csv")
+city_data_file = Path("history_data/city_data.csv")
+# 其他 worker 收到的全量同步请求写在这个文件中，拉取数据的 worker 下一轮读到后执行
+resync_request_file = Path("history_data/.resync_request")
+
+# 虽然直辖市为省级，但是此处仍将其纳入市级来展示
+# 为了方便起见，台湾也计入其中
+municipalities = ["北京", "上海", "天津", "重庆", "台湾", "香港"]
+
+# version 每发布一次加 1，可用作各种缓存的键。
+# province_df 和 city_df 已经加上了派生指标，bins 为 {级别: {指标: (区间边界, 区间标签)}}，见 metrics.py。
+# daily 和 daily_diff 为全国数据的每日值和较昨日新增，见 daily.py。
+# area_watermark 为省市历史数据的水位线，可用作依赖历史数据的缓存的键
+Snapshot = namedtuple(
+    "Snapshot",
+    [
+        "version",
+        "fetch_time",
+        "overall",
+        "province_df",
+        "city_df",
+        "bins",
+        "daily",
+        "daily_diff",
+        "area_watermark",
+    ],
+)
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_snapshot_ready = threading.Event()
+_listeners = []
+_writers = []
+_unpublished = False  # 上一轮的新数据写入失败，还没有发布
+_thread = None
+_stop = threading.Event()
+_wakeup = threading.Event()
+_resync_requested = threading.Event()
+_overall = None  # 全国累计数据，按时间倒序
+_daily = daily.DailyAggregate(daily.early_days)  # 全国累计数据的按天汇总
+_last_success = None  # 上次成功拉取的时间
+_last_full = None  # 上次全量同步的时间
+_compacted_day = None  # 上次合并历史数据分区的日期
+_province_city_mtime = None  # 上次读取的省市数据文件的修改时间
+_regions = {}  # 省份简称 -> 城市名称列表，用于按省市请求腾讯接口
+refresher = refresh.RefreshCoordinator("history_data/.province_city.lock")
+
+
+def _overall_frame(results):
+    """把 overall 接口返回的 results 转换为按时间倒序排列的 DataFrame。"""
+    time_, confirmed, suspected, cured, dead = zip(
+        *[
+            (
+                i["updateTime"],
+                i["confirmedCount"],
+                i["suspectedCount"],
+                i["curedCount"],
+                i["deadCount"],
+            )
+            for i in results
+        ]
+    )
+    time_ = utils.timestamps2datetimes(time_)
+    df = pd.DataFrame(
+        data={
+            "time": time_,
+            "confirmed": confirmed,
+            "suspected": suspected,
+            "cured": cured,
+            "dead": dead,
+        }
+    )
+    return df.sort_values("time", ascending=False, ignore_index=True)
+
+
+def fetch_overall(full=False):
+    """拉取全国累计数据。
+
+    full 为 True 时拉取全部历史并替换内存中的数据，否则只拉取最新一条，
+    比水位线新的记录才会合并进来。返回是否有新数据。
+    """
+    global _overall
+    api = "isaaclin_overall_history" if full else "isaaclin_overall_latest"
+    results = http_client.client.get_json(api)["results"]
+    watermark = history_store.overall.watermark() or 0
+    written = history_store.overall.append(history_store.overall_records(results))
+    if full or _overall is None:
+        _overall = _overall_frame(results)
+        _daily.reset()
+        _daily.update(_overall)
+        return True
+    new = [i for i in results if i["updateTime"] > watermark]
+    if new:
+        rows = _overall_frame(new)
+        _overall = pd.concat([rows, _overall], ignore_index=True)
+        _daily.update(rows)
+    logger.debug(f"全国数据水位线 {watermark}，新增 {written} 条")
+    return bool(new)
+
+
+def fetch_province_city():
+    """拉取各省市最新数据，返回是否有新数据，以及省级和市级两个 DataFrame，并保存为数据文件。
+
+    最新数据同时也是 area 历史的增量，比水位线新的记录会追加到历史数据中。
+    """
+    global _regions
+    res = http_client.client.get_json("isaaclin_area_latest")
+    watermark = history_store.area.watermark() or 0
+    written = history_store.area.append(history_store.area_records(res["results"]))
+    logger.debug(f"省市数据水位线 {watermark}，新增 {written} 条")
+    province, confirmed, suspected, cured, dead = zip(
+        *[
+            (
+                i["provinceName"],
+                i["confirmedCount"],
+                i["suspectedCount"],
+                i["curedCount"],
+                i["deadCount"],
+            )
+            for i in res["results"]
+            if i["countryName"] == "中国"
+        ]
+    )
+    province_df = pd.DataFrame(
+        data={
+            "地区": regions.canonical("province", province),
+            "确诊": confirmed,
+            "疑似": suspected,
+            "治愈": cured,
+            "死亡": dead,
+        },
+    )
+    refresh.atomic_to_csv(province_df, province_data_file)
+
+    cities, confirmeds, suspecteds, cureds, deads = [], [], [], [], []
+    for province in res["results"]:
+        if province["countryName"] != "中国":
+            continue
+        if province["provinceShortName"] in municipalities:
+            cities.append(province["provinceShortName"])
+            confirmeds.append(province["confirmedCount"])
+            suspecteds.append(province["suspectedCount"])
+            cureds.append(province["curedCount"])
+            deads.append(province["deadCount"])
+            continue
+        for city in province["cities"]:
+            cities.append(city["cityName"])
+            confirmeds.append(city["confirmedCount"])
+            suspecteds.append(city["suspectedCount"])
+            cureds.append(city["curedCount"])
+            deads.append(city["deadCount"])
+    _regions = {
+        p["provinceShortName"]: [c["cityName"] for c in p.get("cities") or []]
+        for p in res["results"]
+        if p["countryName"] == "中国"
+    }
+    cities = regions.canonical("city", cities)
+    city_df = pd.DataFrame(
+        data={
+            "地区": cities,
+            "确诊": confirmeds,
+            "疑似": suspecteds,
+            "治愈": cureds,
+            "死亡": deads,
+        },
+    )
+    refresh.atomic_to_csv(city_df, city_data_file)
+    return written > 0, province_df, city_df
+
+
+def load_province_city(max_age=None):
+    """返回 (是否有新数据, 省级 DataFrame, 市级 DataFrame)。
+
+    数据文件早于 max_age 秒（默认 config.data_file_max_age）时才请求上游。多个进程同时运行时只有一个会去请求，
+    其余的等它写完后直接读取文件。每轮拉取时 max_age 为 0，总是重新请求。
+    """
+    global _province_city_mtime
+    fetched = []
+    data_files = [province_data_file, city_data_file]
+    refresher.refresh(
+        data_files,
+        config.data_file_max_age if max_age is None else max_age,
+        lambda: fetched.append(fetch_province_city()),
+    )
+    mtime = province_data_file.stat().st_mtime
+    if fetched:
+        changed, province_df, city_df = fetched[0]
+    else:
+        province_df = pd.read_csv(province_data_file, index_col=0)
+        city_df = pd.read_csv(city_data_file, index_col=0)
+        changed = mtime != _province_city_mtime
+    _province_city_mtime = mtime
+    return changed, province_df, city_df
+
+
+def _needs_full_resync(now):
+    if _resync_requested.is_set() or resync_request_file.exists():
+        return "手动请求"
+    if history_store.area.watermark() is None or _overall is None:
+        return "没有历史数据"
+    if _last_success is None or now - _last_success > config.resync_gap:
+        # 中间有一段时间没拉到数据，只拉最新数据会漏掉这段时间的记录
+        return "数据有缺口"
+    if _last_full is None or now - _last_full > config.full_resync_interval:
+        return "定期全量同步"
+    return None
+
+
+def fetch_jhu(name):
+    """拉取 JHU 的一个时间序列 CSV 并保存到 config.jhu_data_dir，返回文件是否有变化。"""
+    result = http_client.client.fetch(name)
+    if result.not_modified or result.stale:
+        return False
+    path = Path(config.jhu_data_dir) / f"{name}.csv"
+    refresh.atomic_write(path, lambda tmpname: Path(tmpname).write_bytes(result.content))
+    logger.debug(f"{name} 已保存到 {path}，{len(result.content)} 字节")
+    return True
+
+
+def fetch_qq(api, url, province, city=""):
+    """拉取腾讯的一个省或城市的每日数据并追加到历史数据中，返回新增的记录数。"""
+    res = http_client.client.get_json(api, url)
+    return history_store.qq.append(history_store.qq_records(res, province, city))
+
+
+def _core_tasks(full):
+    """每轮都要拉取的数据源。全量同步时拉取全部历史，另外加上 config.extra_sources 中的 JHU 数据。"""
+    apis = config.apis
+    overall_api = "isaaclin_overall_history" if full else "isaaclin_overall_latest"
+    tasks = [
+        fanout.Task(overall_api, apis[overall_api], lambda: fetch_overall(full)),
+        fanout.Task(
+            "isaaclin_area_latest",
+            apis["isaaclin_area_latest"],
+            # 失败后的重试和手动请求的全量同步不能因为文件还没过期而跳过
+            lambda: load_province_city(max_age=0),
+        ),
+    ]
+    if full:
+        tasks += [
+            fanout.Task(
+                "isaaclin_area_history",
+                apis["isaaclin_area_history"],
+                utils.save_dxy_minutes_history,
+            ),
+            fanout.Task(
+                "province_city_history",
+                apis["province_city_history"],
+                utils.save_province_city_history,
+            ),
+        ]
+        tasks += [
+            fanout.Task(name, apis[name], lambda name=name: fetch_jhu(name))
+            for name in config.extra_sources
+            if name.startswith("JHU_")
+        ]
+    return tasks
+
+
+def _qq_tasks():
+    """腾讯接口按省、市分别请求，省市名称来自最近一次拉取的丁香园数据。"""
+    tasks = []
+    if not _regions:
+        if any(name.startswith("qq_") for name in config.extra_sources):
+            logger.info("还没有省市名称，跳过腾讯数据")
+        return tasks
+    for province, cities in _regions.items():
+        if "qq_province" in config.extra_sources:
+            url = config.apis["qq_province"].replace("省份名称", province)
+            tasks.append(
+                fanout.Task(
+                    f"qq_province:{province}",
+                    url,
+                    lambda url=url, province=province: fetch_qq(
+                        "qq_province", url, province
+                    ),
+                )
+            )
+        if "qq_province_city" not in config.extra_sources:
+            continue
+        for city in cities:
+            url = (
+                config.apis["qq_province_city"]
+                .replace("省份名称", province)
+                .replace("城市名称", city)
+            )
+            tasks.append(
+                fanout.Task(
+                    f"qq_province_city:{province}-{city}",
+                    url,
+                    lambda url=url, province=province, city=city: fetch_qq(
+                        "qq_province_city", url, province, city
+                    ),
+                )
+            )
+    return tasks
+
+
+def compact_history(force=False):
+    """把今天之前的历史数据分区合并为一个文件，每天第一轮或者 force 为 True 时执行。"""
+    global _compacted_day
+    today = datetime.now().date()
+    if not force and _compacted_day == today:
+        return
+    start = datetime.combine(today, datetime.min.time())
+    for store in (
+        history_store.area,
+        history_store.overall,
+        history_store.province_city,
+        history_store.qq,
+    ):
+        try:
+            store.compact(before=start)
+        except Exception:
+            logger.error(f"合并 {store.root} 的历史数据出错。", exc_info=True)
+    _compacted_day = today
+
+
+def request_resync():
+    """请求在下一轮拉取时做一次全量同步。可以在任何 worker 中调用，见 app.py 中的 resync。"""
+    refresh.atomic_write(resync_request_file, lambda tmpname: Path(tmpname).touch())
+    _resync_requested.set()
+    _wakeup.set()
+
+
+def _clear_resync_request(before):
+    """清除 before 之前的全量同步请求，之后收到的请求留到下一轮。"""
+    _resync_requested.clear()
+    try:
+        if resync_request_file.stat().st_mtime <= before:
+            resync_request_file.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def ingest_once(full=False):
+    """拉取一轮数据，有新数据时发布新快照。
+
+    通常只拉取增量，在没有历史数据、数据有缺口、到了定期全量同步时间或者手动请求时做全量同步。
+    同一轮中的各个数据源并发请求，见 fanout.py。
+    """
+    global _snapshot, _last_success, _last_full, _unpublished
+    now = time.time()
+    reason = "参数指定" if full else _needs_full_resync(now)
+    if reason:
+        logger.info(f"[开始] 全量同步数据（{reason}）")
+    else:
+        logger.info("[开始] 拉取增量数据")
+    tasks = _core_tasks(bool(reason))
+    results = fanout.run_all(tasks)
+    for task in tasks[:2]:
+        if isinstance(results[task.name], Exception):
+            raise results[task.name]
+    changed = results[tasks[0].name]
+    area_changed, province_df, city_df = results["isaaclin_area_latest"]
+    if reason:
+        if results["isaaclin_area_history"] is not True:
+            raise RuntimeError("全量同步丁香园历史数据失败")
+        # 腾讯数据需要用到刚拉取的省市名称，所以放在第二批
+        qq_tasks = _qq_tasks()
+        if qq_tasks:
+            fanout.run_all(qq_tasks)
+        if any(results.get(name) is True for name in jhu.sources):
+            # CSV 有变化时在这里重建缓存，查询接口（见 query.py）读取时只需映射缓存文件
+            try:
+                jhu.load()
+            except Exception:
+                logger.error("解析 JHU 数据出错。", exc_info=True)
+        _last_full = time.time()
+        _clear_resync_request(now)
+        changed = True
+    changed = changed or area_changed or _unpublished
+    _last_success = now
+    compact_history(force=bool(reason))
+    if not changed and _snapshot is not None:
+        logger.info(f"[结束] 拉取数据，没有新数据，快照版本仍为 {_snapshot.version}")
+        return _snapshot
+    bins = {}
+    province_df, bins["province"] = metrics.derive(
+        province_df, metrics.previous_day("province", province_df["地区"], municipalities)
+    )
+    city_df, bins["city"] = metrics.derive(
+        city_df, metrics.previous_day("city", city_df["地区"], municipalities)
+    )
+    regions.report()
+    version = _snapshot.version + 1 if _snapshot else 1
+    snapshot = Snapshot(
+        version,
+        datetime.now(),
+        _overall,
+        province_df,
+        city_df,
+        bins,
+        _daily.table.copy(),
+        _daily.diff.copy(),
+        history_store.area.watermark(),
+    )
+    # 先写入共享文件等（见 add_writer），都成功后才作为当前快照，写入失败时下一轮重新发布
+    _unpublished = True
+    for writer in list(_writers):
+        writer(snapshot)
+    with _snapshot_lock:
+        _snapshot = snapshot
+    _unpublished = False
+    _snapshot_ready.set()
+    logger.info(f"[结束] 拉取数据，快照版本 {version}")
+    for listener in list(_listeners):
+        try:
+            listener(snapshot)
+        except Exception:
+            logger.error(f"快照监听函数 {listener} 出错。", exc_info=True)
+    return snapshot
+
+
+def _run():
+    while not _stop.is_set():
+        try:
+            ingest_once()
+            wait = config.ingest_interval
+        except Exception:
+            logger.error("拉取数据出错，稍后重试。", exc_info=True)
+            wait = config.ingest_retry_interval
+        _wakeup.wait(wait)
+        _wakeup.clear()
+
+
+def start():
+    """启动后台拉取线程，重复调用无副作用。"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="ingest", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    _wakeup.set()
+
+
+def add_writer(writer):
+    """注册一个函数，每次发布新快照之前以快照为参数调用它。它出错时这一轮不发布新快照。"""
+    _writers.append(writer)
+
+
+def subscribe(listener):
+    """注册一个函数，每次有新快照发布后以快照为参数调用它。"""
+    _listeners.append(listener)
+
+
+def resume(snapshot):
+    """以 snapshot（如其他进程发布的快照）作为当前快照，之后发布的版本号接着它递增。"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or snapshot.version > _snapshot.version:
+            _snapshot = snapshot
+    _snapshot_ready.set()
+
+
+def get_snapshot(timeout=None):
+    """返回最新快照。如果还没有任何快照，最多等待 timeout 秒，超时返回 None。"""
+    _snapshot_ready.wait(timeout)
+    return _snapshot
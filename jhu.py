@@ -0,0 +1,197 @@
+"""
+JHU CSSE 全球时间序列数据。
+
+ingest.fetch_jhu 把 config.extra_sources 中的 JHU CSV 保存到 config.jhu_data_dir，这里把它们转换为
+一个 (国家/地区, 日期, 指标) 的三维数组：
+
+- CSV 每个日期一列，按块读取，每块只保留国家/地区和日期列，dtype 明确指定，不做类型推断
+- 同一国家/地区的各省/州相加后，转为 (国家/地区, 日期, 数值) 的长表（在数组上完成的 melt）
+- 三个指标的长表按国家/地区和日期的编号直接写入对齐的数组，某个指标缺少的国家/地区或日期为 NaN
+
+结果以共享数据文件（见 bundle.py）缓存在 config.jhu_data_dir 中，CSV 没有变化时直接映射缓存，
+不需要重新解析几百列的 CSV。
+"""
+
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import bundle
+import config
+
+logger = logging.getLogger(__name__)
+
+# 数据源 -> 指标
+sources = {
+    "JHU_CSSE_CONFIRMED": "确诊",
+    "JHU_CSSE_CURED": "治愈",
+    "JHU_CSSE_DEATHS": "死亡",
+}
+country_column = "Country/Region"
+id_columns = ["Province/State", "Country/Region", "Lat", "Long"]
+date_format = "%m/%d/%y"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def csv_path(name, data_dir=None):
+    return Path(data_dir or config.jhu_data_dir) / f"{name}.csv"
+
+
+def cache_path(data_dir=None):
+    return Path(data_dir or config.jhu_data_dir) / "global.bin"
+
+
+def read_wide(path, chunksize=None):
+    """读取一个 JHU CSV，返回以国家/地区为索引、每个日期一列的 DataFrame，各省/州已相加。"""
+    header = pd.read_csv(path, nrows=0).columns
+    dates = [c for c in header if c not in id_columns]
+    dtype = {country_column: str}
+    dtype.update({c: np.float64 for c in dates})
+    names, blocks = [], []
+    for chunk in pd.read_csv(
+        path,
+        usecols=[country_column] + dates,
+        dtype=dtype,
+        chunksize=chunksize or config.jhu_chunk_rows,
+    ):
+        names.append(chunk[country_column].to_numpy())
+        blocks.append(chunk[dates].to_numpy())
+    names = np.concatenate(names) if names else np.array([], dtype=object)
+    values = np.concatenate(blocks) if blocks else np.zeros((0, len(dates)))
+    # 同一国家/地区的各行相加，全部为空时结果为 NaN
+    codes, countries = pd.factorize(names, sort=True)
+    present = ~np.isnan(values)
+    total = np.zeros((len(countries), len(dates)))
+    count = np.zeros((len(countries), len(dates)))
+    np.add.at(total, codes, np.where(present, values, 0))
+    np.add.at(count, codes, present)
+    total[count == 0] = np.nan
+    return pd.DataFrame(
+        total, index=countries, columns=pd.to_datetime(dates, format=date_format)
+    )
+
+
+def to_long(wide, metric):
+    """宽表转为 (country, date, metric) 三列的长表，等价于 melt，但直接在数组上完成。"""
+    n, d = wide.shape
+    return pd.DataFrame(
+        {
+            "country": np.repeat(wide.index.to_numpy(), d),
+            "date": np.tile(wide.columns.to_numpy(), n),
+            metric: wide.to_numpy().ravel(),
+        }
+    )
+
+
+class GlobalSeries:
+    """values[i, j, k] 为 countries[i] 在 dates[j] 的 metrics[k]。"""
+
+    def __init__(self, countries, dates, metrics, values):
+        self.countries = list(countries)
+        self.dates = pd.DatetimeIndex(dates)
+        self.metrics = list(metrics)
+        self.values = values
+        self._index = {c: i for i, c in enumerate(self.countries)}
+
+    @classmethod
+    def from_long(cls, longs):
+        """longs 为 {指标: to_long 的结果}。"""
+        metrics = list(longs)
+        country_index = pd.Index(
+            np.unique(np.concatenate([long["country"].to_numpy(str) for long in longs.values()]))
+        )
+        dates = pd.DatetimeIndex(
+            np.unique(np.concatenate([long["date"].to_numpy() for long in longs.values()]))
+        )
+        countries = list(country_index)
+        values = np.full((len(countries), len(dates), len(metrics)), np.nan)
+        for k, metric in enumerate(metrics):
+            long = longs[metric]
+            rows = country_index.get_indexer(long["country"])
+            cols = dates.get_indexer(long["date"])
+            values[rows, cols, k] = long[metric].to_numpy()
+        return cls(countries, dates, metrics, values)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def country(self, name):
+        """一个国家/地区的时间序列，以日期为索引，每个指标一列。"""
+        return pd.DataFrame(self.values[self._index[name]], index=self.dates, columns=self.metrics)
+
+    def on(self, date=None):
+        """某一天（默认最后一天）各国家/地区的数据，以国家/地区为索引，每个指标一列。"""
+        j = -1 if date is None else self.dates.get_loc(pd.Timestamp(date))
+        return pd.DataFrame(self.values[:, j], index=self.countries, columns=self.metrics)
+
+    def write(self, path, stamps):
+        bundle.write_bundle(
+            path,
+            {"countries": self.countries, "metrics": self.metrics, "sources": stamps},
+            {
+                "dates": self.dates.to_numpy(dtype="datetime64[ns]").view(np.int64),
+                "values": self.values,
+            },
+        )
+
+    @classmethod
+    def read(cls, b):
+        return cls(
+            b.meta["countries"],
+            b.arrays["dates"].view("datetime64[ns]"),
+            b.meta["metrics"],
+            b.arrays["values"],
+        )
+
+
+def _stamps(data_dir):
+    stamps = {}
+    for name in sources:
+        current = bundle.stamp(csv_path(name, data_dir))
+        if current is not None:
+            stamps[name] = list(current)
+    return stamps
+
+
+def build(data_dir=None):
+    """解析 data_dir 中的 JHU CSV，返回 GlobalSeries，没有任何 CSV 时返回 None。"""
+    longs = {}
+    for name, metric in sources.items():
+        path = csv_path(name, data_dir)
+        if path.exists():
+            longs[metric] = to_long(read_wide(path), metric)
+    if not longs:
+        return None
+    series = GlobalSeries.from_long(longs)
+    logger.debug(
+        f"JHU 数据：{len(series.countries)} 个国家/地区，{len(series.dates)} 天，指标 {series.metrics}"
+    )
+    return series
+
+
+def load(data_dir=None):
+    """返回 GlobalSeries，CSV 没有变化时直接映射缓存文件，没有任何 CSV 时返回 None。"""
+    global _cache
+    stamps = _stamps(data_dir)
+    if not stamps:
+        return None
+    path = cache_path(data_dir)
+    with _cache_lock:
+        if _cache is not None and _cache[0] == (str(path), stamps):
+            return _cache[1]
+        series = None
+        if bundle.stamp(path) is not None:
+            b = bundle.Bundle(path)
+            if b.meta.get("sources") == stamps:
+                series = GlobalSeries.read(b)
+        if series is None:
+            series = build(data_dir)
+            series.write(path, stamps)
+            logger.info(f"JHU 数据已缓存到 {path}")
+        _cache = ((str(path), stamps), series)
+        return series
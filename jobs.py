@@ -0,0 +1,177 @@
+"""
+视频生成任务队列。
+
+提交 (开始日期, 结束日期) 后立即返回任务 ID，视频在后台生成，页面轮询任务进度。
+相同参数且数据版本相同的任务只会执行一次，生成好的视频缓存在磁盘上，总大小超过上限时删除最久未使用的视频。
+
+任务状态同时写在缓存目录下的 .<任务 ID>.json 中，多个 worker 时，轮询请求落到其他 worker 上也能查到进度。
+状态中记录执行任务的进程，这个进程已经退出时任务才会被其他 worker 重新执行。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import refresh
+import video
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, job_id, start_date, end_date, path):
+        self.id = job_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.path = path
+        self.status = "queued"  # queued, running, done, failed
+        self.progress = 0.0
+        self.error = None
+        self.owner = os.getpid()  # 执行任务的进程
+        self.created = time.time()
+        self.updated = self.created
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        job = cls(state["id"], state["start_date"], state["end_date"], Path(state["path"]))
+        job.status, job.progress, job.error = state["status"], state["progress"], state["error"]
+        job.created, job.updated = state["created"], state["updated"]
+        job.owner = state.get("owner")
+        return job
+
+    def state(self):
+        return dict(
+            self.to_dict(),
+            start_date=self.start_date,
+            end_date=self.end_date,
+            path=self.path.as_posix(),
+            owner=self.owner,
+            created=self.created,
+            updated=self.updated,
+        )
+
+
+class JobManager:
+    """run 的签名为 run(start_date, end_date, videoname, progress)，progress(done, total) 用于汇报进度。"""
+
+    # 无法检查进程是否存在的平台上，其他 worker 的任务超过这么久没有更新状态时重新执行
+    stale_after = 10 * 60  # s
+
+    def __init__(self, run, cache_dir, max_bytes, workers=1):
+        self._run = run
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, start_date, end_date, data_version):
+        """提交任务，返回任务 ID。已有相同任务在执行或已有缓存时不会重复生成。"""
+        key = f"{start_date}|{end_date}|{data_version}"
+        job_id = hashlib.sha1(key.encode("utf8")).hexdigest()[:16]
+        name = f"tncg-{start_date.replace('-', '')}-{end_date.replace('-', '')}-{job_id}"
+        path = self.cache_dir / f"{name}.mp4"
+        # 文件锁保证多个 worker 同时提交相同任务时只有一个会创建
+        with self._lock, refresh.file_lock(self.cache_dir / ".jobs.lock"):
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and job.status in ("queued", "running"):
+                # 本进程的任务在排队或执行中，等待时间再长也不重复提交
+                return job_id
+            if job is None:
+                job = self._load(job_id)
+                if job is not None and job.status in ("queued", "running") and self._alive(job):
+                    return job_id
+            job = Job(job_id, start_date, end_date, path)
+            self._jobs[job_id] = job
+            if path.exists():
+                path.touch()
+                job.status, job.progress = "done", 1.0
+                self._save(job)
+                logger.info(f"视频 {path} 命中缓存")
+                return job_id
+            self._save(job)
+        self._executor.submit(self._execute, job)
+        return job_id
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            # 可能是其他 worker 提交的任务
+            job = self._load(job_id)
+        return job
+
+    def _alive(self, job):
+        """执行 job 的进程是否还在运行。"""
+        if job.owner is None:
+            return False
+        if os.name != "posix":
+            return time.time() - job.updated < self.stale_after
+        try:
+            os.kill(job.owner, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _state_path(self, job_id):
+        return self.cache_dir / f".{job_id}.json"
+
+    def _save(self, job):
+        job.updated = time.time()
+        state = json.dumps(job.state())
+        refresh.atomic_write(
+            self._state_path(job.id),
+            lambda tmpname: Path(tmpname).write_text(state, encoding="utf8"),
+        )
+
+    def _load(self, job_id):
+        try:
+            state = json.loads(self._state_path(job_id).read_text(encoding="utf8"))
+        except (OSError, ValueError):
+            return None
+        return Job.from_state(state)
+
+    def _prune(self, max_age=24 * 3600):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.status in ("done", "failed") and now - job.created > max_age:
+                del self._jobs[job_id]
+        for state in self.cache_dir.glob(".*.json"):
+            if now - state.stat().st_mtime > max_age:
+                state.unlink()
+
+    def _execute(self, job):
+        job.status = "running"
+        self._save(job)
+        logger.info(f"[开始] 任务 {job.id}：生成 {job.start_date} 至 {job.end_date} 的视频")
+
+        def progress(done, total):
+            job.progress = done / total if total else 0.0
+            # 每秒最多写一次状态文件
+            if time.time() - job.updated >= 1:
+                self._save(job)
+
+        try:
+            self._run(job.start_date, job.end_date, job.path, progress)
+            job.status, job.progress = "done", 1.0
+            logger.info(f"[结束] 任务 {job.id}：{job.path}")
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+            logger.error(f"任务 {job.id} 出错。", exc_info=True)
+        self._save(job)
+        video.evict(self.cache_dir, self.max_bytes, keep=[job.path])
@@ -0,0 +1,101 @@
+"""
+地图用到的派生指标。每发布一个快照只计算一次，回调函数直接取列。
+
+- {指标}区间：各指标所在分级区间的编号，区间边界和标签见 Snapshot.bins
+- 新增{指标}：与前一天最后一条记录相比的增量，前一天没有记录时为 NaN
+- 治愈率、死亡率：除以确诊数，确诊为 0 时为 NaN
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import config
+import history_store
+import regions
+
+logger = logging.getLogger(__name__)
+
+metrics = ["确诊", "疑似", "治愈", "死亡"]
+history_columns = dict(zip(history_store.metric_columns, metrics))
+
+
+def fixed_edges(values):
+    return np.asarray(config.bin_edges)
+
+
+def quantile_edges(values):
+    """第一个区间为 0，其余区间按正数的分位数划分，边界取整后去重。"""
+    positive = values[values > 0]
+    if positive.size == 0:
+        return np.array([0, 1])
+    quantiles = np.quantile(positive, np.linspace(0, 1, config.bin_count)[1:-1])
+    edges = np.unique(np.ceil(quantiles).astype(np.int64))
+    return np.concatenate([[0, 1], edges[edges > 1]])
+
+
+bin_modes = {"fixed": fixed_edges, "quantile": quantile_edges}
+
+
+def bin_labels(edges):
+    """区间左闭右开，最后一个区间没有上界，所以任何值都能落入某个区间。"""
+    labels = [
+        f"{lo}" if hi - lo == 1 else f"{lo}-{hi - 1}" for lo, hi in zip(edges[:-1], edges[1:])
+    ]
+    return labels + [f"{edges[-1]}+"]
+
+
+def bin_codes(values, edges):
+    """values 所在区间的编号，即 edges 中不大于它的最后一个边界的下标。"""
+    return np.maximum(np.searchsorted(edges, values, side="right") - 1, 0)
+
+
+def previous_day(level, names, municipalities, now=None):
+    """前一天各地区最后一条记录的各项指标，索引为 names。
+
+    names 为 province_df 或 city_df 中的地区名称，已经换成地图中的名称（见 regions.py）。
+    数据来自 history_store.area，只读取前一天的分区。
+    """
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    history = history_store.area.read(
+        today - timedelta(days=1), today - timedelta(microseconds=1)
+    )
+    history = history[history.country == "中国"]
+    if level == "province":
+        history = history[history.city == ""]
+        keys = history.province
+    else:
+        history = history[(history.city != "") ^ history.province.isin(municipalities)]
+        keys = history.city.where(history.city != "", history.province)
+    # 与 names 一样换成地图中的名称，每个名称只查一次
+    unique = pd.unique(keys.to_numpy())
+    keys = keys.map(dict(zip(unique, regions.canonical(level, unique))))
+    last = history.assign(key=keys.to_numpy()).groupby("key").last()
+    last = last[list(history_columns)].rename(columns=history_columns)
+    return last.reindex(pd.unique(np.asarray(names)))
+
+
+def derive(df, baseline=None):
+    """返回 (加上派生指标列的 df, {指标: (区间边界, 区间标签)})。
+
+    baseline 为 previous_day 的返回值，为 None 时新增列均为 NaN。
+    """
+    df = df.reset_index(drop=True)
+    edges_of = bin_modes[config.bin_mode]
+    bins = {}
+    for m in metrics:
+        values = df[m].to_numpy()
+        edges = edges_of(values)
+        df[f"{m}区间"] = bin_codes(values, edges)
+        bins[m] = (edges, bin_labels(edges))
+        if baseline is None:
+            df[f"新增{m}"] = np.nan
+        else:
+            df[f"新增{m}"] = values - baseline[m].reindex(df["地区"]).to_numpy()
+    confirmed = df["确诊"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for m, name in [("治愈", "治愈率"), ("死亡", "死亡率")]:
+            df[name] = np.where(confirmed > 0, df[m] / confirmed, np.nan)
+    return df, bins
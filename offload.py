@@ -0,0 +1,90 @@
+"""
+把回调中 CPU 密集的计算放到进程池中执行。
+
+gevent 下所有连接共用一个事件循环，回调里的 pandas 计算和 figure 生成会让其他连接（包括静态文件）
+全部停下来等待。放到进程池后，当前协程只是等待结果，事件循环可以继续处理其他连接。
+
+- 进程数为 config.offload_workers，子进程以 config.render_start_method 方式启动
+- 排队和执行中的任务总数不超过 config.offload_max_pending，超过时直接拒绝（Overloaded），
+  回调应放弃本次更新，而不是继续排队拖慢所有请求
+- 每个任务最多等待 config.offload_timeout 秒（可按任务指定），超时抛出 TaskTimeout。
+  已经开始执行的任务无法中途停止，它占用的名额在执行完后才释放，所以超时的任务也计入排队数
+
+提交的函数和参数需要能被 pickle，函数须定义在模块顶层。
+"""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+class Offloader:
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(config.render_start_method)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context
+                )
+            return self._executor
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def run(self, fn, *args, timeout=None):
+        """在进程池中执行 fn(*args) 并返回结果。"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded(f"排队任务数已达上限 {self.max_pending}，拒绝 {fn.__name__}")
+            self.pending += 1
+        try:
+            future = self._pool().submit(fn, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                self.pending -= 1
+                self._executor = None
+            raise
+        future.add_done_callback(self._release)
+        timeout = timeout or self.timeout
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TaskTimeout(f"{fn.__name__} 超过 {timeout}s 没有完成")
+        except BrokenProcessPool:
+            # 子进程异常退出，下次提交时重建进程池
+            with self._lock:
+                self._executor = None
+            logger.error("进程池已损坏，将重建", exc_info=True)
+            raise
+
+
+pool = Offloader(config.offload_workers, config.offload_max_pending, config.offload_timeout)
+
+
+def run(fn, *args, timeout=None):
+    return pool.run(fn, *args, timeout=timeout)
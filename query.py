@@ -0,0 +1,343 @@
+"""
+省市时间序列查询接口。
+
+    GET /api/series/<level>/<region>?metrics=confirmed,cured&start=2020-02-01&end=2020-02-10&resolution=day&format=csv
+    GET /api/series/<level>
+
+level 为 province 或 city，region 为地区名称（也可以用别名或者带行政区划后缀的写法，见 regions.RegionResolver.match，不做前缀匹配），
+metrics 为 history_store.metric_columns 中的指标（也可以用 确诊 等中文名称），默认全部，
+start 和 end 为日期或 ISO 格式的时间，只给日期的 end 包含这一整天，
+resolution 为 config.query_resolutions 中的粒度，降采样时取每个区间内的最后一条记录（累计值），
+format 为 json（默认）或 csv。第二个地址返回该级别所有地区的名称。
+
+    GET /api/global/<country>?metrics=confirmed,dead&start=2020-02-01&end=2020-02-10&format=csv
+    GET /api/global
+
+全球各国家/地区的每日数据，来自 jhu.load() 映射的缓存文件，country 为 JHU 数据中的英文名称，
+指标为 confirmed、cured、dead（或 确诊、治愈、死亡），没有数据的日期为 null。第二个地址返回所有国家/地区的名称。
+
+数据来自 history_store.area。每个级别的记录按 (地区, 时间) 排序后保存为连续的数组，每个地区是其中的一段，
+查询时在这一段中二分查找时间范围，不需要读取和过滤整个历史数据。
+共享快照中的 area 水位线变化时才更新索引，并且只重新读取有变化的日期分区，其余分区使用上次整理好的结果。
+拉取数据的 worker 在发布新快照后就更新索引，其余 worker 在第一次查询时更新。
+"""
+
+import io
+import json
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import flask
+import numpy as np
+import pandas as pd
+
+import config
+import history_store
+import ingest
+import jhu
+import metrics
+import regions
+import shared
+import utils
+
+logger = logging.getLogger(__name__)
+
+levels = ["province", "city"]
+# 中文指标名称 -> 指标列
+metric_aliases = {v: k for k, v in metrics.history_columns.items()}
+# 指标列 -> 中文指标名称，JHU 数据中的指标用中文名称
+metric_names = dict(metrics.history_columns)
+
+
+class QueryError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# 一个日期分区中某个级别的记录，按 (codes, times) 排序，codes 为 regions 中的下标
+DayBlock = namedtuple("DayBlock", ["regions", "codes", "times", "values"])
+
+
+def day_block(level, history, municipalities):
+    """把一个日期分区的记录整理为 level 级别的 DayBlock。"""
+    history = history[history.country == "中国"]
+    if level == "province":
+        history = history[history.city == ""]
+        keys = history.province
+    else:
+        history = history[(history.city != "") ^ history.province.isin(municipalities)]
+        keys = history.city.where(history.city != "", history.province)
+    unique = pd.unique(keys.to_numpy())
+    keys = keys.map(dict(zip(unique, regions.canonical(level, unique))))
+    codes, names = pd.factorize(keys.to_numpy(), sort=True)
+    times = history.updateTime.to_numpy(dtype=np.int64)
+    order = np.lexsort((times, codes))
+    values = history[history_store.metric_columns].to_numpy(dtype=np.int64)
+    return DayBlock(list(names), codes[order], times[order], values[order])
+
+
+class SeriesIndex:
+    """一个级别所有地区的时间序列。
+
+    times 和 values 按 (地区, 时间) 排序，offsets[i]:offsets[i + 1] 为 regions[i] 的记录。
+    times 为毫秒时间戳，values 的列为 history_store.metric_columns。
+    """
+
+    def __init__(self, level, blocks):
+        """blocks 为按日期排列的 DayBlock。"""
+        self.level = level
+        self.regions = sorted(set().union(*(b.regions for b in blocks)))
+        self._index = {name: i for i, name in enumerate(self.regions)}
+        if not blocks:
+            empty = np.zeros((0, len(history_store.metric_columns)), dtype=np.int64)
+            blocks = [DayBlock([], empty[:, 0], empty[:, 0], empty)]
+        codes = np.concatenate(
+            [np.array([self._index[n] for n in b.regions], dtype=np.int64)[b.codes] for b in blocks]
+        )
+        # 每个分区内已按 (地区, 时间) 排序，分区之间按时间先后排列，按地区稳定排序即可
+        order = np.argsort(codes, kind="stable")
+        self.times = np.concatenate([b.times for b in blocks])[order]
+        self.values = np.concatenate([b.values for b in blocks])[order]
+        self.offsets = np.searchsorted(codes[order], np.arange(len(self.regions) + 1))
+
+    def __contains__(self, region):
+        return region in self._index
+
+    def series(self, region, start=None, end=None):
+        """region 在 [start, end]（毫秒时间戳）内的 (times, values)，均为视图。"""
+        i = self._index[region]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        times = self.times[lo:hi]
+        a = 0 if start is None else np.searchsorted(times, start, side="left")
+        b = len(times) if end is None else np.searchsorted(times, end, side="right")
+        return times[a:b], self.values[lo + a : lo + b]
+
+
+def downsample(times, width):
+    """按 width 秒的区间（以本地时间的零点对齐）降采样，返回每个区间内最后一条记录的下标。"""
+    if len(times) == 0:
+        return np.arange(0)
+    offset = datetime.now().astimezone().utcoffset().total_seconds()
+    buckets = (times + int(offset * 1000)) // int(width * 1000)
+    return np.flatnonzero(np.append(buckets[1:] != buckets[:-1], True))
+
+
+_days = {}  # 日期 -> (分区中文件的签名, {级别: DayBlock})
+_indexes = {}
+_index_watermark = None
+_index_lock = threading.Lock()
+
+
+def refresh(watermark):
+    """watermark 与上次不同时更新索引，只重新读取有变化的日期分区。"""
+    global _indexes, _index_watermark
+    with _index_lock:
+        if _indexes and _index_watermark == watermark:
+            return
+        partitions = history_store.area.partitions()
+        changed = [d for d, stamp in partitions.items() if _days.get(d, (None,))[0] != stamp]
+        removed = [d for d in _days if d not in partitions]
+        for day in removed:
+            del _days[day]
+        for day in changed:
+            history = history_store.area.read_day(day)
+            _days[day] = (
+                partitions[day],
+                {l: day_block(l, history, ingest.municipalities) for l in levels},
+            )
+        if changed or removed or not _indexes:
+            _indexes = {l: SeriesIndex(l, [_days[d][1][l] for d in sorted(_days)]) for l in levels}
+            logger.debug(
+                f"时间序列索引：重新读取 {len(changed)} 个日期分区，"
+                + "，".join(f"{l} {len(_indexes[l].regions)} 个地区" for l in levels)
+            )
+        _index_watermark = watermark
+
+
+def get_index(level, watermark):
+    """返回 level 的 SeriesIndex，watermark 与建立索引时不同时更新索引。"""
+    refresh(watermark)
+    return _indexes[level]
+
+
+def parse_time(value, end=False):
+    """返回毫秒时间戳，value 为空时返回 None。"""
+    if not value:
+        return None
+    try:
+        t = datetime.fromisoformat(value)
+    except ValueError:
+        raise QueryError(f"无法解析时间 {value}")
+    if end and len(value) == 10:
+        t += timedelta(days=1) - timedelta(milliseconds=1)
+    return int(t.timestamp() * 1000)
+
+
+def parse_metrics(value):
+    if not value:
+        return list(history_store.metric_columns)
+    names = []
+    for name in value.split(","):
+        name = metric_aliases.get(name.strip(), name.strip())
+        if name not in history_store.metric_columns:
+            raise QueryError(f"未知指标 {name}，可选 {history_store.metric_columns}")
+        names.append(name)
+    return names
+
+
+def query(level, region, metrics=None, start=None, end=None, resolution="raw", watermark=None):
+    """返回 {level, region, resolution, metrics, time, values}，time 为毫秒时间戳列表，values 为 {指标: 列表}。"""
+    if level not in levels:
+        raise QueryError(f"未知级别 {level}，可选 {levels}")
+    if resolution not in config.query_resolutions:
+        raise QueryError(f"未知粒度 {resolution}，可选 {list(config.query_resolutions)}")
+    metrics = parse_metrics(metrics)
+    start, end = parse_time(start), parse_time(end, end=True)
+    if start is not None and end is not None and start > end:
+        raise QueryError("start 晚于 end")
+    index = get_index(level, watermark)
+    name = region if region in index else regions.resolver(level).match(region)
+    if name not in index:
+        raise QueryError(f"没有 {region} 的数据", status=404)
+    times, values = index.series(name, start, end)
+    width = config.query_resolutions[resolution]
+    if width is not None:
+        keep = downsample(times, width)
+        times, values = times[keep], values[keep]
+    columns = [history_store.metric_columns.index(m) for m in metrics]
+    return {
+        "level": level,
+        "region": name,
+        "resolution": resolution,
+        "metrics": metrics,
+        "time": times.tolist(),
+        "values": {m: values[:, c].tolist() for m, c in zip(metrics, columns)},
+    }
+
+
+def global_series():
+    series = jhu.load()
+    if series is None:
+        raise QueryError("没有 JHU 数据", status=503)
+    return series
+
+
+def query_global(country, metrics=None, start=None, end=None):
+    """返回 {country, metrics, date, values}，date 为日期字符串列表，values 为 {指标: 列表}，缺失值为 None。"""
+    series = global_series()
+    if country not in series:
+        raise QueryError(f"没有 {country} 的数据", status=404)
+    names = []
+    for name in parse_metrics(metrics):
+        name = metric_names[name]
+        if name not in series.metrics:
+            raise QueryError(f"JHU 数据中没有指标 {name}，可选 {series.metrics}")
+        names.append(name)
+    df = series.country(country)[names]
+    start, end = parse_time(start), parse_time(end, end=True)
+    if start is not None:
+        df = df[df.index >= utils.timestamps2datetimes([start])[0]]
+    if end is not None:
+        df = df[df.index <= utils.timestamps2datetimes([end])[0]]
+    return {
+        "country": country,
+        "metrics": [metric_aliases[m] for m in names],
+        "date": df.index.strftime("%Y-%m-%d").tolist(),
+        "values": {
+            metric_aliases[m]: [None if np.isnan(v) else v for v in df[m].tolist()] for m in names
+        },
+    }
+
+
+def to_csv(result):
+    """time 列为本地时间，其余每个指标一列。"""
+    df = pd.DataFrame(result["values"], columns=result["metrics"])
+    df.insert(0, "time", utils.timestamps2datetimes(result["time"]))
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    return buffer.getvalue()
+
+
+def _watermark():
+    snapshot = shared.get_snapshot(config.snapshot_wait_timeout)
+    if snapshot is None:
+        raise QueryError("数据还没有准备好", status=503)
+    return snapshot.area_watermark
+
+
+def register_routes(server):
+    """在 Flask server 上注册查询接口。"""
+
+    shared.subscribe(lambda snapshot: refresh(snapshot.area_watermark))
+
+    @server.errorhandler(QueryError)
+    def query_error(e):
+        return flask.jsonify({"error": str(e)}), e.status
+
+    @server.route(config.global_url_prefix)
+    def list_countries():
+        return flask.jsonify(global_series().countries)
+
+    @server.route(f"{config.global_url_prefix}/<country>")
+    def global_country(country):
+        args = flask.request.args
+        fmt = args.get("format", "json")
+        if fmt not in ("json", "csv"):
+            raise QueryError(f"未知格式 {fmt}，可选 json、csv")
+        result = query_global(
+            country, metrics=args.get("metrics"), start=args.get("start"), end=args.get("end")
+        )
+        if fmt == "csv":
+            df = pd.DataFrame(result["values"], columns=result["metrics"])
+            df.insert(0, "date", result["date"])
+            return flask.Response(
+                df.to_csv(index=False),
+                mimetype="text/csv",
+                headers={
+                    "Content-Disposition": "attachment; filename*=UTF-8''"
+                    + quote(f"global-{country}.csv")
+                },
+            )
+        return flask.Response(
+            json.dumps(result, ensure_ascii=False, separators=(",", ":")),
+            mimetype="application/json",
+        )
+
+    @server.route(f"{config.query_url_prefix}/<level>")
+    def list_regions(level):
+        if level not in levels:
+            raise QueryError(f"未知级别 {level}，可选 {levels}")
+        return flask.jsonify(get_index(level, _watermark()).regions)
+
+    @server.route(f"{config.query_url_prefix}/<level>/<region>")
+    def series(level, region):
+        args = flask.request.args
+        fmt = args.get("format", "json")
+        if fmt not in ("json", "csv"):
+            raise QueryError(f"未知格式 {fmt}，可选 json、csv")
+        result = query(
+            level,
+            region,
+            metrics=args.get("metrics"),
+            start=args.get("start"),
+            end=args.get("end"),
+            resolution=args.get("resolution", "raw"),
+            watermark=_watermark(),
+        )
+        if fmt == "csv":
+            return flask.Response(
+                to_csv(result),
+                mimetype="text/csv",
+                headers={
+                    "Content-Disposition": "attachment; filename*=UTF-8''"
+                    + quote(f"{level}-{result['region']}.csv")
+                },
+            )
+        return flask.Response(
+            json.dumps(result, ensure_ascii=False, separators=(",", ":")),
+            mimetype="application/json",
+        )
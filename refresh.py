@@ -0,0 +1,96 @@
+"""
+数据文件的刷新协调。
+
+同一组数据文件同一时刻只允许一个线程（跨进程也一样）刷新：进程内用条件变量通知等待者，
+进程间用文件锁。文件总是先写到临时文件再重命名，读者不会读到写了一半的文件。
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path, write):
+    """调用 write(临时文件路径) 写入数据，成功后原子地替换 path。"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(prefix=f".{path.name}-", dir=path.parent)
+    os.close(fd)
+    try:
+        write(tmpname)
+        os.replace(tmpname, path)
+    except BaseException:
+        if Path(tmpname).exists():
+            Path(tmpname).unlink()
+        raise
+
+
+def atomic_to_csv(df, path):
+    atomic_write(path, lambda tmpname: df.to_csv(tmpname, encoding="utf8"))
+
+
+def is_fresh(path, max_age):
+    path = Path(path)
+    return path.exists() and time.time() - path.stat().st_mtime < max_age
+
+
+@contextmanager
+def file_lock(lock_path):
+    """跨进程的互斥锁，没有 fcntl 的平台上不加锁。"""
+    if fcntl is None:
+        yield
+        return
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "w") as f:
+        # 阻塞直到其他进程释放锁，由内核唤醒
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RefreshCoordinator:
+    def __init__(self, lock_path):
+        self.lock_path = Path(lock_path)
+        self._cond = threading.Condition()
+        self._running = False
+        self._generation = 0
+
+    def refresh(self, paths, max_age, produce):
+        """paths 中有文件不存在或早于 max_age 秒时调用 produce() 重新生成。
+
+        如果本进程中已有线程在刷新，则等它完成后直接返回；拿到文件锁后会再检查一次，
+        因为其他进程可能刚刚刷新过。返回是否由本次调用执行了 produce。
+        """
+        with self._cond:
+            if self._running:
+                generation = self._generation
+                while self._generation == generation:
+                    self._cond.wait()
+                return False
+            self._running = True
+        try:
+            with file_lock(self.lock_path):
+                if all(is_fresh(p, max_age) for p in paths):
+                    logger.debug(f"{[str(p) for p in paths]} 仍然有效，无需刷新")
+                    return False
+                produce()
+                return True
+        finally:
+            with self._cond:
+                self._running = False
+                self._generation += 1
+                self._cond.notify_all()
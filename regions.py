@@ -0,0 +1,210 @@
+"""
+把上游数据中的地区名称对应到地图边界中的名称。
+
+上游的名称写法不统一（武汉、武汉市、恩施州、吐鲁番地区……），对应不上的地区在地图上不显示。
+RegionResolver 用地图边界中的名称建立索引，依次尝试：
+
+1. exact：与地图中的名称完全相同
+2. alias：config.region_aliases 中的别名
+3. normalized：去掉行政区划后缀（市、州、地区、自治区……）后相同，只去掉真正的后缀，而不是逐个字符去掉
+4. prefix：去掉后缀后，地图中的某个名称是它的前缀，或者它是地图中唯一一个名称的前缀
+   （如 黔东南州 -> 黔东南苗族侗族，海西州 -> 海西蒙古族藏族自治州直辖）
+
+上游数据中的名称按名称缓存结果，之后同一名称的查找只是一次字典查询；外部传入的名称用 match 查找，不缓存，也不做前缀匹配。每轮拉取结束后 report 输出各方式的命中率和没有对应上的名称，
+对应不上的行保留原名称，不会被丢弃。
+"""
+
+import logging
+import threading
+from collections import Counter
+
+import config
+import geometry
+
+logger = logging.getLogger(__name__)
+
+# 从长到短排列，优先去掉最长的后缀
+suffixes = sorted(
+    [
+        "特别行政区",
+        "维吾尔自治区",
+        "壮族自治区",
+        "回族自治区",
+        "自治区",
+        "自治州",
+        "自治县",
+        "地区",
+        "林区",
+        "省",
+        "市",
+        "州",
+        "盟",
+        "县",
+    ],
+    key=len,
+    reverse=True,
+)
+methods = ["exact", "alias", "normalized", "prefix", "unmatched"]
+
+
+def normalize(name):
+    """去掉名称末尾的一个行政区划后缀，去掉后不足 config.region_min_length 个字时保留原名称。
+
+    config.exceptions 中的名称不做处理。
+    """
+    name = name.strip()
+    if name in config.exceptions:
+        return name
+    for suffix in suffixes:
+        if name.endswith(suffix) and len(name) - len(suffix) >= config.region_min_length:
+            return name[: -len(suffix)]
+    return name
+
+
+class PrefixTrie:
+    """按字符建立的前缀树，每个节点记录以它为前缀的名称个数。"""
+
+    def __init__(self, names=()):
+        self.root = {}
+        for name in names:
+            self.insert(name)
+
+    def insert(self, name):
+        node = self.root
+        for ch in name:
+            node = node.setdefault(ch, {})
+            node["#"] = node.get("#", 0) + 1
+            node["last"] = name
+        node["$"] = name
+
+    def longest_prefix(self, query):
+        """树中是 query 前缀的最长名称，没有时返回 None。"""
+        node, found = self.root, None
+        for ch in query:
+            node = node.get(ch)
+            if node is None:
+                break
+            found = node.get("$", found)
+        return found
+
+    def unique_completion(self, query):
+        """以 query 为前缀的名称只有一个时返回它，否则返回 None。"""
+        node = self.root
+        for ch in query:
+            node = node.get(ch)
+            if node is None:
+                return None
+        return node["last"] if node.get("#") == 1 else None
+
+
+class RegionResolver:
+    def __init__(self, names, aliases=None):
+        self.names = [n for n in dict.fromkeys(names) if n]
+        self._known = set(self.names)
+        self.aliases = {}
+        for alias, target in (aliases or {}).items():
+            if target in self._known:
+                self.aliases[alias] = target
+            else:
+                logger.warning(f"别名 {alias} 对应的 {target} 不在地图中")
+        self._normalized = {}
+        ambiguous = set()
+        for name in self.names:
+            key = normalize(name)
+            if key in self._normalized and self._normalized[key] != name:
+                ambiguous.add(key)
+            self._normalized[key] = name
+        for key in ambiguous:
+            logger.warning(f"{key} 对应多个地区，不按去掉后缀后的名称匹配")
+            del self._normalized[key]
+        self._trie = PrefixTrie(self._normalized)
+        self._memo = {}
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.unmatched = Counter()
+
+    def _lookup(self, name):
+        if name in self._known:
+            return name, "exact"
+        if name in self.aliases:
+            return self.aliases[name], "alias"
+        key = normalize(name)
+        if key in self.aliases:
+            return self.aliases[key], "alias"
+        if key in self._normalized:
+            return self._normalized[key], "normalized"
+        if len(key) >= config.region_min_length:
+            found = self._trie.longest_prefix(key)
+            if found is not None and len(found) >= config.region_min_length:
+                return self._normalized[found], "prefix"
+            found = self._trie.unique_completion(key)
+            if found is not None:
+                return self._normalized[found], "prefix"
+        return None, "unmatched"
+
+    def resolve(self, name):
+        """返回地图中对应的名称，对应不上时返回 None。"""
+        hit = self._memo.get(name)
+        if hit is None:
+            hit = self._memo[name] = self._lookup(name)
+        canonical, method = hit
+        with self._lock:
+            self.counts[method] += 1
+            if canonical is None:
+                self.unmatched[name] += 1
+        return canonical
+
+    def match(self, name, methods=("exact", "alias", "normalized")):
+        """只按 methods 中的方式查找，返回地图中对应的名称，对应不上时返回 None。
+
+        用于外部传入的名称（如查询接口），结果不缓存，也不计入 report 的统计。
+        默认不做前缀匹配，以免 湖北火星 这样的名称对应到 湖北。
+        """
+        hit = self._memo.get(name)
+        canonical, method = hit if hit is not None else self._lookup(name)
+        return canonical if method in methods else None
+
+    def canonical(self, names):
+        """逐个转换为地图中的名称，对应不上的保留原名称。"""
+        result = []
+        for name in names:
+            canonical = self.resolve(name)
+            result.append(name if canonical is None else canonical)
+        return result
+
+    def report(self, label=""):
+        """输出并清空上次 report 以来各匹配方式的命中次数和没有对应上的名称，返回 (次数, 没有对应上的名称)。"""
+        with self._lock:
+            counts, unmatched = self.counts, self.unmatched
+            self.counts, self.unmatched = Counter(), Counter()
+        total = sum(counts.values())
+        if total:
+            rates = "，".join(f"{m} {counts[m] / total:.1%}" for m in methods if counts[m])
+            logger.info(f"{label}地区名称 {total} 个：{rates}")
+        if unmatched:
+            logger.warning(f"{label}地区名称没有对应上：{'、'.join(sorted(unmatched))}")
+        return counts, unmatched
+
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def resolver(level):
+    """返回 level（province 或 city）的 RegionResolver，名称来自 config.region_sources 中的地图边界。"""
+    with _resolvers_lock:
+        if level not in _resolvers:
+            path, key = config.region_sources[level]
+            names = geometry.property_values(path, key)
+            _resolvers[level] = RegionResolver(names, config.region_aliases.get(level))
+            logger.debug(f"{level} 地区名称索引：{len(_resolvers[level].names)} 个名称")
+        return _resolvers[level]
+
+
+def canonical(level, names):
+    return resolver(level).canonical(names)
+
+
+def report():
+    """输出各级别本轮的匹配情况，每轮拉取结束后调用。"""
+    return {level: r.report(f"[{level}] ") for level, r in list(_resolvers.items())}
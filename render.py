@@ -0,0 +1,169 @@
+"""
+动态变化图的逐帧渲染。
+
+帧在一个进程池中并行渲染，每个子进程只加载一次地图。有两种渲染器：matplotlib 每帧重新绘制多边形，
+raster 预先栅格化省份后每帧只做一次数组索引，速度快得多，见 config.frame_renderer。
+"""
+
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_renderer = None
+
+
+def _pyplot():
+    """matplotlib 只在渲染进程中用到，延迟导入以加快主进程启动。"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+class MatplotlibRenderer:
+    """用 geopandas 逐帧重新绘制所有多边形。"""
+
+    def __init__(self, geojson_path, dpi):
+        import geopandas
+
+        self.geomap = geopandas.read_file(geojson_path)
+        self.dpi = dpi
+
+    def render(self, label, values):
+        """返回 (高, 宽, 3) 的 uint8 数组。"""
+        plt = _pyplot()
+        plot_series = pd.Series(values) + 1
+        ax = self.geomap.plot(plot_series.map(np.log), figsize=(5, 3))
+        fig = ax.figure
+        fig.set_dpi(self.dpi)
+        plt.axis("off")
+        plt.text(93, 50, label, fontsize=10)
+        plt.tight_layout()
+        fig.canvas.draw()
+        frame = np.array(fig.canvas.buffer_rgba())[:, :, :3]
+        plt.close(fig)
+        return frame
+
+
+class RasterRenderer:
+    """先把省份栅格化为一张标签图，之后每一帧只需用颜色查找表索引这张图。
+
+    标签图中每个像素的值为所在省份的序号加 1，0 表示背景。时间戳的每个字符也预先渲染好，
+    每帧只需拼接字符遮罩。
+    """
+
+    chars = "0123456789-: "
+
+    def __init__(self, geojson_path, dpi, cmap="viridis"):
+        import geopandas
+
+        geomap = geopandas.read_file(geojson_path)
+        self.width, self.height = int(5 * dpi), int(3 * dpi)
+        self.cmap = _pyplot().get_cmap(cmap)
+        self.labels, self.text_origin = self._rasterize(geomap, dpi)
+        self.glyphs = self._render_glyphs(dpi)
+
+    def _rasterize(self, geomap, dpi):
+        plt = _pyplot()
+        fig = plt.figure(figsize=(5, 3), dpi=dpi, facecolor="black")
+        ax = fig.add_axes([0.02, 0.02, 0.96, 0.96])
+        ax.axis("off")
+        # 用 RGB 编码省份序号，关闭抗锯齿保证颜色不被混合
+        ids = np.arange(1, len(geomap) + 1)
+        colors = np.stack([(ids >> 16) & 255, (ids >> 8) & 255, ids & 255], axis=1) / 255
+        geomap.plot(ax=ax, color=colors, linewidth=0, antialiased=False)
+        fig.canvas.draw()
+        rgb = np.asarray(fig.canvas.buffer_rgba())[:, :, :3].astype(np.int32)
+        labels = (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+        labels[labels > len(geomap)] = 0
+        x, y = ax.transData.transform((93, 50))
+        plt.close(fig)
+        return labels, (int(x), int(self.height - y))
+
+    def _render_glyphs(self, dpi):
+        plt = _pyplot()
+        glyphs = {}
+        for c in self.chars:
+            fig = plt.figure(figsize=(0.1, 0.18), dpi=dpi, facecolor="white")
+            fig.text(0, 0.2, c, fontsize=10, family="monospace", color="black")
+            fig.canvas.draw()
+            gray = np.asarray(fig.canvas.buffer_rgba())[:, :, 0]
+            glyphs[c] = 1 - gray / 255
+            plt.close(fig)
+        return glyphs
+
+    def render(self, label, values):
+        """返回 (高, 宽, 3) 的 uint8 数组。"""
+        logs = np.log(np.asarray(values, dtype=float) + 1)
+        span = logs.max() - logs.min()
+        normed = (logs - logs.min()) / span if span > 0 else np.zeros_like(logs)
+        lut = np.empty((len(logs) + 1, 3), dtype=np.uint8)
+        lut[0] = 255
+        lut[1:] = (self.cmap(normed)[:, :3] * 255).astype(np.uint8)
+        frame = lut[self.labels]
+        mask = np.concatenate([self.glyphs[c] for c in label], axis=1)
+        # text_origin 为文字基线的左端点，与 plt.text 一致
+        x, y = self.text_origin
+        h, w = mask.shape
+        y = max(0, y - h)
+        h, w = min(h, self.height - y), min(w, self.width - x)
+        region = frame[y : y + h, x : x + w]
+        region[:] = (region * (1 - mask[:h, :w, None])).astype(np.uint8)
+        return frame
+
+
+renderers = {"matplotlib": MatplotlibRenderer, "raster": RasterRenderer}
+
+
+def _init_worker(renderer, geojson_path, dpi):
+    global _renderer
+    _renderer = renderers[renderer](geojson_path, dpi)
+
+
+def _render_frame(task):
+    label, values = task
+    return _renderer.render(label, values)
+
+
+def frame_size(dpi):
+    """两种渲染器输出的帧大小都是 5 × 3 英寸，返回像素 (宽, 高)。"""
+    return int(5 * dpi), int(3 * dpi)
+
+
+def iter_frames(bucket_times, values, geojson_path, dpi, workers=None, renderer=None):
+    """按顺序逐帧返回每个时间桶渲染出的 (高, 宽, 3) uint8 数组。
+
+    values 的形状为 (桶数, 省份数)，省份顺序与 geojson_path 中的要素顺序一致。
+    workers 为进程数，默认为 config.render_workers；renderer 为 renderers 中的键，
+    默认为 config.frame_renderer。同一时刻最多只有 2 × workers 帧在渲染或等待被取走，
+    调用方取得慢时渲染也会随之停下。
+    """
+    workers = workers or config.render_workers
+    renderer = renderer or config.frame_renderer
+    tasks = [
+        (dt.strftime("%Y-%m-%d %H:%M:%S"), values[i]) for i, dt in enumerate(bucket_times)
+    ]
+    logger.info(f"使用 {workers} 个进程和 {renderer} 渲染器渲染 {len(tasks)} 帧")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(config.render_start_method),
+        initializer=_init_worker,
+        initargs=(renderer, geojson_path, dpi),
+    ) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(_render_frame, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
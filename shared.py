@@ -0,0 +1,214 @@
+"""
+多个 gunicorn worker 之间共享快照和数据拉取。
+
+- 通过文件锁选出一个 leader，只有 leader 运行 ingest 拉取数据，每个快照先写入共享文件再发布
+- 其余 worker 映射这个文件读取快照（见 bundle.py），每次读取前 stat 一次，文件被替换时才重新读取
+- leader 退出后文件锁由系统释放，其余 worker 定期尝试获取，由第一个拿到锁的接替拉取数据
+
+这样增加 worker 只增加处理请求的能力，不会增加上游请求和数据拉取占用的内存。
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import bundle
+import config
+import ingest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+snapshot_path = Path(config.shared_dir) / "snapshot.bin"
+lock_path = Path(config.shared_dir) / "leader.lock"
+frames = ["overall", "province_df", "city_df", "daily", "daily_diff"]
+
+_lock_file = None
+_is_leader = False
+_thread = None
+_bundle = None
+_snapshot = None
+_read_lock = threading.Lock()
+_listeners = []
+
+
+def _put_frame(name, df, meta, arrays):
+    """数值和时间列写为数组，字符串列放在 meta 中。"""
+    columns = []
+    for c in df.columns:
+        values = df[c].to_numpy()
+        key = f"{name}.{c}"
+        if values.dtype == object:
+            meta["strings"][key] = [str(v) for v in values]
+            columns.append([c, "strings"])
+        elif np.issubdtype(values.dtype, np.datetime64):
+            arrays[key] = values.astype("datetime64[ns]").view(np.int64)
+            columns.append([c, "datetime"])
+        else:
+            arrays[key] = values
+            columns.append([c, "array"])
+    index = None
+    if isinstance(df.index, pd.DatetimeIndex):
+        arrays[f"{name}.index"] = df.index.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        index = "datetime"
+    meta["frames"][name] = {"columns": columns, "index": index}
+
+
+def _get_frame(name, b):
+    spec = b.meta["frames"][name]
+    data = {}
+    for c, kind in spec["columns"]:
+        key = f"{name}.{c}"
+        if kind == "strings":
+            data[c] = b.meta["strings"][key]
+        elif kind == "datetime":
+            data[c] = b.arrays[key].view("datetime64[ns]")
+        else:
+            data[c] = b.arrays[key]
+    index = None
+    if spec["index"] == "datetime":
+        index = pd.DatetimeIndex(b.arrays[f"{name}.index"].view("datetime64[ns]"))
+    return pd.DataFrame(data, index=index, columns=[c for c, _ in spec["columns"]])
+
+
+def encode(snapshot):
+    """返回 (meta, arrays)，用于 bundle.write_bundle。"""
+    meta = {
+        "version": snapshot.version,
+        "fetch_time": snapshot.fetch_time.isoformat(),
+        "area_watermark": snapshot.area_watermark,
+        "bins": {
+            level: {
+                m: [np.asarray(edges).tolist(), list(labels)]
+                for m, (edges, labels) in bins.items()
+            }
+            for level, bins in snapshot.bins.items()
+        },
+        "frames": {},
+        "strings": {},
+    }
+    arrays = {}
+    for name in frames:
+        _put_frame(name, getattr(snapshot, name), meta, arrays)
+    return meta, arrays
+
+
+def decode(b):
+    meta = b.meta
+    return ingest.Snapshot(
+        version=meta["version"],
+        fetch_time=datetime.fromisoformat(meta["fetch_time"]),
+        bins={
+            level: {m: (np.asarray(edges), labels) for m, (edges, labels) in bins.items()}
+            for level, bins in meta["bins"].items()
+        },
+        area_watermark=meta["area_watermark"],
+        **{name: _get_frame(name, b) for name in frames},
+    )
+
+
+def write(snapshot):
+    """ingest 发布快照之前写入共享文件，写入失败时 ingest 不发布这个快照。"""
+    bundle.write_bundle(snapshot_path, *encode(snapshot))
+    logger.debug(f"快照版本 {snapshot.version} 已写入 {snapshot_path}")
+
+
+def _notify(snapshot):
+    for listener in list(_listeners):
+        try:
+            listener(snapshot)
+        except Exception:
+            logger.error(f"快照监听函数 {listener} 出错。", exc_info=True)
+
+
+def subscribe(listener):
+    """注册一个函数，本进程发布的快照写入共享文件后以快照为参数调用它。只有 leader 会发布快照。"""
+    _listeners.append(listener)
+
+
+def read_snapshot():
+    """返回共享文件中的快照，没有文件时返回 None。文件没有被替换时直接返回上次读取的结果。"""
+    global _bundle, _snapshot
+    current = bundle.stamp(snapshot_path)
+    if current is None:
+        return None
+    with _read_lock:
+        if _bundle is None or _bundle.stamp != current:
+            b = bundle.Bundle(snapshot_path)
+            _snapshot, _bundle = decode(b), b
+            logger.debug(f"读取共享快照版本 {_snapshot.version}")
+        return _snapshot
+
+
+def _try_lead():
+    global _lock_file
+    if fcntl is None:
+        return True
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(lock_path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    # 文件保持打开，进程退出时锁自动释放
+    _lock_file = f
+    return True
+
+
+def _lead():
+    global _is_leader
+    previous = read_snapshot()
+    if previous is not None:
+        ingest.resume(previous)
+    ingest.add_writer(write)
+    ingest.subscribe(_notify)
+    _is_leader = True
+    ingest.start()
+    logger.info(f"进程 {os.getpid()} 负责拉取数据")
+
+
+def _follow():
+    while not _try_lead():
+        time.sleep(config.leader_retry_interval)
+    _lead()
+
+
+def start():
+    """拿到文件锁则开始拉取数据，否则在后台定期尝试接替。重复调用无副作用。"""
+    global _thread
+    if _is_leader or (_thread is not None and _thread.is_alive()):
+        return
+    if _try_lead():
+        _lead()
+        return
+    logger.info(f"进程 {os.getpid()} 读取其他进程拉取的数据")
+    _thread = threading.Thread(target=_follow, name="shared-follow", daemon=True)
+    _thread.start()
+
+
+def get_snapshot(timeout=None):
+    """返回最新快照。还没有任何快照时最多等待 timeout 秒，超时返回 None。"""
+    if _is_leader:
+        return ingest.get_snapshot(timeout)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        snapshot = read_snapshot()
+        if snapshot is not None:
+            return snapshot
+        if _is_leader:
+            # 等待期间本进程接替成为了 leader
+            return ingest.get_snapshot(timeout)
+        if deadline is not None and time.time() >= deadline:
+            return None
+        time.sleep(0.5)
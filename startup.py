@@ -0,0 +1,29 @@
+"""
+启动耗时统计。
+
+app.py 最先导入本模块，之后每完成一个阶段调用一次 mark，最后调用 report 输出各阶段的耗时。
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_start = time.perf_counter()
+_last = _start
+_phases = []
+
+
+def mark(phase):
+    """记录从上一次 mark（或导入本模块）到现在的耗时，记为 phase 阶段。"""
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+
+def report():
+    total = _last - _start
+    lines = [f"{phase:<16}{elapsed * 1000:>8.0f}ms" for phase, elapsed in _phases]
+    logger.info(f"启动耗时 {total * 1000:.0f}ms：\n" + "\n".join(lines))
+    return list(_phases)
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import buckets
+
+locations = ["湖北省", "广东省", "浙江省", "河南省", "北京市"]
+
+
+def reference(history, locations, width):
+    """原来 generate_figures 中逐行处理的实现，返回 (桶起点时间列表, 桶数 × 省份数 × 指标数的数组)。"""
+    history = history.sort_values(by="time", ascending=True, ignore_index=True)
+    baseline = history.loc[0, "time"]
+    times_dict = OrderedDict()
+    for row in history.itertuples(index=False):
+        if (row.time - baseline).seconds >= width:
+            baseline = row.time
+        if baseline not in times_dict:
+            times_dict[baseline] = {}
+        record = [row.confirmed, row.suspected, row.cured, row.dead, row.time]
+        if row.province in times_dict[baseline]:
+            if row.time > times_dict[baseline][row.province][-1]:
+                times_dict[baseline][row.province] = record
+        else:
+            times_dict[baseline][row.province] = record
+
+    last_time = list(times_dict.keys())[0]
+    for k, v in times_dict.items():
+        diff = set(times_dict[last_time].keys()) - set(v.keys())
+        if diff:
+            times_dict[k].update({p: times_dict[last_time][p] for p in diff})
+        last_time = k
+
+    values = np.array(
+        [
+            [times_dict[k][p][:4] if p in times_dict[k] else [0, 0, 0, 0] for p in locations]
+            for k in times_dict
+        ],
+        dtype=float,
+    )
+    return list(times_dict), values
+
+
+def random_history(seed, n, days):
+    rng = np.random.default_rng(seed)
+    # 不重复的时间，避免同一时间的记录在两种实现中排序不同
+    seconds = rng.choice(days * 86400, size=n, replace=False)
+    return pd.DataFrame(
+        {
+            "province": rng.choice(locations + ["台湾"], size=n),
+            "time": pd.Timestamp("2020-01-22") + pd.to_timedelta(seconds, unit="s"),
+            **{m: rng.integers(0, 10000, size=n) for m in buckets.metric_columns},
+        }
+    )
+
+
+@pytest.mark.parametrize("seed,n,days,width", [(0, 5000, 10, 1800), (1, 300, 3, 600), (2, 50, 1, 3600)])
+def test_matches_reference(seed, n, days, width):
+    history = random_history(seed, n, days)
+    expected_times, expected = reference(history, locations, width)
+    times, values = buckets.bucketize(history, locations, width)
+    assert list(times) == expected_times
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_unsorted_input():
+    history = random_history(3, 500, 2)
+    shuffled = history.sample(frac=1, random_state=0)
+    times, values = buckets.bucketize(shuffled, locations, 1800)
+    expected_times, expected = buckets.bucketize(history, locations, 1800)
+    assert list(times) == list(expected_times)
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_gap_longer_than_a_day():
+    """原实现用 timedelta.seconds，相隔 1 天 10 分钟的两条记录会落入同一个桶，这里分为两个桶。"""
+    t0 = pd.Timestamp("2020-02-01 08:00")
+    history = pd.DataFrame(
+        {
+            "province": ["湖北省", "湖北省"],
+            "time": [t0, t0 + pd.Timedelta(days=1, minutes=10)],
+            "confirmed": [1, 2],
+            "suspected": [0, 0],
+            "cured": [0, 0],
+            "dead": [0, 0],
+        }
+    )
+    old_times, old = reference(history, locations, 1800)
+    assert old_times == [t0]
+    times, values = buckets.bucketize(history, locations, 1800)
+    assert list(times) == [t0, t0 + pd.Timedelta(days=1, minutes=10)]
+    assert values[:, 0, 0].tolist() == [1, 2]
+
+
+def test_empty():
+    empty = random_history(4, 10, 1).iloc[:0]
+    times, values = buckets.bucketize(empty, locations, 1800)
+    assert len(times) == 0 and values.shape == (0, len(locations), 4)
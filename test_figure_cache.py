@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import namedtuple
+
+import figure_cache
+
+Snapshot = namedtuple("Snapshot", ["version"])
+
+
+def test_concurrent_misses_build_once():
+    calls = []
+
+    def builder(snapshot, level):
+        calls.append((snapshot.version, level))
+        time.sleep(0.2)
+        return {"version": snapshot.version, "level": level}
+
+    cache = figure_cache.FigureCache(builder)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(Snapshot(1), "province")))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [(1, "province")]
+    assert results == [{"version": 1, "level": "province"}] * 8
+    assert cache.get(Snapshot(1), "province") is results[0]
+    assert len(calls) == 1
+
+
+def test_error_is_shared_and_not_cached():
+    calls = []
+    started = threading.Event()
+
+    def builder(snapshot, level):
+        calls.append(level)
+        started.set()
+        time.sleep(0.2)
+        if len(calls) == 1:
+            raise RuntimeError("busy")
+        return level
+
+    cache = figure_cache.FigureCache(builder)
+    errors = []
+
+    def get():
+        try:
+            cache.get(Snapshot(1), "city")
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=get)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=get)
+    follower.start()
+    leader.join()
+    follower.join()
+    assert len(calls) == 1 and len(errors) == 2
+    # 失败的结果不缓存，下一次重新生成
+    assert cache.get(Snapshot(1), "city") == "city"
+    assert len(calls) == 2
+
+
+def test_new_version_drops_old_figures():
+    cache = figure_cache.FigureCache(lambda snapshot, level: (snapshot.version, level))
+    cache.get(Snapshot(1), "province")
+    cache.get(Snapshot(2), "province")
+    assert list(cache._figures) == [(2, "province")]
+    # 旧快照生成的 figure 不放进缓存
+    assert cache.get(Snapshot(1), "city") == (1, "city")
+    assert list(cache._figures) == [(2, "province")]
@@ -0,0 +1,126 @@
+import gzip
+import json
+import threading
+import urllib.request
+from pathlib import Path
+
+import flask
+import pytest
+from werkzeug.serving import make_server
+
+import config
+import geometry
+
+root = Path(__file__).parent
+provinces = root / "data" / "china_provinces_v3.geojson"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(geometry, "cache_dir", tmp_path)
+    geometry._compact.clear()
+    yield tmp_path
+    geometry._compact.clear()
+
+
+@pytest.fixture
+def server(cache_dir):
+    resource = geometry.GeometryResource("provinces", provinces, "original")
+    app = flask.Flask(__name__)
+    geometry.register_resources(app, [resource])
+    httpd = make_server("127.0.0.1", 0, app)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}", resource
+    httpd.shutdown()
+
+
+def _get(url, **headers):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as resp:
+        return resp, resp.read()
+
+
+def test_compact_round_trip(cache_dir):
+    with open(provinces, encoding="utf8") as f:
+        original = json.load(f)
+    compact = geometry.CompactGeometry.from_geojson(original)
+    assert compact.to_geojson() == original
+    assert geometry.load_compact(provinces, "original").to_geojson() == original
+    as_dict, as_arrays = geometry.footprint(original)
+    assert as_arrays < as_dict
+
+
+def test_digest_cached_until_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "a.geojson"
+    path.write_text("{}")
+    first = geometry._digest(path)
+    reads = []
+    read_bytes = Path.read_bytes
+    monkeypatch.setattr(Path, "read_bytes", lambda self: reads.append(self) or read_bytes(self))
+    assert geometry._digest(path) == first and reads == []
+    tmp = tmp_path / "b.geojson"
+    tmp.write_text('{"type": "FeatureCollection"}')
+    tmp.replace(path)
+    assert geometry._digest(path) != first and len(reads) == 1
+
+
+def _collection(*geometries):
+    return {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {}, "geometry": g} for g in geometries],
+    }
+
+
+def test_invalid_features():
+    square = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    bowtie = [[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]
+    spike = [[0, 0], [1, 0], [2, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    pinched = [[0, 0], [2, 0], [1, 1], [2, 2], [0, 2], [1, 1], [0, 0]]
+    touching = [[[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]]
+    overlapping = [[[0.5, 0.5], [2, 0.5], [2, 2], [0.5, 2], [0.5, 0.5]]]
+    geojson = _collection(
+        {"type": "Polygon", "coordinates": [square]},
+        {"type": "Polygon", "coordinates": [bowtie]},
+        {"type": "Polygon", "coordinates": [spike]},
+        {"type": "Polygon", "coordinates": [pinched]},
+        {"type": "MultiPolygon", "coordinates": [[square], touching]},
+        {"type": "MultiPolygon", "coordinates": [[square], overlapping]},
+        None,
+    )
+    assert geometry.invalid_features(geojson) == [1, 2, 3, 5]
+
+
+@pytest.mark.parametrize("level", ["medium", "low"])
+def test_simplified_is_valid(level):
+    """按原来逐段简化的做法，medium 有 8 个省份、low 有 5 个省份自相交。"""
+    with open(provinces, encoding="utf8") as f:
+        original = json.load(f)
+    tolerance, digits = config.geometry_levels[level]
+    simplified = geometry.simplify_geojson(original, tolerance, digits)
+    assert geometry.invalid_features(simplified) == []
+    assert geometry.count_vertices(simplified) < geometry.count_vertices(original) / 2
+    assert len(simplified["features"]) == len(original["features"])
+
+
+@pytest.mark.parametrize("encoding", ["identity", "gzip"])
+def test_resource_served_through_wsgi(server, encoding):
+    base, resource = server
+    resp, body = _get(base + resource.url, **{"Accept-Encoding": encoding})
+    assert resp.status == 200
+    assert int(resp.headers["Content-Length"]) == len(body)
+    if encoding == "gzip":
+        assert resp.headers["Content-Encoding"] == "gzip"
+        body = gzip.decompress(body)
+    with open(provinces, encoding="utf8") as f:
+        assert json.loads(body) == json.load(f)
+
+
+def test_resource_not_modified(server):
+    base, resource = server
+    resp, _ = _get(base + resource.url, **{"Accept-Encoding": "gzip"})
+    request = urllib.request.Request(
+        base + resource.url, headers={"If-None-Match": resp.headers["ETag"]}
+    )
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 304
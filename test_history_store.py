@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import history_store
+
+
+def _records(times, confirmed=1):
+    return pd.DataFrame(
+        {
+            "country": "中国",
+            "province": "湖北省",
+            "city": "",
+            "updateTime": times,
+            "confirmed": confirmed,
+            "suspected": 0,
+            "cured": 0,
+            "dead": 0,
+        }
+    )
+
+
+def _ms(text):
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = history_store.HistoryStore(tmp_path)
+    for hour in range(5):
+        store.append(_records([_ms(f"2020-02-01 0{hour}:00"), _ms(f"2020-02-02 0{hour}:00")]))
+    return store
+
+
+def _day_files(store, day):
+    return sorted(p.name for p in (store.root / day).iterdir())
+
+
+def test_compact_keeps_records(store):
+    before = store.read()
+    assert len(_day_files(store, "20200201")) == 5
+    assert store.compact(before=datetime(2020, 2, 2)) == 1
+    assert _day_files(store, "20200201") == ["part-00001.npz"]
+    # 还没有结束的日期不合并
+    assert len(_day_files(store, "20200202")) == 5
+    pd.testing.assert_frame_equal(store.read(), before)
+    assert store.compact(before=datetime(2020, 2, 2)) == 0
+
+    # 合并后继续追加和去重
+    fresh = history_store.HistoryStore(store.root)
+    assert fresh.append(_records([_ms("2020-02-01 00:00"), _ms("2020-02-01 06:00")])) == 1
+    assert _day_files(fresh, "20200201") == ["part-00001.npz", "part-00002.npz"]
+    assert len(fresh.read()) == len(before) + 1
+
+
+def test_interrupted_compact(store, monkeypatch):
+    before = store.read()
+    day_dir = store.root / "20200201"
+    calls = []
+    unlink = type(day_dir).unlink
+
+    def crash(self, *args, **kwargs):
+        # 删除两个原文件后退出
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        calls.append(self)
+        unlink(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(day_dir), "unlink", crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact(before=datetime(2020, 2, 2))
+    monkeypatch.undo()
+    assert "compact.npz" in _day_files(store, "20200201")
+
+    # 中断后读取到的仍是完整的记录，没有重复
+    fresh = history_store.HistoryStore(store.root)
+    pd.testing.assert_frame_equal(fresh.read(), before)
+    assert fresh.watermark() == store.watermark()
+    assert fresh.compact(before=datetime(2020, 2, 2)) == 0
+    assert _day_files(fresh, "20200201") == ["part-00001.npz"]
+    pd.testing.assert_frame_equal(fresh.read(), before)
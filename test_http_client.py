@@ -0,0 +1,91 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import config
+import http_client
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """status 为 200 时返回 body，带 ETag，If-None-Match 匹配时返回 304。"""
+
+    status = 200
+    body = b""
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        StubHandler.requests.append(dict(self.headers))
+        if self.status != 200:
+            self.send_response(self.status)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(config, "http_retries", 1)
+    monkeypatch.setattr(config, "http_backoff", 0)
+    monkeypatch.setattr(config, "breaker_threshold", 2)
+    StubHandler.status = 200
+    StubHandler.body = json.dumps({"results": [1, 2]}).encode()
+    StubHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{httpd.server_port}/data"
+    yield http_client.UpstreamClient({"stub": url})
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_conditional_request(stub):
+    first = stub.fetch("stub")
+    assert (first.not_modified, first.stale) == (False, False)
+    second = stub.fetch("stub")
+    assert second.not_modified and second.content == first.content
+    assert StubHandler.requests[-1]["If-None-Match"] == '"v1"'
+
+
+def test_stale_payload_is_not_fresh(stub):
+    assert stub.get_json("stub") == {"results": [1, 2]}
+    StubHandler.status = 500
+    result = stub.fetch("stub")
+    assert result.stale and json.loads(result.content) == {"results": [1, 2]}
+    with pytest.raises(http_client.StaleError):
+        stub.get_json("stub")
+    assert stub.get_json("stub", allow_stale=True) == {"results": [1, 2]}
+
+
+def test_retry_and_circuit_breaker(stub):
+    StubHandler.status = 503
+    with pytest.raises(http_client.UpstreamError):
+        stub.fetch("stub")
+    # 第一次请求加一次重试
+    assert len(StubHandler.requests) == 2
+    with pytest.raises(http_client.UpstreamError):
+        stub.fetch("stub")
+    with pytest.raises(http_client.CircuitOpenError):
+        stub.fetch("stub")
+    assert len(StubHandler.requests) == 4
+
+
+def test_client_error_is_not_retried(stub):
+    StubHandler.status = 404
+    with pytest.raises(http_client.UpstreamError):
+        stub.fetch("stub")
+    assert len(StubHandler.requests) == 1
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import fanout
+import history_store
+import http_client
+import ingest
+import utils
+
+
+def _overall(update_time, confirmed):
+    return {
+        "updateTime": update_time,
+        "confirmedCount": confirmed,
+        "suspectedCount": 0,
+        "curedCount": 0,
+        "deadCount": 0,
+    }
+
+
+@pytest.fixture
+def overall_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "overall", history_store.HistoryStore(tmp_path / "overall"))
+    monkeypatch.setattr(ingest, "_overall", None)
+    monkeypatch.setattr(ingest, "_daily", ingest.daily.DailyAggregate(ingest.daily.early_days))
+
+
+def _serve(monkeypatch, results, stale=False):
+    body = json.dumps({"results": results}).encode()
+    monkeypatch.setattr(
+        http_client.client, "fetch", lambda name, url=None: http_client.Result(body, False, stale)
+    )
+
+
+def test_fetch_overall_incremental(overall_store, monkeypatch):
+    now = int(time.time() * 1000)
+    _serve(monkeypatch, [_overall(now - 60000, 10)])
+    assert ingest.fetch_overall(full=True) is True
+    _serve(monkeypatch, [_overall(now, 12)])
+    assert ingest.fetch_overall() is True
+    assert ingest._overall["confirmed"].tolist() == [12, 10]
+    # 没有比水位线新的记录
+    assert ingest.fetch_overall() is False
+    assert len(ingest._overall) == 2
+
+
+def test_stale_overall_is_not_new(overall_store, monkeypatch):
+    now = int(time.time() * 1000)
+    _serve(monkeypatch, [_overall(now, 10)])
+    ingest.fetch_overall(full=True)
+    _serve(monkeypatch, [_overall(now, 10)], stale=True)
+    with pytest.raises(http_client.StaleError):
+        ingest.fetch_overall()
+
+
+def test_stale_history_is_not_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "area", history_store.HistoryStore(tmp_path / "area"))
+    _serve(monkeypatch, [], stale=True)
+    assert utils.save_dxy_minutes_history() is False
+
+
+@pytest.fixture
+def publishing(tmp_path, monkeypatch):
+    """ingest_once 只保留发布快照的部分，changed 为本轮是否有新数据。"""
+    changed = [True]
+    monkeypatch.setattr(history_store, "area", history_store.HistoryStore(tmp_path / "area"))
+    monkeypatch.setattr(ingest, "_snapshot", None)
+    monkeypatch.setattr(ingest, "_snapshot_ready", threading.Event())
+    monkeypatch.setattr(ingest, "_unpublished", False)
+    monkeypatch.setattr(ingest, "_writers", [])
+    monkeypatch.setattr(ingest, "_listeners", [])
+    monkeypatch.setattr(ingest, "_needs_full_resync", lambda now: None)
+    monkeypatch.setattr(ingest, "compact_history", lambda force=False: None)
+    area = pd.DataFrame({"地区": []})
+    monkeypatch.setattr(
+        ingest,
+        "_core_tasks",
+        lambda full: [
+            fanout.Task("overall", None, lambda: changed[0]),
+            fanout.Task("isaaclin_area_latest", None, lambda: (False, area, area)),
+        ],
+    )
+    monkeypatch.setattr(fanout, "run_all", lambda tasks: {t.name: t.run() for t in tasks})
+    monkeypatch.setattr(ingest.metrics, "derive", lambda df, previous: (df, {}))
+    monkeypatch.setattr(ingest.metrics, "previous_day", lambda *args: None)
+    monkeypatch.setattr(ingest.regions, "report", lambda: None)
+    return changed
+
+
+def test_snapshot_published_after_writers(publishing):
+    seen = []
+
+    def writer(snapshot):
+        # 写入时新快照还不可见
+        seen.append((snapshot.version, ingest.get_snapshot(0)))
+        if len(seen) == 1:
+            raise OSError("磁盘已满")
+
+    ingest.add_writer(writer)
+    ingest.subscribe(lambda snapshot: seen.append(ingest.get_snapshot(0) is snapshot))
+    with pytest.raises(OSError):
+        ingest.ingest_once()
+    assert ingest.get_snapshot(0) is None
+    # 下一轮没有新数据，也重新发布上一轮写入失败的快照
+    publishing[0] = False
+    snapshot = ingest.ingest_once()
+    assert snapshot.version == 1 and ingest.get_snapshot(0) is snapshot
+    assert seen == [(1, None), (1, None), True]
+    assert ingest.ingest_once() is snapshot
+    assert len(seen) == 3
+
+
+def test_ingest_round_refetches_fresh_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "province_data_file", tmp_path / "province.csv")
+    monkeypatch.setattr(ingest, "city_data_file", tmp_path / "city.csv")
+    monkeypatch.setattr(ingest, "refresher", ingest.refresh.RefreshCoordinator(tmp_path / ".lock"))
+    calls = []
+
+    def fetch():
+        df = pd.DataFrame({"地区": ["湖北"], "确诊": [len(calls)]})
+        for path in (ingest.province_data_file, ingest.city_data_file):
+            ingest.refresh.atomic_to_csv(df, path)
+        calls.append(df)
+        return True, df, df
+
+    monkeypatch.setattr(ingest, "fetch_province_city", fetch)
+    assert ingest.load_province_city()[0] is True
+    # 文件还没过期，其他读取者直接读取文件
+    changed, province_df, _ = ingest.load_province_city()
+    assert len(calls) == 1 and changed is False and province_df["确诊"].tolist() == [0]
+    # 每轮拉取总是重新请求
+    tasks = {t.name: t for t in ingest._core_tasks(False)}
+    changed, province_df, _ = tasks["isaaclin_area_latest"].run()
+    assert len(calls) == 2 and province_df["确诊"].tolist() == [1]
+
+
+def test_resync_request_from_other_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "resync_request_file", tmp_path / ".resync_request")
+    monkeypatch.setattr(ingest, "_resync_requested", threading.Event())
+    ingest.request_resync()
+    # 拉取数据的 worker 中没有设置事件，只能看到请求文件
+    ingest._resync_requested.clear()
+    assert ingest._needs_full_resync(time.time()) == "手动请求"
+    # 同步开始之后收到的请求留到下一轮
+    ingest._clear_resync_request(time.time() - 60)
+    assert ingest._needs_full_resync(time.time()) == "手动请求"
+    ingest._clear_resync_request(time.time())
+    assert not ingest.resync_request_file.exists()
+    assert ingest._needs_full_resync(time.time()) != "手动请求"
@@ -0,0 +1,86 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import jhu
+
+fixtures = Path(__file__).parent / "fixtures" / "jhu"
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    for path in fixtures.glob("*.csv"):
+        shutil.copy(path, tmp_path)
+    monkeypatch.setattr(jhu, "_cache", None)
+    return tmp_path
+
+
+def test_provinces_are_summed(data_dir):
+    wide = jhu.read_wide(jhu.csv_path("JHU_CSSE_CONFIRMED", data_dir), chunksize=2)
+    assert wide.index.tolist() == ["Afghanistan", "China", "Italy", "Kosovo", "Netherlands"]
+    assert list(wide.columns) == list(pd.date_range("2020-01-22", periods=3))
+    assert wide.loc["China"].tolist() == [445, 453, 564]
+    # 空值不参与相加，全部为空时为 NaN
+    assert wide.loc["Netherlands"].tolist() == [0, 1, 1]
+    assert np.isnan(wide.loc["Kosovo"].iloc[-1])
+
+
+def test_to_long_matches_melt(data_dir):
+    wide = jhu.read_wide(jhu.csv_path("JHU_CSSE_CONFIRMED", data_dir))
+    long = jhu.to_long(wide, "确诊")
+    melted = (
+        wide.rename_axis("country")
+        .reset_index()
+        .melt(id_vars="country", var_name="date", value_name="确诊")
+        .sort_values(["country", "date"], ignore_index=True)
+    )
+    pd.testing.assert_frame_equal(
+        long.sort_values(["country", "date"], ignore_index=True), melted, check_dtype=False
+    )
+
+
+def test_metrics_are_aligned(data_dir):
+    series = jhu.build(data_dir)
+    assert series.metrics == ["确诊", "治愈", "死亡"]
+    assert series.countries == ["Afghanistan", "Canada", "China", "Italy", "Kosovo", "Netherlands"]
+    assert series.values.shape == (6, 3, 3)
+    china = series.country("China")
+    assert china["确诊"].tolist() == [445, 453, 564]
+    assert china["死亡"].tolist() == [17, 17, 24]
+    # 治愈数据少一天
+    assert china["治愈"].tolist()[:2] == [28, 28] and np.isnan(china["治愈"].iloc[2])
+    # 只出现在部分指标中的国家/地区，其余指标为 NaN
+    assert series.country("Italy")["治愈"].isna().all()
+    assert series.country("Canada")[["确诊", "死亡"]].isna().all().all()
+    assert series.on("2020-01-23").loc["Canada", "治愈"] == 1
+
+
+def test_cache_reused_until_sources_change(data_dir, monkeypatch):
+    first = jhu.load(data_dir)
+    assert jhu.cache_path(data_dir).exists()
+    assert jhu.load(data_dir) is first
+
+    # 新进程：直接映射缓存文件，不重新解析 CSV
+    monkeypatch.setattr(jhu, "_cache", None)
+    monkeypatch.setattr(jhu, "build", lambda data_dir=None: pytest.fail("不应重新解析"))
+    cached = jhu.load(data_dir)
+    np.testing.assert_array_equal(cached.values, first.values)
+    assert cached.countries == first.countries
+    assert list(cached.dates) == list(first.dates)
+    monkeypatch.undo()
+
+    # CSV 被替换后重新解析
+    path = jhu.csv_path("JHU_CSSE_DEATHS", data_dir)
+    text = path.read_text().replace("17,17,24", "17,18,25")
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(text)
+    tmp.replace(path)
+    rebuilt = jhu.load(data_dir)
+    assert rebuilt.country("China")["死亡"].tolist() == [17, 18, 25]
+
+
+def test_no_sources(tmp_path):
+    assert jhu.load(tmp_path) is None
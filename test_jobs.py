@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def blocked(tmp_path):
+    release = threading.Event()
+    calls = []
+
+    def run(start_date, end_date, path, progress):
+        calls.append(path)
+        release.wait(5)
+        path.write_bytes(b"mp4")
+
+    manager = jobs.JobManager(run, tmp_path, max_bytes=1 << 20)
+    yield manager, calls, release
+    release.set()
+    manager._executor.shutdown()
+
+
+def test_queued_job_is_not_resubmitted(blocked, monkeypatch):
+    manager, calls, release = blocked
+    first = manager.submit("2020-02-01", "2020-02-02", 1)
+    queued = manager.submit("2020-02-03", "2020-02-04", 1)
+    # 排队超过 stale_after 的本进程任务也不重复提交
+    monkeypatch.setattr(jobs.JobManager, "stale_after", 0)
+    assert manager.submit("2020-02-03", "2020-02-04", 1) == queued
+    assert manager.submit("2020-02-01", "2020-02-02", 1) == first
+    release.set()
+    manager._executor.shutdown()
+    assert len(calls) == 2
+    assert manager.get(queued).status == "done"
+
+
+def test_job_of_other_worker(blocked, tmp_path, monkeypatch):
+    manager, calls, release = blocked
+    job_id = manager.submit("2020-02-01", "2020-02-02", 1)
+    # 另一个 worker 读取状态文件，执行任务的进程还在，排队再久也不重复提交
+    other = jobs.JobManager(lambda *args: None, tmp_path, max_bytes=1 << 20)
+    monkeypatch.setattr(jobs.JobManager, "stale_after", 0)
+    assert other.submit("2020-02-01", "2020-02-02", 1) == job_id
+    assert job_id not in other._jobs
+
+    # 执行任务的进程已经退出
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True)
+    state = other._load(job_id)
+    state.owner = int(exited.stdout)
+    other._save(state)
+    assert other.submit("2020-02-01", "2020-02-02", 1) == job_id
+    assert job_id in other._jobs
+    other._executor.shutdown()
+    assert other._load(job_id).owner == os.getpid()
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import metrics
+
+
+def _frame(values):
+    return pd.DataFrame(
+        {"地区": [f"地区{i}" for i in range(len(values))], **{m: values for m in metrics.metrics}}
+    )
+
+
+def test_large_values_in_last_bin(monkeypatch):
+    """原来 pd.cut 的最后一个边界是 100000，不小于它的值得到 NaN。"""
+    monkeypatch.setattr(config, "bin_mode", "fixed")
+    values = [0, 1, 9, 10, 9999, 10000, 99999, 100000, 250000]
+    df, bins = metrics.derive(_frame(values))
+    edges, labels = bins["确诊"]
+    assert labels[-1] == "10000+"
+    codes = df["确诊区间"].tolist()
+    assert [labels[c] for c in codes[-4:]] == ["10000+"] * 4
+    assert codes[:4] == [0, 1, 1, 2]
+    assert not df["确诊区间"].isna().any()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_quantile_bins_cover_all_values(monkeypatch, seed):
+    monkeypatch.setattr(config, "bin_mode", "quantile")
+    rng = np.random.default_rng(seed)
+    values = np.concatenate([[0, 0, 1], rng.integers(1, 200000, size=300), [10 ** 6]])
+    df, bins = metrics.derive(_frame(values))
+    for m in metrics.metrics:
+        edges, labels = bins[m]
+        codes = df[f"{m}区间"].to_numpy()
+        assert len(labels) == len(edges) <= config.bin_count
+        assert np.all(np.diff(edges) > 0)
+        assert codes.min() >= 0 and codes.max() < len(labels)
+        # 每个值都在它所在区间的范围内
+        assert np.all(edges[codes] <= values)
+        upper = np.append(edges[1:], np.inf)[codes]
+        assert np.all(values < upper)
+
+
+def test_quantile_without_positive_values(monkeypatch):
+    monkeypatch.setattr(config, "bin_mode", "quantile")
+    df, bins = metrics.derive(_frame([0, 0, 0]))
+    assert bins["确诊"][1] == ["0", "1+"]
+    assert df["确诊区间"].tolist() == [0, 0, 0]
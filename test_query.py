@@ -0,0 +1,160 @@
+import shutil
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+import flask
+import numpy as np
+import pandas as pd
+import pytest
+
+import history_store
+import query
+import shared
+
+Snapshot = namedtuple("Snapshot", ["area_watermark"])
+
+
+def _ms(text):
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+def _records(time, confirmed):
+    return pd.DataFrame(
+        {
+            "country": "中国",
+            "province": ["湖北省", "湖北省", "广东省", "北京"],
+            "city": ["", "武汉", "", ""],
+            "updateTime": time,
+            "confirmed": confirmed,
+            "suspected": 0,
+            "cured": 0,
+            "dead": 0,
+        }
+    )
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = history_store.HistoryStore(tmp_path)
+    monkeypatch.setattr(history_store, "area", store)
+    monkeypatch.setattr(query, "_days", {})
+    monkeypatch.setattr(query, "_indexes", {})
+    monkeypatch.setattr(query, "_index_watermark", None)
+    for i, day in enumerate(["2020-02-01", "2020-02-02", "2020-02-03"]):
+        store.append(_records(_ms(f"{day} 10:00"), 10 * i))
+        store.append(_records(_ms(f"{day} 08:00"), 10 * i - 1))
+    return store
+
+
+@pytest.fixture
+def reads(store, monkeypatch):
+    days = []
+    read_day = store.read_day
+
+    def counting(day, metrics=None):
+        days.append(day)
+        return read_day(day, metrics)
+
+    monkeypatch.setattr(store, "read_day", counting)
+    return days
+
+
+def test_index_sorted_by_region_and_time(store):
+    index = query.get_index("province", store.watermark())
+    assert len(index.times) == 18
+    for region in index.regions:
+        times, values = index.series(region)
+        assert np.all(np.diff(times) > 0)
+        assert values[:, 0].tolist() == [-1, 0, 9, 10, 19, 20]
+    times, _ = index.series(index.regions[0], start=_ms("2020-02-02 00:00"), end=_ms("2020-02-02 09:00"))
+    assert times.tolist() == [_ms("2020-02-02 08:00")]
+
+
+def test_only_changed_days_are_read(store, reads):
+    query.get_index("province", store.watermark())
+    assert sorted(reads) == ["20200201", "20200202", "20200203"]
+    query.get_index("city", store.watermark())
+    assert len(reads) == 3
+
+    # 新的一天和迟到的旧记录，只重新读取这两个分区
+    store.append(_records(_ms("2020-02-04 10:00"), 30))
+    store.append(_records(_ms("2020-02-01 12:00"), 1))
+    index = query.get_index("province", store.watermark())
+    assert sorted(reads[3:]) == ["20200201", "20200204"]
+    times, values = index.series(index.regions[0])
+    assert np.all(np.diff(times) > 0)
+    assert values[:, 0].tolist() == [-1, 0, 1, 9, 10, 19, 20, 30]
+
+    # 合并分区后文件有变化，重新读取一次，结果不变
+    store.compact(before=datetime(2020, 2, 4))
+    again = query.get_index("province", -1)
+    np.testing.assert_array_equal(again.values, index.values)
+    np.testing.assert_array_equal(again.times, index.times)
+
+
+def test_routes(store, monkeypatch):
+    monkeypatch.setattr(shared, "get_snapshot", lambda timeout=None: Snapshot(store.watermark()))
+    monkeypatch.setattr(shared, "_listeners", [])
+    server = flask.Flask(__name__)
+    query.register_routes(server)
+    client = server.test_client()
+    regions = client.get("/api/series/city").get_json()
+    assert len(regions) == 2
+    result = client.get(
+        f"/api/series/province/{query.get_index('province', None).regions[0]}"
+        "?metrics=确诊&start=2020-02-02&end=2020-02-02"
+    ).get_json()
+    assert result["metrics"] == ["confirmed"]
+    assert result["values"]["confirmed"] == [9, 10]
+    assert client.get("/api/series/province/火星").status_code == 404
+
+
+def test_region_names(store):
+    watermark = store.watermark()
+    resolver = query.regions.resolver("province")
+    hubei = query.query("province", "湖北省", watermark=watermark)["region"]
+    assert query.query("province", hubei, watermark=watermark)["region"] == hubei
+    memo = len(resolver._memo)
+    # 只有前缀相同的名称不对应，也不缓存
+    for name in ["湖北火星", "湖北省火星", "广东" * 50]:
+        with pytest.raises(query.QueryError) as e:
+            query.query("province", name, watermark=watermark)
+        assert e.value.status == 404
+    assert len(resolver._memo) == memo
+
+
+@pytest.fixture
+def jhu_dir(tmp_path, monkeypatch):
+    for path in (Path(__file__).parent / "fixtures" / "jhu").glob("*.csv"):
+        shutil.copy(path, tmp_path)
+    monkeypatch.setattr(query.config, "jhu_data_dir", str(tmp_path))
+    monkeypatch.setattr(query.jhu, "_cache", None)
+    return tmp_path
+
+
+def test_global_routes(jhu_dir, monkeypatch):
+    server = flask.Flask(__name__)
+    monkeypatch.setattr(shared, "_listeners", [])
+    query.register_routes(server)
+    client = server.test_client()
+    assert "China" in client.get("/api/global").get_json()
+    result = client.get("/api/global/China?metrics=确诊,cured&start=2020-01-23").get_json()
+    assert result == {
+        "country": "China",
+        "metrics": ["confirmed", "cured"],
+        "date": ["2020-01-23", "2020-01-24"],
+        "values": {"confirmed": [453, 564], "cured": [28, None]},
+    }
+    csv = client.get("/api/global/China?metrics=dead&end=2020-01-23&format=csv").get_data(as_text=True)
+    assert csv.splitlines() == ["date,dead", "2020-01-22,17.0", "2020-01-23,17.0"]
+    assert client.get("/api/global/Atlantis").status_code == 404
+    assert client.get("/api/global/China?metrics=suspected").status_code == 400
+
+
+def test_global_without_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(query.config, "jhu_data_dir", str(tmp_path))
+    monkeypatch.setattr(query.jhu, "_cache", None)
+    with pytest.raises(query.QueryError) as e:
+        query.query_global("China")
+    assert e.value.status == 503
@@ -0,0 +1,58 @@
+import pytest
+
+import geometry
+import regions
+
+
+@pytest.fixture
+def resolver(tmp_path, monkeypatch):
+    monkeypatch.setattr(geometry, "cache_dir", tmp_path)
+    monkeypatch.setattr(geometry, "_compact", {})
+    monkeypatch.setattr(regions, "_resolvers", {})
+    return regions.resolver
+
+
+@pytest.mark.parametrize(
+    "level,name,expected,method",
+    [
+        ("city", "武汉市", "武汉", "normalized"),
+        ("city", "武汉", "武汉", "exact"),
+        ("city", "恩施州", "恩施土家族苗族自治州", "alias"),
+        ("city", "海西州", "海西蒙古族藏族自治州直辖", "prefix"),
+        ("city", "吐鲁番地区", "吐鲁番地区", "exact"),
+        ("province", "湖北省", "湖北", "normalized"),
+        ("province", "香港特别行政区", "香港", "normalized"),
+    ],
+)
+def test_resolve(resolver, level, name, expected, method):
+    r = resolver(level)
+    assert r.resolve(name) == expected
+    counts, unmatched = r.report()
+    assert counts == {method: 1} and not unmatched
+
+
+def test_unknown_names_are_rejected(resolver):
+    r = resolver("province")
+    assert r.resolve("火星") is None
+    assert r.canonical(["火星", "湖北省"]) == ["火星", "湖北"]
+    counts, unmatched = r.report()
+    assert counts["unmatched"] == 2 and unmatched == {"火星": 2}
+
+
+def test_normalize_removes_whole_suffix():
+    """原来用 rstrip("地区") 逐个字符去掉，会把名称本身末尾的 地、区 也去掉。"""
+    assert regions.normalize("大兴安岭地区") == "大兴安岭"
+    assert regions.normalize("神农架林区") == "神农架"
+    assert regions.normalize("天地") == "天地"
+    assert regions.normalize("区区") == "区区"
+    assert regions.normalize("北区") == "北区"
+    r = regions.RegionResolver(["天地", "天", "湾区"])
+    assert r.resolve("天地") == "天地"
+    assert r.resolve("湾区市") == "湾区"
+
+
+def test_prefix_needs_a_unique_match():
+    r = regions.RegionResolver(["黔东南苗族侗族", "黔南布依族苗族", "海西蒙古族藏族"])
+    assert r.resolve("黔东南州") == "黔东南苗族侗族"
+    # 黔 是两个名称的前缀，不知道对应哪一个
+    assert r.resolve("黔州") is None
@@ -1,100 +1,75 @@
-import json
+import hashlib
+import itertools
 import logging
-import subprocess
-from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-import shutil
 
-import matplotlib
-
-matplotlib.use("Agg")
-import geopandas
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import requests
-from fake_useragent import UserAgent
-from progressbar import progressbar
 
+import buckets
 import config
+import history_store
+import http_client
+import render
+import video
 
 logger = logging.getLogger(__name__)
-ua = UserAgent()
-
-
-def uniform_city_name(cn):
-    if cn not in config.exceptions:
-        cn = cn.rstrip("地区")
-    cn = config.replace_map.get(cn, cn)
-    return cn
 
 
 def save_province_city_history():
+    """拉取并保存省市每日历史数据，成功返回 True。"""
     logger.info("[开始] 保存省市每日历史数据")
+    ok = False
     try:
-        headers = {"User-Agent": ua.random}
-        r = requests.get("http://ncov.nosensor.com:8080/api/", headers=headers)
-        r.raise_for_status()
-        res = r.json()
-        with open(
-            f"history_data/province_city_history_{datetime.now().strftime('%Y%m%d')}.json",
-            "w",
-            encoding="utf-8",
-        ) as f:
-            json.dump(res, f, ensure_ascii=False, indent=4)
+        res = http_client.client.get_json("province_city_history")
+        history_store.province_city.append(history_store.province_city_records(res))
+        ok = True
     except Exception as e:
         logger.error(f"保存省市每日历史数据出错。", exc_info=True)
     logger.info("[结束] 保存省市每日历史数据")
+    return ok
 
 
 def save_dxy_minutes_history():
+    """拉取并保存丁香园全部历史数据，成功返回 True。"""
     logger.info("[开始] 保存丁香园每分钟历史数据")
+    ok = False
     try:
-        headers = {"User-Agent": ua.random}
-        r = requests.get(
-            "http://lab.isaaclin.cn/nCoV/api/area?latest=0", headers=headers
-        )
-        r.raise_for_status()
-        res = r.json()
-        with open(
-            f"history_data/dxy_minutes_history_{datetime.now().strftime('%Y%m%d')}.json",
-            "w",
-            encoding="utf-8",
-        ) as f:
-            json.dump(res, f, ensure_ascii=False, indent=4)
+        res = http_client.client.get_json("isaaclin_area_history")
+        history_store.area.append(history_store.area_records(res["results"]))
+        ok = True
     except Exception as e:
         logger.error(f"保存丁香园每分钟历史数据出错。", exc_info=True)
     logger.info("[结束] 保存丁香园每分钟历史数据")
+    return ok
 
 
 def timestamp2datetime(ts):
     return datetime.fromtimestamp(ts)
 
 
-def generate_figures(
-    history, geomap, locations_list, start_date, end_date, dpi, figdir
-):
+def timestamps2datetimes(ms):
+    """timestamp2datetime 的向量化版本，ms 为毫秒时间戳数组，返回本地时间的 DatetimeIndex。"""
+    local_tz = datetime.now().astimezone().tzinfo
+    return (
+        pd.to_datetime(np.asarray(ms), unit="ms", utc=True)
+        .tz_convert(local_tz)
+        .tz_localize(None)
+    )
+
+
+def province_buckets(history, locations_list, start_date, end_date):
+    """把 history 中 [start_date, end_date] 范围内的省级记录按时间分桶。
+
+    history 为 history_store.area.read 返回的 DataFrame，日期为 YYYY-MM-DD 格式的字符串。
+    返回值同 buckets.bucketize。
+    """
     # 哪个省在什么时间点的确诊、疑似、治愈、死亡人数
     # 省份，确诊，疑似，治愈，死亡，时间
     start_date = datetime.strptime(start_date, "%Y-%m-%d")
     end_date = datetime.strptime(f"{end_date} 23:59:59", "%Y-%m-%d %H:%M:%S")
 
-    def plot_one_date(dt, geomap, times_dict, locations_list, filename):
-        plot_data = []
-        for p in locations_list:
-            if p in times_dict[dt]:
-                plot_data.append(times_dict[dt][p][0])
-            else:
-                plot_data.append(0)
-        plot_series = pd.Series(plot_data, index=locations_list) + 1
-        geomap.plot(plot_series.map(np.log), figsize=(5, 3))
-        plt.axis("off")
-        plt.text(93, 50, dt.replace("_", " "), fontsize=10)
-        plt.tight_layout()
-        plt.savefig(f"{figdir}/{filename}.png", dpi=dpi)
-        plt.close()
-
     short2full = {
         "广西": "广西壮族自治区",
         "内蒙古": "内蒙古自治区",
@@ -102,95 +77,105 @@ def generate_figures(
         "新疆": "新疆维吾尔自治区",
         "西藏": "西藏自治区",
     }
-    provinces, confirmeds, suspecteds, cureds, deads, times = [], [], [], [], [], []
-    for r in history["results"]:
-        time_ = timestamp2datetime(r["updateTime"] / 1000)
-        if start_date <= time_ <= end_date:
-            provinces.append(r["provinceShortName"])
-            confirmeds.append(r["confirmedCount"])
-            suspecteds.append(r["suspectedCount"])
-            cureds.append(r["curedCount"])
-            deads.append(r["deadCount"])
-            times.append(time_)
+    history = history[history.city == ""]
     history_df = pd.DataFrame(
         data={
-            "province": provinces,
-            "confirmed": confirmeds,
-            "suspected": suspecteds,
-            "cured": cureds,
-            "dead": deads,
-            "time": times,
+            "province": history.province.replace(short2full).values,
+            "confirmed": history.confirmed.values,
+            "suspected": history.suspected.values,
+            "cured": history.cured.values,
+            "dead": history.dead.values,
+            "time": timestamps2datetimes(history.updateTime),
         }
     )
-    history_df_sorted = history_df.sort_values(
-        by="time", ascending=True, ignore_index=True
+    history_df = history_df[
+        (history_df.time >= start_date) & (history_df.time <= end_date)
+    ]
+    return buckets.bucketize(history_df, locations_list, config.bucket_width)
+
+
+def read_province_buckets(locations_list, start_date, end_date):
+    """从 history_store.area 读取 [start_date, end_date] 的数据并分桶，可在 offload 的进程池中执行。"""
+    history = history_store.area.read(
+        datetime.strptime(start_date, "%Y-%m-%d"),
+        datetime.strptime(f"{end_date} 23:59:59", "%Y-%m-%d %H:%M:%S"),
     )
-    history_df_sorted.province = history_df_sorted.province.replace(short2full)
-
-    # 生成 times_dict
-    baseline = history_df_sorted.loc[0, "time"]
-    max_interval = 0.5 * 3600  # 秒
-    new_times = []
-    times_dict = OrderedDict()
-    for row in history_df_sorted.itertuples(index=False):
-        if (row.time - baseline).seconds >= max_interval:
-            baseline = row.time
-        new_times.append(baseline)
-        str_time = baseline.strftime("%Y-%m-%d_%H:%M:%S")
-        if str_time not in times_dict:
-            times_dict[str_time] = {}
-        if row.province in times_dict[str_time]:
-            if row.time > times_dict[str_time][row.province][-1]:
-                times_dict[str_time][row.province] = [
-                    row.confirmed,
-                    row.suspected,
-                    row.cured,
-                    row.dead,
-                    row.time,
-                ]
+    return province_buckets(history, locations_list, start_date, end_date)
+
+
+def generate_video(
+    bucket_times,
+    values,
+    geojson_path,
+    dpi,
+    videoname,
+    fps,
+    progress=None,
+):
+    """生成省级确诊人数动态变化视频，帧率由 fps 指定。geojson_path 为省级地图文件。
+
+    bucket_times 和 values 为 province_buckets 的返回值。
+    视频按天分段编码，每段以 (每帧的时间和数据, dpi, fps, 渲染器) 的哈希值为键缓存在
+    config.segment_cache_dir 中，只有缓存中没有的分段才需要渲染和编码，最后把所有分段拼接起来。
+    progress 见 video.encode，total 为需要渲染的帧数。
+    """
+    if not len(bucket_times):
+        raise ValueError("所选日期范围内没有数据")
+    values = values[:, :, 0]
+    renderer = config.frame_renderer
+    segment_dir = Path(config.segment_cache_dir)
+    segment_dir.mkdir(parents=True, exist_ok=True)
+
+    segments, missing = [], []
+    days = bucket_times.strftime("%Y%m%d")
+    for day in sorted(set(days)):
+        index = np.flatnonzero(days == day)
+        h = hashlib.sha1(f"{renderer}|{dpi}|{fps}".encode("utf8"))
+        for i in index:
+            h.update(bucket_times[i].strftime("%Y%m%d%H%M%S").encode("utf8"))
+            h.update(values[i].astype(np.int64).tobytes())
+        path = segment_dir / f"{day}-{h.hexdigest()[:16]}.mp4"
+        segments.append(path)
+        if path.exists():
+            path.touch()
         else:
-            times_dict[str_time][row.province] = [
-                row.confirmed,
-                row.suspected,
-                row.cured,
-                row.dead,
-                row.time,
-            ]
-
-    # last_time = "2020-01-22_03:28:10"
-    last_time = list(times_dict.keys())[0]
-    for k, v in times_dict.items():
-        current_provinces_set = set(v.keys())
-        last_provinces_set = set(times_dict[last_time].keys())
-        diff = last_provinces_set - current_provinces_set
-        if diff:
-            times_dict[k].update(
-                {province: times_dict[last_time][province] for province in diff}
-            )
-        last_time = k
-
-    # 循环绘制多个 figures
-    for i, k in progressbar(enumerate(times_dict)):
-        plot_one_date(k, geomap, times_dict, locations_list, str(i))
-
-
-def generate_video(image_pattern, videoname, fps):
-    """根据 image_pattern 指定的图片集生成名为 videoname 的视频，帧率由 fps 指定。"""
-    cmd = f"ffmpeg -r {fps} -f image2 -s 1920x1080 -i {image_pattern} -vcodec libx264 -crf 25  -pix_fmt yuv420p {videoname}"
-    logger.info(f"cmd={cmd}")
-    subprocess.run(cmd)
-
-
-def rmfigures(figdir):
-    logger.info(f"正在删除 {figdir} 中的 PNG 文件 ...")
-    count = 0
-    for fname in Path(figdir).glob("*.png"):
-        fname.unlink()
-        count += 1
-    logger.info(f"共删除 {count} 份 PNG 文件")
+            missing.append((path, index))
+    total = sum(len(index) for _, index in missing)
+    logger.info(f"共 {len(segments)} 段，需要生成 {len(missing)} 段 {total} 帧")
+
+    if missing:
+        width, height = render.frame_size(dpi)
+        todo = np.concatenate([index for _, index in missing])
+        frames = render.iter_frames(
+            bucket_times[todo], values[todo], geojson_path, dpi, renderer=renderer
+        )
+        done = 0
+
+        def segment_progress(n, _):
+            if progress is not None:
+                progress(done + n, total)
+
+        try:
+            for path, index in missing:
+                video.encode(
+                    itertools.islice(frames, len(index)),
+                    path,
+                    fps,
+                    width,
+                    height,
+                    total=len(index),
+                    progress=segment_progress,
+                )
+                done += len(index)
+        finally:
+            frames.close()
+    video.concat(segments, videoname)
+    video.evict(segment_dir, config.segment_cache_max_bytes, keep=segments)
 
 
 def get_cmap_hex(cmap, n):
+    import matplotlib
+
     hexcolors = []
     cm = matplotlib.cm.get_cmap(cmap, n)
     for i in range(cm.N):
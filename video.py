@@ -0,0 +1,127 @@
+"""
+把渲染好的帧直接通过管道送入 ffmpeg 编码，不经过磁盘上的图片文件。
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+from progressbar import progressbar
+
+logger = logging.getLogger(__name__)
+
+
+def encode(frames, videoname, fps, width, height, total=None, progress=None):
+    """把 frames 编码为 videoname。
+
+    frames 为 (height, width, 3) 的 uint8 数组的迭代器。写入 ffmpeg 的管道满了时会阻塞，
+    所以渲染速度不会超过编码速度。视频先写入同目录下的临时文件，成功后才重命名为 videoname，
+    出错时结束 ffmpeg 并删除临时文件。每写入一帧调用一次 progress(已写入帧数, total)。返回写入的帧数。
+    """
+    videoname = Path(videoname)
+    videoname.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(
+        suffix=".part", prefix=f".{videoname.stem}-", dir=videoname.parent
+    )
+    os.close(fd)
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgb24",
+        "-s",
+        f"{width}x{height}",
+        "-r",
+        str(fps),
+        "-i",
+        "-",
+        # yuv420p 要求宽高为偶数
+        "-vf",
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-vcodec",
+        "libx264",
+        "-crf",
+        "25",
+        "-pix_fmt",
+        "yuv420p",
+        "-f",
+        "mp4",
+        tmpname,
+    ]
+    logger.info(f"cmd={' '.join(cmd)}")
+    count = 0
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=stderr)
+        try:
+            for frame in progressbar(frames, max_value=total):
+                if frame.shape != (height, width, 3):
+                    raise ValueError(f"帧大小 {frame.shape} 与 {(height, width, 3)} 不一致")
+                proc.stdin.write(frame.tobytes())
+                count += 1
+                if progress is not None:
+                    progress(count, total)
+            proc.stdin.close()
+            returncode = proc.wait()
+            if returncode != 0:
+                stderr.seek(0)
+                raise RuntimeError(
+                    f"ffmpeg 退出码 {returncode}：{stderr.read().decode(errors='replace')}"
+                )
+            os.replace(tmpname, videoname)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            if Path(tmpname).exists():
+                Path(tmpname).unlink()
+            raise
+    logger.info(f"共编码 {count} 帧到 {videoname}")
+    return count
+
+
+def concat(segments, videoname):
+    """不重新编码，把多个参数相同的视频按顺序拼接为 videoname。"""
+    videoname = Path(videoname)
+    videoname.parent.mkdir(parents=True, exist_ok=True)
+    fd, listname = tempfile.mkstemp(suffix=".txt", dir=videoname.parent)
+    with os.fdopen(fd, "w", encoding="utf8") as f:
+        for segment in segments:
+            f.write(f"file '{Path(segment).resolve().as_posix()}'\n")
+    fd, tmpname = tempfile.mkstemp(
+        suffix=".part", prefix=f".{videoname.stem}-", dir=videoname.parent
+    )
+    os.close(fd)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0"]
+    cmd += ["-i", listname, "-c", "copy", "-f", "mp4", tmpname]
+    logger.info(f"cmd={' '.join(cmd)}")
+    try:
+        result = subprocess.run(cmd, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"ffmpeg 退出码 {result.returncode}：{result.stderr.decode(errors='replace')}"
+            )
+        os.replace(tmpname, videoname)
+    finally:
+        os.unlink(listname)
+        if Path(tmpname).exists():
+            Path(tmpname).unlink()
+
+
+def evict(directory, max_bytes, keep=()):
+    """directory 中的 mp4 总大小超过 max_bytes 时，删除最久未使用的文件，keep 中的文件除外。"""
+    keep = {Path(p) for p in keep}
+    videos = sorted(Path(directory).glob("*.mp4"), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in videos)
+    for p in videos:
+        if total <= max_bytes:
+            break
+        if p in keep:
+            continue
+        total -= p.stat().st_size
+        p.unlink()
+        logger.info(f"{directory} 超过大小上限，删除 {p}")